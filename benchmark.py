@@ -0,0 +1,1150 @@
+import os
+import re
+import json
+import time
+import asyncio
+import threading
+import shutil
+import tempfile
+
+import numpy as np
+import tensorflow as tf
+from bert.tokenization import FullTokenizer
+
+from src.input_fn import train_eval_input_fn, predict_input_fn, create_predict_example
+from src.model_fn import BertMultiTask
+from src.params import Params
+from src.estimator import Estimator
+from src.ckpt_restore_hook import RestoreCheckpointHook
+from src.estimator_wrapper import (export_inference_checkpoint, export_numpy_weights,
+                                   quantize_checkpoint, WarmPredictor, ChineseNER,
+                                   ChineseWordSegment, MultiTaskAnnotator)
+from src.server import MicroBatcher, InferenceServer
+from src.postprocess import NERDecoder, CWSDecoder
+from src.numpy_bert import NumpyBert, WEIGHT_DIR_NAME
+from src.quantization import QuantizedNumpyBert
+from src.pruning import prune
+from src.utils import get_or_make_label_encoder, create_generator
+from src.top import SequenceLabel
+from src.viterbi import ViterbiDecoder, viterbi_decode
+
+flags = tf.flags
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string("bench", "label_smoothing",
+                    "Benchmark to run, see BENCHMARKS for available ones")
+
+flags.DEFINE_integer("repeat", 20,
+                     "number of timed runs for each benchmark case")
+
+flags.DEFINE_string("problem", "WeiboNER",
+                    "Problems to benchmark, same format as main.py")
+
+flags.DEFINE_string("teacher_dir", "",
+                    "Checkpoint dir of distillation teacher")
+
+flags.DEFINE_string("student_dir", "",
+                    "Checkpoint dir of distillation student")
+
+flags.DEFINE_string("layer_list", "2,4,6,8,10,12",
+                    "Encoder layer counts to benchmark, seperated by comma")
+
+flags.DEFINE_string("model_dir", "",
+                    "Checkpoint dir to benchmark")
+
+flags.DEFINE_string("threshold_list", "0.8,0.9,0.95,0.99",
+                    "Early exit thresholds to benchmark, seperated by comma")
+
+flags.DEFINE_string("seq_len_list", "128,256,512",
+                    "max_seq_len to benchmark, seperated by comma")
+
+flags.DEFINE_string("batch_size_list", "32,128,512",
+                    "Batch sizes to benchmark, seperated by comma")
+
+flags.DEFINE_float("target_f1", 0.9,
+                   "Target eval F1 Score of time to F1 benchmark")
+
+flags.DEFINE_integer("eval_every", 100,
+                     "Evaluate every n train steps in time to F1 benchmark")
+
+flags.DEFINE_string("concurrency_list", "1,8,32,128",
+                    "Numbers of concurrent clients of serve benchmark")
+
+flags.DEFINE_integer("max_batch_size", 32,
+                     "Max micro batch size of serve benchmark")
+
+flags.DEFINE_float("max_wait_ms", 5,
+                   "Max micro batch wait of serve benchmark")
+
+flags.DEFINE_string("prune_ratio_list", "0,0.25,0.5",
+                    "Ratios of heads and intermediate neurons to prune in prune benchmark")
+
+
+def _stacked_smooth_label(labels, num_classes, label_smoothing, max_seq_len):
+    """Label smoothing sampler that materializes the whole sample set.
+
+    Kept here as the reference for label_smoothing_benchmark.
+    """
+    true_labels = tf.stack(
+        [labels]*int(num_classes/label_smoothing), axis=-1)
+    single_label_set = tf.stack([tf.range(
+        num_classes)]*max_seq_len, axis=0)
+    batch_size_this_turn = tf.shape(true_labels)[0]
+    label_set = tf.broadcast_to(
+        input=single_label_set, shape=[batch_size_this_turn,
+                                       max_seq_len,
+                                       num_classes])
+    sample_set = tf.concat([true_labels, label_set], axis=-1)
+
+    dims = tf.shape(sample_set)
+    sample_set = tf.reshape(sample_set, shape=[-1, dims[-1]])
+
+    samples_index = tf.random_uniform(
+        shape=[tf.shape(sample_set)[0], 1], minval=0,
+        maxval=tf.shape(sample_set)[1], dtype=tf.int32)
+    flat_offsets = tf.reshape(
+        tf.range(0, tf.shape(sample_set)[0], dtype=tf.int32) * tf.shape(sample_set)[1], [-1, 1])
+    flat_index = tf.reshape(samples_index+flat_offsets, [-1])
+    sampled_label = tf.gather(
+        tf.reshape(sample_set, [-1]), flat_index)
+    return tf.reshape(sampled_label, dims[:-1])
+
+
+def _run_with_peak_memory(sess, fetch, repeat):
+    """Run fetch repeat times, return (mean seconds, peak bytes, last value)"""
+    run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+    run_metadata = tf.RunMetadata()
+    value = sess.run(fetch, options=run_options, run_metadata=run_metadata)
+    peak_bytes = 0
+    for dev_stats in run_metadata.step_stats.dev_stats:
+        for node_stats in dev_stats.node_stats:
+            for mem in node_stats.memory:
+                peak_bytes = max(peak_bytes, mem.peak_bytes)
+
+    start = time.time()
+    for _ in range(repeat):
+        value = sess.run(fetch)
+    return (time.time() - start) / repeat, peak_bytes, value
+
+
+def label_smoothing_benchmark(params, batch_size=32, class_num_list=(5, 10, 62)):
+    """Compare the stacked and the index based label smoothing sampler.
+
+    Reports time per call, peak allocation and the empirical probability
+    of keeping the true label, which should match
+    (num_copies + 1) / (num_copies + num_classes) for both samplers.
+    """
+    seq_tag = SequenceLabel(params)
+    print('|num_classes|sampler|ms/call|peak MB|P(true)|expected P(true)|')
+    print('|----------:|-------|------:|------:|------:|---------------:|')
+    for num_classes in class_num_list:
+        tf.reset_default_graph()
+        labels = tf.constant(np.random.randint(
+            0, num_classes, size=[batch_size, params.max_seq_len]), dtype=tf.int32)
+        samplers = {
+            'stacked': _stacked_smooth_label(
+                labels, num_classes, params.label_smoothing, params.max_seq_len),
+            'index': seq_tag.create_smooth_label(labels, num_classes)
+        }
+        num_copies = int(num_classes/params.label_smoothing)
+        expected = (num_copies + 1) / (num_copies + num_classes)
+        with tf.Session() as sess:
+            label_value = sess.run(labels)
+            for name, sampled in samplers.items():
+                sec, peak, value = _run_with_peak_memory(
+                    sess, sampled, FLAGS.repeat)
+                print('|%d|%s|%.3f|%.2f|%.4f|%.4f|' % (
+                    num_classes, name, sec*1000, peak/1024/1024,
+                    np.mean(value == label_value), expected))
+
+
+def viterbi_benchmark(params, num_classes=10, batch_size_list=(1, 16, 64, 256)):
+    """Compare tf.contrib.crf.crf_decode with numpy ViterbiDecoder.
+
+    Reports ms per batch of both decoders and the fraction of tags the
+    two agree on, which should be 1.0.
+    """
+    max_seq_len = params.max_seq_len
+    print('|batch_size|crf_decode ms|numpy ms|numpy threaded ms|agreement|')
+    print('|---------:|------------:|-------:|----------------:|--------:|')
+    for batch_size in batch_size_list:
+        tf.reset_default_graph()
+        logits_value = np.random.randn(
+            batch_size, max_seq_len, num_classes).astype(np.float32)
+        transition_value = np.random.randn(
+            num_classes, num_classes).astype(np.float32)
+        seq_length_value = np.random.randint(
+            1, max_seq_len + 1, size=[batch_size]).astype(np.int32)
+
+        logits = tf.placeholder(tf.float32, [None, max_seq_len, num_classes])
+        seq_length = tf.placeholder(tf.int32, [None])
+        tags, _ = tf.contrib.crf.crf_decode(
+            logits, tf.constant(transition_value), seq_length)
+        feed_dict = {logits: logits_value, seq_length: seq_length_value}
+
+        with tf.Session() as sess:
+            tf_tags = sess.run(tags, feed_dict=feed_dict)
+            start = time.time()
+            for _ in range(FLAGS.repeat):
+                sess.run(tags, feed_dict=feed_dict)
+            tf_sec = (time.time() - start) / FLAGS.repeat
+
+        result = []
+        for num_threads in [1, params.crf_decode_threads]:
+            decoder = ViterbiDecoder(
+                transition_value, num_threads=num_threads)
+            np_tags, _ = decoder.decode(logits_value, seq_length_value)
+            start = time.time()
+            for _ in range(FLAGS.repeat):
+                decoder.decode(logits_value, seq_length_value)
+            result.append((time.time() - start) / FLAGS.repeat)
+
+        mask = np.arange(max_seq_len)[None, :] < seq_length_value[:, None]
+        agreement = np.mean((np_tags == tf_tags)[mask])
+        print('|%d|%.2f|%.2f|%.2f|%.4f|' % (
+            batch_size, tf_sec*1000, result[0]*1000, result[1]*1000, agreement))
+
+
+def _load_params(problem, model_dir):
+    """Create params for an existing checkpoint dir, hparams are
+    restored from params.json if exists"""
+    params = Params()
+    params_path = os.path.join(model_dir, 'params.json')
+    if os.path.exists(params_path):
+        params.from_json(params_path)
+    base_dir, dir_name = os.path.split(model_dir)
+    params.assign_problem(problem, gpu=1, base_dir=base_dir, dir_name=dir_name)
+    return params
+
+
+def _create_estimator(params):
+    model = BertMultiTask(params=params)
+    model_fn = model.get_model_fn(warm_start=False)
+    run_config = tf.estimator.RunConfig(
+        log_step_count_steps=params.log_every_n_steps)
+    return Estimator(
+        model_fn,
+        model_dir=params.ckpt_dir,
+        params=params,
+        config=run_config)
+
+
+def _eval_and_time(params):
+    """Evaluate params.ckpt_dir on eval set, return (metrics, ms per example)"""
+    estimator = _create_estimator(params)
+
+    def input_fn(): return train_eval_input_fn(params, mode='eval')
+    eval_dict = estimator.evaluate(input_fn=input_fn)
+
+    num_examples = 0
+    start = time.time()
+    for _ in estimator.predict(input_fn=input_fn):
+        num_examples += 1
+    ms_per_example = (time.time() - start) * 1000 / max(num_examples, 1)
+    return eval_dict, ms_per_example
+
+
+def distillation_report(params):
+    """Latency and accuracy of distillation teacher vs student.
+
+    Use --teacher_dir and --student_dir to specify checkpoints and
+    --problem for problems to evaluate.
+    """
+    teacher_params = _load_params(FLAGS.problem, FLAGS.teacher_dir)
+    student_params = _load_params(FLAGS.problem, FLAGS.student_dir)
+    student_params.distillation = True
+
+    teacher_eval, teacher_ms = _eval_and_time(teacher_params)
+    student_eval, student_ms = _eval_and_time(student_params)
+
+    print('|metric|teacher (%d layers)|student (%d layers)|' % (
+        teacher_params.bert_config.num_hidden_layers,
+        student_params.student_num_hidden_layers))
+    print('|------|------:|------:|')
+    for metric in sorted(teacher_eval):
+        if metric == 'global_step' or metric not in student_eval:
+            continue
+        print('|%s|%.4f|%.4f|' % (
+            metric, teacher_eval[metric], student_eval[metric]))
+    print('|ms/example|%.2f|%.2f|' % (teacher_ms, student_ms))
+    print('|speedup|1.00|%.2f|' % (teacher_ms / student_ms))
+
+
+def encoder_layers_benchmark(params):
+    """Accuracy and latency of --problem fine-tuned with the first N
+    encoder layers, for N in --layer_list.
+
+    A model is fine-tuned for every N under tmp/<problems>_layer<N>_ckpt,
+    existing checkpoints are reused.
+    """
+    problem_list = sorted(re.split(r'[&|]', FLAGS.problem))
+    result = {}
+    for num_layers in [int(n) for n in FLAGS.layer_list.split(',')]:
+        tf.reset_default_graph()
+        params = Params()
+        params.problem_encoder_layers = {
+            problem: num_layers for problem in problem_list}
+        params.assign_problem(
+            FLAGS.problem, gpu=1, base_dir='tmp',
+            dir_name='%s_layer%d_ckpt' % ('_'.join(problem_list), num_layers))
+
+        estimator = _create_estimator(params)
+
+        def train_input_fn(): return train_eval_input_fn(params)
+        estimator.train(
+            train_input_fn, max_steps=params.train_steps,
+            hooks=[RestoreCheckpointHook(params)])
+
+        result[num_layers] = _eval_and_time(params)
+
+    metric_list = sorted([metric for metric in result[num_layers][0]
+                          if metric != 'global_step'])
+    print('|layers|%s|ms/example|' % '|'.join(metric_list))
+    print('|-----:|%s|---------:|' % '|'.join(['---:']*len(metric_list)))
+    for num_layers, (eval_dict, ms_per_example) in sorted(result.items()):
+        print('|%d|%s|%.2f|' % (
+            num_layers,
+            '|'.join(['%.4f' % eval_dict[metric] for metric in metric_list]),
+            ms_per_example))
+
+
+def _predict_and_time(params):
+    """Predict eval set of params.ckpt_dir, return (predictions, ms per example)"""
+    estimator = _create_estimator(params)
+
+    def input_fn(): return train_eval_input_fn(params, mode='eval')
+    start = time.time()
+    pred_list = list(estimator.predict(input_fn=input_fn))
+    ms_per_example = (time.time() - start) * 1000 / max(len(pred_list), 1)
+    return pred_list, ms_per_example
+
+
+def early_exit_benchmark(params):
+    """Average exit layer, latency and agreement with full depth
+    prediction of early exit, for thresholds in --threshold_list.
+
+    --model_dir should be trained with early_exit_layers.
+    """
+    params = _load_params(FLAGS.problem, FLAGS.model_dir)
+    if not params.early_exit_layers:
+        raise ValueError(
+            '%s is not trained with early_exit_layers' % FLAGS.model_dir)
+    problem_list = [problem for problem_dict in params.run_problem_list
+                    for problem in problem_dict]
+    early_exit_layers = params.early_exit_layers
+
+    params.early_exit_layers = []
+    full_pred, full_ms = _predict_and_time(params)
+    params.early_exit_layers = early_exit_layers
+
+    print('|threshold|avg exit layer|ms/example|latency saved|%s|' % '|'.join(
+        ['%s agreement' % problem for problem in problem_list]))
+    print('|--------:|-------------:|---------:|------------:|%s|' % '|'.join(
+        ['---:']*len(problem_list)))
+    print('|full|%d|%.2f|0.00%%|%s|' % (
+        params.bert_config.num_hidden_layers, full_ms,
+        '|'.join(['1.0000']*len(problem_list))))
+    for threshold in [float(t) for t in FLAGS.threshold_list.split(',')]:
+        tf.reset_default_graph()
+        params.early_exit_threshold = threshold
+        pred_list, ms_per_example = _predict_and_time(params)
+
+        agreement_list = []
+        for problem in problem_list:
+            agreement_list.append(np.mean([
+                np.all(np.argmax(p[problem], axis=-1) == np.argmax(f[problem], axis=-1))
+                if params.problem_type[problem] == 'cls'
+                else np.all(p[problem] == f[problem])
+                for p, f in zip(pred_list, full_pred)]))
+        print('|%.2f|%.2f|%.2f|%.2f%%|%s|' % (
+            threshold,
+            np.mean([p['exit_layer'] for p in pred_list]),
+            ms_per_example,
+            (1 - ms_per_example / full_ms) * 100,
+            '|'.join(['%.4f' % a for a in agreement_list])))
+
+
+def recompute_benchmark(params):
+    """Peak memory and step time of a bert forward and backward pass,
+    with and without recompute_grad, for max_seq_len in --seq_len_list.
+
+    Weights are randomly initialized, batch size is params.batch_size.
+    """
+    print('|max_seq_len|recompute_grad|peak MB|ms/step|')
+    print('|----------:|--------------|------:|------:|')
+    for max_seq_len in [int(l) for l in FLAGS.seq_len_list.split(',')]:
+        for recompute_grad in [False, True]:
+            tf.reset_default_graph()
+            params.max_seq_len = max_seq_len
+            params.recompute_grad = recompute_grad
+            shape = [params.batch_size, max_seq_len]
+            features = {
+                'input_ids': tf.random_uniform(
+                    shape, maxval=params.vocab_size, dtype=tf.int32),
+                'input_mask': tf.ones(shape, dtype=tf.int32),
+                'segment_ids': tf.zeros(shape, dtype=tf.int32)}
+            model = BertMultiTask(params=params)
+            hidden_feature = model.body(features, tf.estimator.ModeKeys.TRAIN)
+            loss = tf.reduce_mean(tf.square(hidden_feature['seq']))
+            grads = tf.gradients(loss, tf.trainable_variables())
+            train_op = tf.group(*[g for g in grads if g is not None])
+            max_bytes_in_use = tf.contrib.memory_stats.MaxBytesInUse()
+
+            with tf.Session() as sess:
+                sess.run(tf.global_variables_initializer())
+                sess.run(train_op)
+                start = time.time()
+                for _ in range(FLAGS.repeat):
+                    sess.run(train_op)
+                sec = (time.time() - start) / FLAGS.repeat
+                peak_bytes = sess.run(max_bytes_in_use)
+            print('|%d|%s|%.2f|%.2f|' % (
+                max_seq_len, recompute_grad, peak_bytes/1024/1024, sec*1000))
+
+
+def time_to_f1_benchmark(params):
+    """Train time and steps for --problem to reach --target_f1 on eval
+    set, with adam and lamb optimizer and batch sizes in --batch_size_list.
+
+    Training is interrupted every --eval_every steps for evaluation,
+    which restarts the input pipeline, so the train set should fit in
+    the shuffle buffer.
+    """
+    problem_list = sorted(re.split(r'[&|]', FLAGS.problem))
+    f1_key_list = ['%s_F1 Score' % problem for problem in problem_list]
+
+    print('|optimizer|batch_size|lr|steps|train sec|F1|')
+    print('|---------|---------:|--:|----:|--------:|--:|')
+    for optimizer in ['adam', 'lamb']:
+        for batch_size in [int(b) for b in FLAGS.batch_size_list.split(',')]:
+            tf.reset_default_graph()
+            params = Params()
+            params.optimizer = optimizer
+            params.batch_size = batch_size
+            params.assign_problem(
+                FLAGS.problem, gpu=1, base_dir='tmp',
+                dir_name='%s_%s_bs%d_ckpt' % (
+                    '_'.join(problem_list), optimizer, batch_size))
+            estimator = _create_estimator(params)
+
+            def train_input_fn(): return train_eval_input_fn(params)
+
+            def eval_input_fn(): return train_eval_input_fn(params, mode='eval')
+
+            train_sec = 0
+            step = 0
+            f1 = 0
+            while step < params.train_steps and f1 < FLAGS.target_f1:
+                step = min(step + FLAGS.eval_every, params.train_steps)
+                start = time.time()
+                estimator.train(
+                    train_input_fn, max_steps=step,
+                    hooks=[RestoreCheckpointHook(params)])
+                train_sec += time.time() - start
+                eval_dict = estimator.evaluate(input_fn=eval_input_fn)
+                f1 = min([eval_dict[k] for k in f1_key_list])
+            print('|%s|%d|%.2e|%d|%.1f|%.4f|' % (
+                optimizer, batch_size, params.lr, step, train_sec, f1))
+
+
+def _build_deterministic_train_step(params, input_value):
+    """Build a train step of bert on fixed inputs without dropout,
+    so graphs built with the same params give the same results.
+
+    Returns:
+        tuple -- (loss, train_op, tvars, number of apply_gradients ops)
+    """
+    tf.reset_default_graph()
+    tf.set_random_seed(0)
+    shape = list(input_value.shape)
+    features = {
+        'input_ids': tf.constant(input_value, dtype=tf.int32),
+        'input_mask': tf.ones(shape, dtype=tf.int32),
+        'segment_ids': tf.zeros(shape, dtype=tf.int32)}
+    model = BertMultiTask(params=params)
+    hidden_feature = model.body(features, tf.estimator.ModeKeys.EVAL)
+    loss = tf.reduce_mean(tf.square(hidden_feature['seq']))
+    tvars = tf.trainable_variables()
+    grads = tf.gradients(loss, tvars)
+    optimizer = model.create_optimizer(1e-3, 1000, 0)
+
+    num_ops = len(tf.get_default_graph().get_operations())
+    train_op = optimizer.apply_gradients(zip(grads, tvars))
+    num_apply_ops = len(
+        tf.get_default_graph().get_operations()) - num_ops
+    return loss, train_op, tvars, num_apply_ops
+
+
+def fused_adam_benchmark(params, num_steps=3):
+    """Op count, step time and difference of variables after num_steps
+    updates, of AdamWeightDecayOptimizer and FusedAdamWeightDecayOptimizer.
+
+    The same inputs and initial values are used for both, and
+    dropout is disabled, so max abs diff should be 0.
+    """
+    np.random.seed(0)
+    input_value = np.random.randint(
+        0, params.vocab_size, size=[params.batch_size, params.max_seq_len])
+
+    result = {}
+    for fused in [False, True]:
+        params.fused_optimizer = fused
+        _, train_op, tvars, num_apply_ops = _build_deterministic_train_step(
+            params, input_value)
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            for _ in range(num_steps):
+                sess.run(train_op)
+            var_value = sess.run(tvars)
+            start = time.time()
+            for _ in range(FLAGS.repeat):
+                sess.run(train_op)
+            sec = (time.time() - start) / FLAGS.repeat
+        result[fused] = (num_apply_ops, sec, var_value)
+
+    print('|optimizer|apply_gradients ops|ms/step|max abs diff|')
+    print('|---------|------------------:|------:|-----------:|')
+    for fused, name in [(False, 'AdamWeightDecay'), (True, 'FusedAdamWeightDecay')]:
+        num_apply_ops, sec, var_value = result[fused]
+        max_diff = max([np.max(np.abs(a - b))
+                        for a, b in zip(var_value, result[False][2])])
+        print('|%s|%d|%.2f|%.3e|' % (name, num_apply_ops, sec*1000, max_diff))
+
+
+def quantized_adam_benchmark(params, num_steps=20):
+    """Optimizer state memory, checkpoint size and loss after num_steps
+    updates, of float32 and 8 bit adam moments."""
+    np.random.seed(0)
+    input_value = np.random.randint(
+        0, params.vocab_size, size=[params.batch_size, params.max_seq_len])
+
+    print('|optimizer state|state MB|checkpoint MB|loss after %d steps|' % num_steps)
+    print('|---------------|-------:|------------:|------------------:|')
+    for quantize in [False, True]:
+        params.quantize_optimizer_state = quantize
+        loss, train_op, tvars, _ = _build_deterministic_train_step(
+            params, input_value)
+        tvar_names = set([v.op.name for v in tvars])
+        state_bytes = sum([
+            v.shape.num_elements() * v.dtype.base_dtype.size
+            for v in tf.global_variables()
+            if v.op.name not in tvar_names and v.shape.ndims])
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            for _ in range(num_steps):
+                loss_value, _ = sess.run([loss, train_op])
+            ckpt_dir = tempfile.mkdtemp()
+            tf.train.Saver().save(sess, os.path.join(ckpt_dir, 'model.ckpt'))
+        ckpt_bytes = sum([os.path.getsize(os.path.join(ckpt_dir, f))
+                          for f in os.listdir(ckpt_dir)])
+        shutil.rmtree(ckpt_dir)
+
+        print('|%s|%.2f|%.2f|%.6f|' % (
+            'int8 blockwise' if quantize else 'float32',
+            state_bytes/1024/1024, ckpt_bytes/1024/1024, loss_value))
+
+
+def _checkpoint_megabytes(model_dir):
+    checkpoint_path = tf.train.latest_checkpoint(model_dir)
+    data_files = tf.gfile.Glob(checkpoint_path + '.*')
+    return sum([os.path.getsize(f) for f in data_files]) / 1024 / 1024
+
+
+def export_benchmark(params):
+    """Checkpoint size, archive size and time to restore and predict the
+    first example, of --model_dir and its float32 and float16 inference
+    exports."""
+    params = _load_params(FLAGS.problem, FLAGS.model_dir)
+    export_root = tempfile.mkdtemp()
+
+    dir_list = [('training', params.ckpt_dir, None)]
+    for dtype in ['float32', 'float16']:
+        export_dir = os.path.join(export_root, dtype)
+        archive_path = export_inference_checkpoint(params, export_dir, dtype=dtype)
+        dir_list.append((dtype, export_dir, archive_path))
+
+    print('|checkpoint|checkpoint MB|archive MB|first prediction sec|')
+    print('|----------|------------:|---------:|-------------------:|')
+    for name, model_dir, archive_path in dir_list:
+        tf.reset_default_graph()
+        dir_params = Params()
+        dir_params.from_predict_dir(model_dir)
+        dir_params.max_seq_len = params.max_seq_len
+
+        def input_fn(): return predict_input_fn(
+            ['上海浦东开发与法制建设同步'], dir_params, mode='predict')
+        start = time.time()
+        next(_create_estimator(dir_params).predict(input_fn=input_fn))
+        sec = time.time() - start
+
+        archive_mb = os.path.getsize(archive_path) / 1024 / 1024 \
+            if archive_path is not None else float('nan')
+        print('|%s|%.1f|%.1f|%.2f|' % (
+            name, _checkpoint_megabytes(model_dir), archive_mb, sec))
+    shutil.rmtree(export_root)
+
+
+def warm_predict_benchmark(params, num_calls=10):
+    """Per call latency of Estimator.predict and WarmPredictor on
+    --model_dir, each call predicts batch sizes in --batch_size_list
+    of short sentences."""
+    params = Params()
+    params.from_predict_dir(FLAGS.model_dir)
+    sentence = '上海浦东开发与法制建设同步'
+
+    predictor = WarmPredictor(params, FLAGS.model_dir)
+    estimator = _create_estimator(params)
+
+    print('WarmPredictor cold start: %.2f sec' % predictor.cold_start_time)
+    print('|batch size|Estimator.predict ms/call|WarmPredictor ms/call|speedup|')
+    print('|---------:|------------------------:|--------------------:|------:|')
+    for batch_size in [int(b) for b in FLAGS.batch_size_list.split(',')]:
+        input_list = [sentence] * batch_size
+
+        def input_fn(): return predict_input_fn(
+            input_list, params, mode='predict')
+        start = time.time()
+        for _ in range(num_calls):
+            list(estimator.predict(input_fn=input_fn))
+        estimator_sec = (time.time() - start) / num_calls
+
+        # first call is excluded as warm up
+        predictor.predict(input_list)
+        start = time.time()
+        for _ in range(num_calls):
+            predictor.predict(input_list)
+        warm_sec = (time.time() - start) / num_calls
+
+        print('|%d|%.1f|%.1f|%.1f|' % (
+            batch_size, estimator_sec*1000, warm_sec*1000,
+            estimator_sec / warm_sec))
+    predictor.close()
+
+
+def sorted_predict_benchmark(params, num_docs=2000):
+    """Throughput of prediction on a mixed length corpus, with and
+    without sorting inputs by length, on --model_dir. Padded tokens per
+    real token are reported together with padding to max_seq_len."""
+    params = Params()
+    params.from_predict_dir(FLAGS.model_dir)
+    params.max_seq_len = 350
+    estimator = _create_estimator(params)
+
+    # mostly short sentences with a long tail, like tweets mixed with articles
+    rng = np.random.RandomState(0)
+    sentence = '上海浦东开发与法制建设同步，新区建设以来已批准外商投资项目。'
+    length_list = np.minimum(
+        np.exp(rng.uniform(np.log(5), np.log(2000), size=num_docs)).astype(int),
+        params.max_seq_len - 2)
+    corpus = [(sentence * (length // len(sentence) + 1))[:length]
+              for length in length_list]
+    seq_length = length_list + 2
+    batch_size = params.batch_size*2
+
+    def padded_tokens(sort):
+        length = np.sort(seq_length) if sort else seq_length
+        return sum([np.max(length[i:i+batch_size]) * len(length[i:i+batch_size])
+                    for i in range(0, len(length), batch_size)])
+
+    print('|batching|padded tokens / token|docs/sec|')
+    print('|--------|--------------------:|-------:|')
+    print('|pad to max_seq_len|%.2f|-|' % (
+        params.max_seq_len * num_docs / np.sum(seq_length)))
+    for sort in [False, True]:
+        params.predict_sort_by_length = sort
+
+        def input_fn(): return predict_input_fn(corpus, params, mode='predict')
+        start = time.time()
+        for _ in estimator.predict(input_fn=input_fn):
+            pass
+        sec = time.time() - start
+        print('|%s|%.2f|%.1f|' % (
+            'pad to batch, sorted' if sort else 'pad to batch',
+            padded_tokens(sort) / np.sum(seq_length), num_docs / sec))
+
+
+def cache_benchmark(params, num_requests=2000, num_distinct=500, call_size=32):
+    """Hit rate and latency of ChineseNER on --model_dir with and without
+    the result cache, on zipf distributed traffic of num_distinct texts
+    with leading and trailing noise."""
+    rng = np.random.RandomState(0)
+    sentence = '上海浦东开发与法制建设同步，新区建设以来已批准外商投资项目。'
+    distinct_list = [sentence[:rng.randint(5, len(sentence))] + str(ind)
+                     for ind in range(num_distinct)]
+    text_ind = np.minimum(rng.zipf(1.2, size=num_requests), num_distinct) - 1
+    traffic = [distinct_list[ind] + ' ' * rng.randint(0, 2) for ind in text_ind]
+
+    print('|cache size|hit rate|ms/call|docs/sec|')
+    print('|---------:|-------:|------:|-------:|')
+    for cache_size in [0, 100, 1000]:
+        tf.reset_default_graph()
+        model_params = Params()
+        model_params.predict_cache_size = cache_size
+        model = ChineseNER(model_params, FLAGS.model_dir, gpu=1, warm=True)
+        start = time.time()
+        for call_start in range(0, num_requests, call_size):
+            model.ner(traffic[call_start:call_start+call_size])
+        sec = time.time() - start
+        num_calls = (num_requests + call_size - 1) // call_size
+        print('|%d|%.3f|%.1f|%.1f|' % (
+            cache_size, model.cache_metrics().get('hit_rate', 0.0),
+            sec / num_calls * 1000, num_requests / sec))
+        model.warm_predictor.close()
+
+
+def multi_head_benchmark(params, num_docs=1000):
+    """Time to get CWS, NER and POS of the same texts from a CWS|NER|POS
+    checkpoint in --model_dir, with a predictor per problem vs one
+    MultiTaskAnnotator pass."""
+    rng = np.random.RandomState(0)
+    sentence = '上海浦东开发与法制建设同步，新区建设以来已批准外商投资项目。'
+    corpus = [sentence[:rng.randint(5, len(sentence))] for _ in range(num_docs)]
+
+    def new_params():
+        tf.reset_default_graph()
+        return Params()
+
+    # one pass per problem, POS has no dedicated predictor
+    ner_model = ChineseNER(new_params(), FLAGS.model_dir, gpu=1, warm=True)
+    cws_model = ChineseWordSegment(new_params(), FLAGS.model_dir, gpu=1, warm=True)
+    annotator = MultiTaskAnnotator(new_params(), FLAGS.model_dir, gpu=1, warm=True)
+
+    start = time.time()
+    ner_model.ner(corpus)
+    cws_model.cws(corpus)
+    annotator.predict(corpus)
+    separate_sec = time.time() - start
+
+    start = time.time()
+    annotator.annotate(corpus)
+    combined_sec = time.time() - start
+
+    print('|inference|encoder passes|docs/sec|')
+    print('|---------|-------------:|-------:|')
+    print('|predictor per problem|3|%.1f|' % (num_docs / separate_sec))
+    print('|MultiTaskAnnotator|1|%.1f|' % (num_docs / combined_sec))
+
+
+def _legacy_ner_decode(pred_list, label_encoder, tokenizer):
+    """Per example NER post processing before NERDecoder.
+
+    Kept here as the reference for postprocess_benchmark.
+    """
+    result_list = []
+    for p in pred_list:
+        tokens = tokenizer.convert_ids_to_tokens(p['input_ids'])
+        labels = label_encoder.inverse_transform(p['NER'])
+        ind_list = [ind for ind, char in enumerate(tokens)
+                    if char in ['[PAD]', '[CLS]', '[SEP]']]
+        tokens = [e for ie, e in enumerate(tokens) if ie not in ind_list]
+        labels = [e for ie, e in enumerate(labels) if ie not in ind_list]
+        merged_tokens, merged_labels = [], []
+        for token, label in zip(tokens, labels):
+            if label == 'O' or label[0] == 'B':
+                merged_tokens.append(token)
+                merged_labels.append(label if label == 'O' else label[2:])
+            else:
+                merged_tokens[-1] += token
+        result_list.append([(ent, ent_type) for ent, ent_type in zip(
+            merged_tokens, merged_labels) if ent_type != 'O'])
+    return result_list
+
+
+def _legacy_cws_decode(pred_list, label_encoder, tokenizer):
+    """Per example CWS post processing before CWSDecoder.
+
+    Kept here as the reference for postprocess_benchmark.
+    """
+    result_list = []
+    for p in pred_list:
+        tokens = tokenizer.convert_ids_to_tokens(p['input_ids'])
+        labels = label_encoder.inverse_transform(p['CWS'])
+        ind_list = [ind for ind, char in enumerate(tokens)
+                    if char in ['[PAD]', '[CLS]', '[SEP]']]
+        tokens = [e for ie, e in enumerate(tokens) if ie not in ind_list]
+        labels = [e for ie, e in enumerate(labels) if ie not in ind_list]
+        output_str = ''
+        for char, char_label in zip(tokens, labels):
+            if char_label in ['s', 'e']:
+                output_str += char + ' '
+            else:
+                output_str += char
+        result_list.append(output_str)
+    return result_list
+
+
+def _synthetic_predictions(problem, label_encoder, tokenizer, num_examples, max_seq_len, rng):
+    """Padded predictions of random chars and labels, no I tag right
+    after [CLS] so the legacy merge does not fail"""
+    label_ids = np.array([ind for ind, label in sorted(label_encoder.decode_dict.items())
+                          if label != '[PAD]'])
+    outside_id = label_encoder.encode_dict.get('O', label_ids[0])
+    vocab_ids = np.array([ind for token, ind in tokenizer.vocab.items()
+                          if len(token) == 1])
+    pred_list = []
+    for _ in range(num_examples):
+        length = rng.randint(5, max_seq_len - 1)
+        input_ids = np.zeros(max_seq_len, dtype=np.int64)
+        input_ids[0] = tokenizer.vocab['[CLS]']
+        input_ids[1:1+length] = rng.choice(vocab_ids, size=length)
+        input_ids[1+length] = tokenizer.vocab['[SEP]']
+        labels = rng.choice(label_ids, size=max_seq_len)
+        if label_encoder.decode_dict[labels[1]][0] == 'I':
+            labels[1] = outside_id
+        pred_list.append({'input_ids': input_ids, problem: labels})
+    return pred_list
+
+
+def postprocess_benchmark(params, num_examples=10000, max_seq_len=128):
+    """Examples/sec of NER and CWS post processing of num_examples
+    synthetic predictions, per example loop vs NERDecoder and CWSDecoder.
+    Label encoders and vocab are read from --model_dir, no model is run."""
+    params.from_predict_dir(FLAGS.model_dir)
+    tokenizer = FullTokenizer(params.vocab_file)
+    rng = np.random.RandomState(0)
+
+    print('|problem|post processing|examples/sec|')
+    print('|-------|---------------|-----------:|')
+    for problem, legacy_fn, decoder_class in [
+            ('NER', _legacy_ner_decode, NERDecoder),
+            ('CWS', _legacy_cws_decode, CWSDecoder)]:
+        label_encoder = get_or_make_label_encoder(params, problem, 'predict')
+        pred_list = _synthetic_predictions(
+            problem, label_encoder, tokenizer, num_examples, max_seq_len, rng)
+        doc_list = [''] * num_examples
+
+        start = time.time()
+        legacy_result = legacy_fn(pred_list, label_encoder, tokenizer)
+        legacy_sec = time.time() - start
+
+        decoder = decoder_class(label_encoder, tokenizer)
+        start = time.time()
+        result = decoder.decode(pred_list, problem, doc_list)
+        sec = time.time() - start
+
+        assert result == legacy_result, '%s decoder does not match legacy' % problem
+        print('|%s|per example|%.1f|' % (problem, num_examples / legacy_sec))
+        print('|%s|%s|%.1f|' % (problem, decoder_class.__name__, num_examples / sec))
+
+
+def numpy_bert_benchmark(params, num_docs=512):
+    """Startup time, docs/sec and output difference of NumpyBert vs
+    WarmPredictor on --model_dir, on mixed length sentences. seq_tag
+    logits and cls probabilities are compared, and viterbi tags of
+    NumpyBert against tags decoded from tensorflow logits."""
+    params = Params()
+    params.from_predict_dir(FLAGS.model_dir)
+    params.crf_decode_on_host = True
+    weight_dir = export_numpy_weights(params)
+    rng = np.random.RandomState(0)
+    sentence = '上海浦东开发与法制建设同步，新区建设以来已批准外商投资项目。'
+    corpus = [sentence * rng.randint(1, 4) for _ in range(num_docs)]
+    batch_size = params.batch_size*2
+
+    predictor = WarmPredictor(params, FLAGS.model_dir)
+    start = time.time()
+    engine = NumpyBert(weight_dir)
+    engine_start_sec = time.time() - start
+    example_list = [create_predict_example(doc, predictor.tokenizer, params)
+                    for doc in corpus]
+
+    # first call is excluded as warm up
+    predictor.predict(example_list[:batch_size])
+    start = time.time()
+    tf_pred = predictor.predict(example_list)
+    tf_sec = time.time() - start
+    engine.predict(example_list[:batch_size], batch_size=batch_size)
+    start = time.time()
+    engine_pred = engine.predict(example_list, batch_size=batch_size)
+    engine_sec = time.time() - start
+    engine_logits = engine.predict(
+        example_list, batch_size=batch_size, return_logits=True)
+
+    print('|engine|startup sec|docs/sec|')
+    print('|------|----------:|-------:|')
+    print('|WarmPredictor|%.2f|%.1f|' % (predictor.cold_start_time, num_docs / tf_sec))
+    print('|NumpyBert|%.2f|%.1f|' % (engine_start_sec, num_docs / engine_sec))
+
+    print('|problem|max abs diff|tag agreement|')
+    print('|-------|-----------:|------------:|')
+    length_list = [sum(example['input_mask']) for example in example_list]
+    for problem, head in engine.head_dict.items():
+        if head['type'] == 'cls':
+            max_diff = max([np.max(np.abs(t[problem] - e[problem]))
+                            for t, e in zip(tf_pred, engine_pred)])
+            print('|%s|%.2e|-|' % (problem, max_diff))
+            continue
+        transition = engine.weights[head['scope'] + '/crf_transition']
+        max_diff = 0.0
+        num_same = 0
+        for t, e, l, n in zip(tf_pred, engine_pred, engine_logits, length_list):
+            max_diff = max(max_diff, np.max(np.abs(t[problem][:n] - l[problem][:n])))
+            tf_tags, _ = viterbi_decode(t[problem][None, :n], transition, np.array([n]))
+            num_same += np.sum(tf_tags[0] == e[problem][:n])
+        print('|%s|%.2e|%.4f|' % (problem, max_diff, num_same / sum(length_list)))
+    predictor.close()
+
+
+def _weight_megabytes(weight_dir):
+    return sum([os.path.getsize(os.path.join(weight_dir, f))
+                for f in os.listdir(weight_dir) if f.endswith('.npy')]) / 1024**2
+
+
+def quantize_benchmark(params, num_calibration=512):
+    """Accuracy and latency of float32 NumpyBert vs int8 QuantizedNumpyBert
+    on the eval set of --problem, with the checkpoint in --model_dir.
+    seq_tag accuracy is over tokens of input_mask, same as eval metrics
+    of SequenceLabel. Agreement is the share of predictions where the
+    int8 engine matches the float32 one. The int8 engine runs int8
+    values through float32 matmul, so it is not faster than float32,
+    see QuantizedNumpyBert."""
+    params = _load_params(FLAGS.problem, FLAGS.model_dir)
+    quant_dir = quantize_checkpoint(params, num_examples=num_calibration)
+    engine_dict = {
+        'float32': NumpyBert.from_checkpoint(params.ckpt_dir),
+        'int8': QuantizedNumpyBert(quant_dir)}
+    example_list = list(create_generator(params, 'eval', epoch=1))
+    batch_size = params.batch_size
+
+    pred_dict = {}
+    print('|weights|MB|docs/sec|')
+    print('|-------|--:|-------:|')
+    for name, engine in engine_dict.items():
+        # first batch is excluded as warm up
+        engine.predict(example_list[:batch_size], batch_size=batch_size)
+        start = time.time()
+        pred_dict[name] = engine.predict(example_list, batch_size=batch_size)
+        sec = time.time() - start
+        weight_dir = quant_dir if name == 'int8' else \
+            os.path.join(params.ckpt_dir, WEIGHT_DIR_NAME)
+        print('|%s|%.1f|%.1f|' % (
+            name, _weight_megabytes(weight_dir), len(example_list) / sec))
+    print('int8 values are multiplied by float32 matmul, int8 is expected '
+          'to be slower than float32. MB is size on disk, both take the '
+          'same memory at prediction.')
+
+    print('|problem|float32 accuracy|int8 accuracy|agreement|')
+    print('|-------|---------------:|------------:|--------:|')
+    for problem, head in engine_dict['float32'].head_dict.items():
+        num_correct = {name: 0 for name in pred_dict}
+        num_same = 0
+        total = 0
+        for ind, example in enumerate(example_list):
+            if not example['%s_loss_multiplier' % problem]:
+                continue
+            label = np.array(example['%s_label_ids' % problem])
+            pred = {}
+            if head['type'] == 'seq_tag':
+                seq_length = int(np.sum(example['input_mask']))
+                label = label[:seq_length]
+                for name in pred_dict:
+                    pred[name] = pred_dict[name][ind][problem][:seq_length]
+            else:
+                for name in pred_dict:
+                    pred[name] = np.argmax(pred_dict[name][ind][problem])
+            for name in pred_dict:
+                num_correct[name] += np.sum(pred[name] == label)
+            num_same += np.sum(pred['float32'] == pred['int8'])
+            total += np.size(label)
+        total = max(total, 1)
+        print('|%s|%.4f|%.4f|%.4f|' % (
+            problem, num_correct['float32'] / total, num_correct['int8'] / total,
+            num_same / total))
+
+
+def prune_benchmark(params):
+    """Accuracy, size and latency of --model_dir pruned by each ratio of
+    --prune_ratio_list and fine-tuned for one epoch. The same ratio is
+    used for heads and intermediate neurons, ratio 0 is the unpruned
+    checkpoint. Pruned models are written to <model_dir>_pruned<ratio>."""
+    params = _load_params(FLAGS.problem, FLAGS.model_dir)
+    bert_config = params.bert_config
+    num_layers = bert_config.num_hidden_layers
+
+    result = {}
+    for ratio in [float(r) for r in FLAGS.prune_ratio_list.split(',')]:
+        tf.reset_default_graph()
+        if ratio == 0:
+            run_params = params
+        else:
+            run_params = prune(
+                params, '%s_pruned%g' % (FLAGS.model_dir.rstrip('/'), ratio),
+                ratio, ratio)
+        tf.reset_default_graph()
+        config_dict = run_params.bert_config_dict
+        num_heads = sum(config_dict.get('layer_num_attention_heads') or
+                        [bert_config.num_attention_heads] * num_layers)
+        num_neurons = sum(config_dict.get('layer_intermediate_size') or
+                          [bert_config.intermediate_size] * num_layers)
+        eval_dict, ms_per_example = _eval_and_time(run_params)
+        result[ratio] = (num_heads, num_neurons,
+                         _checkpoint_megabytes(run_params.ckpt_dir),
+                         eval_dict, ms_per_example)
+
+    metric_list = sorted([metric for metric in eval_dict if metric != 'global_step'])
+    print('|ratio|heads|neurons|checkpoint MB|%s|ms/example|' % '|'.join(metric_list))
+    print('|----:|----:|------:|------------:|%s|---------:|' % '|'.join(
+        ['---:']*len(metric_list)))
+    for ratio, (num_heads, num_neurons, megabytes, eval_dict, ms_per_example) in sorted(
+            result.items()):
+        print('|%g|%d|%d|%.1f|%s|%.2f|' % (
+            ratio, num_heads, num_neurons, megabytes,
+            '|'.join(['%.4f' % eval_dict[metric] for metric in metric_list]),
+            ms_per_example))
+
+
+def xla_benchmark(params, num_warmup_steps=3):
+    """CPU step time of train and predict graphs of --problem, with and
+    without XLA JIT. The first num_warmup_steps steps, where clusters
+    are compiled, are timed separately from the --repeat timed steps."""
+    params.assign_problem(FLAGS.problem, gpu=1, base_dir=tempfile.mkdtemp())
+    session_config = tf.ConfigProto(device_count={'GPU': 0})
+
+    print('|mode|xla|warm up sec|ms/step|')
+    print('|----|---|----------:|------:|')
+    for mode in [tf.estimator.ModeKeys.TRAIN, tf.estimator.ModeKeys.PREDICT]:
+        for xla_jit in [False, True]:
+            tf.reset_default_graph()
+            params.xla_jit = xla_jit
+            features = train_eval_input_fn(params).make_one_shot_iterator().get_next()
+            model = BertMultiTask(params=params)
+            spec = model.get_model_fn(warm_start=False)(
+                features, None, mode, params)
+            fetch = spec.train_op if mode == tf.estimator.ModeKeys.TRAIN \
+                else spec.predictions
+
+            with tf.Session(config=session_config) as sess:
+                sess.run([tf.global_variables_initializer(),
+                          tf.local_variables_initializer(), tf.tables_initializer()])
+                start = time.time()
+                for _ in range(num_warmup_steps):
+                    sess.run(fetch)
+                warmup_sec = time.time() - start
+                start = time.time()
+                for _ in range(FLAGS.repeat):
+                    sess.run(fetch)
+                sec = (time.time() - start) / FLAGS.repeat
+            print('|%s|%s|%.1f|%.2f|' % (mode, xla_jit, warmup_sec, sec*1000))
+
+
+async def _http_request(reader, writer, method, path, body=None):
+    body = json.dumps(body, ensure_ascii=False).encode('utf8') if body is not None else b''
+    writer.write(('%s %s HTTP/1.1\r\nContent-Length: %d\r\n\r\n' % (
+        method, path, len(body))).encode('latin-1') + body)
+    status = int((await reader.readline()).split()[1])
+    content_length = 0
+    while True:
+        line = await reader.readline()
+        if line == b'\r\n':
+            break
+        key, value = line.decode('latin-1').split(':', 1)
+        if key.lower() == 'content-length':
+            content_length = int(value)
+    return status, json.loads((await reader.readexactly(content_length)).decode('utf8'))
+
+
+async def _request_metrics(port):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    result = await _http_request(reader, writer, 'GET', '/metrics')
+    writer.close()
+    return result
+
+
+async def _load_client(port, text, num_requests, latency_list):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    num_rejected = 0
+    for _ in range(num_requests):
+        start = time.time()
+        status, _ = await _http_request(reader, writer, 'POST', '/predict', {'text': text})
+        if status == 503:
+            num_rejected += 1
+        else:
+            latency_list.append(time.time() - start)
+    writer.close()
+    return num_rejected
+
+
+def serve_benchmark(params, num_requests=50):
+    """Throughput and client side latency of a local micro batching
+    server of ChineseNER on --model_dir, for numbers of concurrent clients
+    in --concurrency_list. Each client sends num_requests sequentially."""
+    model = ChineseNER(params, FLAGS.model_dir, gpu=1, warm=True)
+    text = '上海浦东开发与法制建设同步'
+
+    # server runs in its own thread and event loop, as a separate process would
+    server_loop = asyncio.new_event_loop()
+    server_started = threading.Event()
+
+    def run_server():
+        asyncio.set_event_loop(server_loop)
+        batcher = MicroBatcher(
+            model.ner, max_batch_size=FLAGS.max_batch_size,
+            max_wait_ms=FLAGS.max_wait_ms)
+        run_server.server = InferenceServer(batcher, port=0)
+        server_loop.run_until_complete(run_server.server.start())
+        server_started.set()
+        server_loop.run_forever()
+    threading.Thread(target=run_server, daemon=True).start()
+    server_started.wait()
+    port = run_server.server.port
+
+    loop = asyncio.get_event_loop()
+    # warm up
+    loop.run_until_complete(_load_client(port, text, 5, []))
+
+    print('|clients|requests/sec|p50 ms|p99 ms|rejected|mean batch size|')
+    print('|------:|-----------:|-----:|-----:|-------:|--------------:|')
+    for concurrency in [int(c) for c in FLAGS.concurrency_list.split(',')]:
+        latency_list = []
+        _, before = loop.run_until_complete(_request_metrics(port))
+        start = time.time()
+        num_rejected = sum(loop.run_until_complete(asyncio.gather(*[
+            _load_client(port, text, num_requests, latency_list)
+            for _ in range(concurrency)])))
+        sec = time.time() - start
+        _, after = loop.run_until_complete(_request_metrics(port))
+        mean_batch_size = (after['num_requests'] - before['num_requests']) / \
+            max(after['num_batches'] - before['num_batches'], 1)
+        print('|%d|%.1f|%.1f|%.1f|%d|%.1f|' % (
+            concurrency, len(latency_list) / sec,
+            np.percentile(latency_list, 50) * 1000,
+            np.percentile(latency_list, 99) * 1000,
+            num_rejected, mean_batch_size))
+    server_loop.call_soon_threadsafe(server_loop.stop)
+
+
+BENCHMARKS = {
+    'label_smoothing': label_smoothing_benchmark,
+    'viterbi': viterbi_benchmark,
+    'distillation': distillation_report,
+    'encoder_layers': encoder_layers_benchmark,
+    'early_exit': early_exit_benchmark,
+    'recompute': recompute_benchmark,
+    'time_to_f1': time_to_f1_benchmark,
+    'fused_adam': fused_adam_benchmark,
+    'quantized_adam': quantized_adam_benchmark,
+    'export': export_benchmark,
+    'warm_predict': warm_predict_benchmark,
+    'serve': serve_benchmark,
+    'sorted_predict': sorted_predict_benchmark,
+    'cache': cache_benchmark,
+    'multi_head': multi_head_benchmark,
+    'postprocess': postprocess_benchmark,
+    'numpy_bert': numpy_bert_benchmark,
+    'quantize': quantize_benchmark,
+    'prune': prune_benchmark,
+    'xla': xla_benchmark,
+}
+
+
+def main(_):
+    params = Params()
+    BENCHMARKS[FLAGS.bench](params)
+
+
+if __name__ == '__main__':
+    tf.logging.set_verbosity(tf.logging.INFO)
+    tf.app.run()
@@ -8,6 +8,13 @@ from src.model_fn import BertMultiTask
 from src.params import Params
 from src.estimator import Estimator
 from src.ckpt_restore_hook import RestoreCheckpointHook
+from src.hooks import StepTimeHook
+from src.estimator_wrapper import (dump_teacher_logits, export_inference_checkpoint,
+                                   export_numpy_weights, quantize_checkpoint, ChineseNER,
+                                   ChineseWordSegment, MultiTaskAnnotator)
+from src.server import serve
+from src.bulk_annotate import bulk_annotate
+from src.pruning import prune
 
 flags = tf.flags
 
@@ -25,6 +32,116 @@ flags.DEFINE_integer("gpu", 2,
 flags.DEFINE_string("model_dir", "",
                     "Model dir. If not specified, will use problem_name + _ckpt")
 
+flags.DEFINE_string("teacher_checkpoint", "",
+                    "If specified, distill the teacher checkpoint into a student")
+
+flags.DEFINE_integer("student_layers", 4,
+                     "number of hidden layers of distillation student")
+
+flags.DEFINE_string("teacher_logits_dir", "",
+                    "Teacher logits store. With schedule dump_teacher, write the "
+                    "outputs of model_dir to it, with schedule train, distill from it")
+
+flags.DEFINE_string("encoder_layers", "",
+                    "Number of encoder layers used by each problem, "
+                    "e.g. WeiboNER:6,WeiboSegment:4")
+
+flags.DEFINE_string("early_exit_layers", "",
+                    "Encoder layers to attach early exit heads, e.g. 4,8")
+
+flags.DEFINE_string("optimizer", "adam",
+                    "adam or lamb, lamb is recommended for large batch size")
+
+flags.DEFINE_bool("fused_optimizer", False,
+                  "Update all variables of adam in a few bulk ops")
+
+flags.DEFINE_bool("quantize_optimizer_state", False,
+                  "Store adam moments as 8 bit integers")
+
+flags.DEFINE_integer("batch_size", 32,
+                     "batch size per gpu")
+
+flags.DEFINE_integer("max_seq_len", 128,
+                     "max sequence length of training")
+
+flags.DEFINE_integer("train_window_stride", 0,
+                     "If positive, split long seq_tag training examples into "
+                     "windows starting every this many tokens instead of truncating")
+
+flags.DEFINE_bool("recompute_grad", False,
+                  "Recompute activations inside encoder layers in backward "
+                  "pass to train long sequences in less memory")
+
+flags.DEFINE_bool("xla_jit", False,
+                  "Compile encoder and heads with XLA JIT in train, eval and predict")
+
+flags.DEFINE_string("layer_freeze_schedule", "",
+                    "step:num_frozen_layers seperated by comma, "
+                    "e.g. 0:8,1000:4,2000:0")
+
+flags.DEFINE_string("export_dir", "",
+                    "With schedule export, write inference only checkpoint "
+                    "of model_dir to it. Defaults to model_dir + _export. "
+                    "With schedule export_numpy, write NumpyBert weights to it. "
+                    "Defaults to model_dir/numpy_weights. With schedule quantize, "
+                    "write int8 weights to it. Defaults to model_dir/numpy_weights_int8. "
+                    "With schedule prune, write fine-tuned pruned model to it. "
+                    "Defaults to model_dir + _pruned")
+
+flags.DEFINE_string("export_dtype", "float32",
+                    "float32 or float16, dtype of exported float variables")
+
+flags.DEFINE_integer("calibration_size", 512,
+                     "Number of eval examples to calibrate activation ranges "
+                     "in schedule quantize")
+
+flags.DEFINE_float("head_prune_ratio", 0.25,
+                   "Ratio of attention heads to prune in schedule prune")
+
+flags.DEFINE_float("ffn_prune_ratio", 0.25,
+                   "Ratio of intermediate neurons of each layer to prune in schedule prune")
+
+flags.DEFINE_float("prune_finetune_epoch", 1,
+                   "Epochs to fine-tune the pruned model in schedule prune")
+
+flags.DEFINE_integer("port", 8000,
+                     "Port of schedule serve")
+
+flags.DEFINE_integer("max_batch_size", 32,
+                     "Max number of requests in a micro batch of schedule serve")
+
+flags.DEFINE_float("max_wait_ms", 5,
+                   "Max time a micro batch waits for more requests in schedule serve")
+
+flags.DEFINE_integer("max_queue_size", 1024,
+                     "Requests are rejected with 503 when this many are waiting")
+
+flags.DEFINE_integer("predict_cache_size", 0,
+                     "Number of results cached for repeated inputs in schedule serve")
+
+flags.DEFINE_string("input_file", "",
+                    "Input of schedule annotate, a document per line")
+
+flags.DEFINE_string("output_file", "",
+                    "JSONL output of schedule annotate")
+
+flags.DEFINE_integer("num_workers", 1,
+                     "Number of worker processes of schedule annotate")
+
+flags.DEFINE_integer("chunk_size", 1000,
+                     "Lines annotated between two progress records in schedule annotate")
+
+
+def create_annotate_fn(problem, model_dir):
+    """Annotate function of problem for schedule annotate,
+    runs in worker processes"""
+    params = Params()
+    if problem == 'NER':
+        return ChineseNER(params, model_dir, gpu=1, warm=True).ner
+    if problem == 'CWS':
+        return ChineseWordSegment(params, model_dir, gpu=1, warm=True).cws
+    return MultiTaskAnnotator(params, model_dir, gpu=1, warm=True, problem=problem).annotate
+
 
 def main(_):
 
@@ -32,17 +149,102 @@ def main(_):
         os.mkdir('tmp')
 
     if FLAGS.model_dir:
-        base_dir, dir_name = os.path.split(FLAGS.model)
+        base_dir, dir_name = os.path.split(FLAGS.model_dir)
     else:
         base_dir, dir_name = None, None
 
     params = Params()
+    if FLAGS.teacher_checkpoint:
+        params.distillation = True
+        params.teacher_checkpoint = FLAGS.teacher_checkpoint
+        params.student_num_hidden_layers = FLAGS.student_layers
+    if FLAGS.teacher_logits_dir and FLAGS.schedule == 'train':
+        params.distillation = True
+        params.teacher_logits_dir = FLAGS.teacher_logits_dir
+        params.student_num_hidden_layers = FLAGS.student_layers
+    if FLAGS.encoder_layers:
+        for problem_layers in FLAGS.encoder_layers.split(','):
+            problem, num_layers = problem_layers.split(':')
+            params.problem_encoder_layers[problem] = int(num_layers)
+    params.optimizer = FLAGS.optimizer
+    params.fused_optimizer = FLAGS.fused_optimizer
+    params.quantize_optimizer_state = FLAGS.quantize_optimizer_state
+    params.batch_size = FLAGS.batch_size
+    params.max_seq_len = FLAGS.max_seq_len
+    params.recompute_grad = FLAGS.recompute_grad
+    params.xla_jit = FLAGS.xla_jit
+    if FLAGS.train_window_stride > 0:
+        params.train_window_stride = FLAGS.train_window_stride
+    if FLAGS.layer_freeze_schedule:
+        params.layer_freeze_schedule = [
+            [int(x) for x in phase.split(':')]
+            for phase in FLAGS.layer_freeze_schedule.split(',')]
+    if FLAGS.early_exit_layers:
+        params.early_exit_layers = [
+            int(num_layers) for num_layers in FLAGS.early_exit_layers.split(',')]
     params.assign_problem(FLAGS.problem, gpu=int(FLAGS.gpu),
                           base_dir=base_dir, dir_name=dir_name)
 
     tf.logging.info('Checkpoint dir: %s' % params.ckpt_dir)
     time.sleep(3)
 
+    if FLAGS.schedule == 'dump_teacher':
+        dump_teacher_logits(params, FLAGS.teacher_logits_dir)
+        return
+
+    if FLAGS.schedule == 'serve':
+        params.predict_cache_size = FLAGS.predict_cache_size
+        if FLAGS.problem == 'NER':
+            predict_model = ChineseNER(params, params.ckpt_dir, gpu=1, warm=True)
+            predict_fn = predict_model.ner
+        elif FLAGS.problem == 'CWS':
+            predict_model = ChineseWordSegment(
+                params, params.ckpt_dir, gpu=1, warm=True)
+            predict_fn = predict_model.cws
+        else:
+            raise ValueError('Schedule serve supports NER and CWS, got %s' % FLAGS.problem)
+        serve(predict_fn, port=FLAGS.port, max_batch_size=FLAGS.max_batch_size,
+              max_wait_ms=FLAGS.max_wait_ms, max_queue_size=FLAGS.max_queue_size,
+              metrics_fn=predict_model.cache_metrics)
+        return
+
+    if FLAGS.schedule == 'annotate':
+        bulk_annotate(
+            create_annotate_fn, (FLAGS.problem, params.ckpt_dir),
+            FLAGS.input_file, FLAGS.output_file, num_workers=FLAGS.num_workers,
+            chunk_size=FLAGS.chunk_size, gpu=int(FLAGS.gpu))
+        return
+
+    if FLAGS.schedule == 'export':
+        export_dir = FLAGS.export_dir if FLAGS.export_dir else params.ckpt_dir + '_export'
+        export_inference_checkpoint(params, export_dir, dtype=FLAGS.export_dtype)
+        return
+
+    if FLAGS.schedule == 'export_numpy':
+        # weights for NumpyBert, defaults to model_dir/numpy_weights
+        export_numpy_weights(params, FLAGS.export_dir if FLAGS.export_dir else None)
+        return
+
+    if FLAGS.schedule == 'quantize':
+        # int8 weights for QuantizedNumpyBert, defaults to model_dir/numpy_weights_int8
+        quantize_checkpoint(params, FLAGS.export_dir if FLAGS.export_dir else None,
+                            num_examples=FLAGS.calibration_size)
+        return
+
+    if FLAGS.schedule == 'prune':
+        # pruned init checkpoint in <export_dir>/pruned_init, fine-tuned in export_dir
+        export_dir = FLAGS.export_dir if FLAGS.export_dir else params.ckpt_dir + '_pruned'
+        pruned_params = prune(
+            params, export_dir, FLAGS.head_prune_ratio, FLAGS.ffn_prune_ratio,
+            finetune_epoch=FLAGS.prune_finetune_epoch)
+        estimator = Estimator(
+            BertMultiTask(params=pruned_params).get_model_fn(warm_start=False),
+            model_dir=pruned_params.ckpt_dir, params=pruned_params)
+
+        def input_fn(): return train_eval_input_fn(pruned_params, mode='eval')
+        estimator.evaluate(input_fn=input_fn)
+        return
+
     model = BertMultiTask(params=params)
     model_fn = model.get_model_fn(warm_start=False)
 
@@ -68,8 +270,28 @@ def main(_):
         train_hook = RestoreCheckpointHook(params)
 
         def train_input_fn(): return train_eval_input_fn(params)
-        estimator.train(
-            train_input_fn, max_steps=params.train_steps, hooks=[train_hook])
+        if params.layer_freeze_schedule:
+            # graph is rebuilt for every phase since frozen variables
+            # are excluded at graph construction
+            phase_time_list = []
+            for start_step, end_step, num_frozen_layers in params.layer_freeze_phases:
+                model.num_frozen_layers = num_frozen_layers
+                step_time_hook = StepTimeHook(
+                    'Phase %d-%d, %d frozen layers' % (
+                        start_step, end_step, num_frozen_layers))
+                estimator.train(
+                    train_input_fn, max_steps=end_step,
+                    hooks=[train_hook, step_time_hook])
+                phase_time_list.append(
+                    (start_step, end_step, num_frozen_layers,
+                     step_time_hook.mean_step_time))
+            for phase_time in phase_time_list:
+                tf.logging.info(
+                    'Phase %d-%d, %d frozen layers: %.2f ms/step' % (
+                        phase_time[:3] + (phase_time[3]*1000,)))
+        else:
+            estimator.train(
+                train_input_fn, max_steps=params.train_steps, hooks=[train_hook])
 
         def input_fn(): return train_eval_input_fn(params, mode='eval')
         estimator.evaluate(input_fn=input_fn)
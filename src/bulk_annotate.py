@@ -0,0 +1,173 @@
+import os
+import json
+import heapq
+import multiprocessing
+
+import tensorflow as tf
+
+
+def get_shard_path(output_path, shard_index, num_shards):
+    return '%s.shard-%d-of-%d' % (output_path, shard_index, num_shards)
+
+
+def load_progress(progress_path):
+    """Progress of a shard, see annotate_shard
+
+    Returns:
+        dict -- input_offset, output_offset and num_lines,
+            all 0 if not started
+    """
+    if not os.path.exists(progress_path):
+        return {'input_offset': 0, 'output_offset': 0, 'num_lines': 0}
+    with open(progress_path, 'r', encoding='utf8') as f:
+        return json.load(f)
+
+
+def save_progress(progress_path, progress):
+    # write then rename, so an interrupted write leaves the old progress
+    tmp_path = progress_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf8') as f:
+        json.dump(progress, f)
+    os.replace(tmp_path, progress_path)
+
+
+def iter_shard_chunks(input_path, input_offset, line_no, shard_index, num_shards,
+                      chunk_size):
+    """Read lines of a shard from input_offset, chunk by chunk. Line
+    line_no goes to shard line_no % num_shards.
+
+    Yields:
+        tuple -- (list of (line_no, text), input offset after the chunk,
+            line_no after the chunk)
+    """
+    chunk = []
+    with open(input_path, 'rb') as f:
+        f.seek(input_offset)
+        while True:
+            line = f.readline()
+            if not line:
+                break
+            if line_no % num_shards == shard_index:
+                chunk.append((line_no, line.decode('utf8').rstrip('\r\n')))
+            line_no += 1
+            if len(chunk) == chunk_size:
+                yield chunk, f.tell(), line_no
+                chunk = []
+        if chunk:
+            yield chunk, f.tell(), line_no
+
+
+def annotate_shard(annotate_fn, input_path, output_path, shard_index=0,
+                   num_shards=1, chunk_size=1000):
+    """Annotate lines of a shard of input file, and write a JSONL line
+    {"line": line_no, "result": ...} per input line to the shard output.
+
+    After every chunk, output is flushed and the input offset, output
+    offset and line number are saved to <shard output>.progress. A
+    restarted shard truncates output written after the last saved
+    progress and continues from the saved input offset, so finished
+    chunks are never annotated again.
+
+    Arguments:
+        annotate_fn {callable} -- list of str -> list of json serializable
+            result, e.g. ChineseNER.ner
+        input_path {str} -- input file, a document per line
+        output_path {str} -- output file, shard output is written to
+            output_path.shard-<i>-of-<n>
+
+    Keyword Arguments:
+        shard_index {int} -- index of shard (default: {0})
+        num_shards {int} -- number of shards (default: {1})
+        chunk_size {int} -- number of lines annotated at once (default: {1000})
+
+    Returns:
+        str -- path of shard output
+    """
+    shard_path = get_shard_path(output_path, shard_index, num_shards)
+    progress_path = shard_path + '.progress'
+    progress = load_progress(progress_path)
+    if progress['input_offset']:
+        tf.logging.info('Shard %d resumes from line %d' % (
+            shard_index, progress['num_lines']))
+
+    with open(shard_path, 'ab') as out_f:
+        out_f.truncate(progress['output_offset'])
+        out_f.seek(progress['output_offset'])
+        for chunk, input_offset, num_lines in iter_shard_chunks(
+                input_path, progress['input_offset'], progress['num_lines'],
+                shard_index, num_shards, chunk_size):
+            result_list = annotate_fn([text for _, text in chunk])
+            for (line_no, _), result in zip(chunk, result_list):
+                out_f.write((json.dumps(
+                    {'line': line_no, 'result': result},
+                    ensure_ascii=False, default=str) + '\n').encode('utf8'))
+            out_f.flush()
+            os.fsync(out_f.fileno())
+
+            progress = {'input_offset': input_offset,
+                        'output_offset': out_f.tell(),
+                        'num_lines': num_lines}
+            save_progress(progress_path, progress)
+            tf.logging.info('Shard %d: %d lines done' % (shard_index, num_lines))
+    return shard_path
+
+
+def merge_shards(output_path, num_shards):
+    """Merge shard outputs into output_path in input line order"""
+    shard_file_list = [open(get_shard_path(output_path, ind, num_shards), 'r', encoding='utf8')
+                       for ind in range(num_shards)]
+    with open(output_path, 'w', encoding='utf8') as out_f:
+        for line in heapq.merge(*shard_file_list, key=lambda l: json.loads(l)['line']):
+            out_f.write(line)
+    for f in shard_file_list:
+        f.close()
+
+
+def _annotate_worker(create_annotate_fn, args, input_path, output_path,
+                     shard_index, num_shards, chunk_size, gpu):
+    if gpu:
+        os.environ['CUDA_VISIBLE_DEVICES'] = str(shard_index % gpu)
+    annotate_shard(create_annotate_fn(*args), input_path, output_path,
+                   shard_index, num_shards, chunk_size)
+
+
+def bulk_annotate(create_annotate_fn, args, input_path, output_path,
+                  num_workers=1, chunk_size=1000, gpu=0):
+    """Annotate a large file with num_workers processes, each annotates
+    a shard with its own model, see annotate_shard. Rerun with the same
+    arguments to resume an interrupted job.
+
+    Arguments:
+        create_annotate_fn {callable} -- create_annotate_fn(*args) returns
+            annotate_fn of annotate_shard. Called in worker processes,
+            so it should be a module level function
+        args {tuple} -- args of create_annotate_fn
+        input_path {str} -- input file, a document per line
+        output_path {str} -- output JSONL file
+
+    Keyword Arguments:
+        num_workers {int} -- number of worker processes (default: {1})
+        chunk_size {int} -- number of lines annotated at once (default: {1000})
+        gpu {int} -- number of gpu, worker i uses gpu i % gpu. If 0,
+            devices are not assigned (default: {0})
+    """
+    if num_workers == 1:
+        annotate_shard(create_annotate_fn(*args), input_path, output_path,
+                       chunk_size=chunk_size)
+    else:
+        # tensorflow does not survive fork
+        ctx = multiprocessing.get_context('spawn')
+        worker_list = [
+            ctx.Process(target=_annotate_worker, args=(
+                create_annotate_fn, args, input_path, output_path,
+                shard_index, num_workers, chunk_size, gpu))
+            for shard_index in range(num_workers)]
+        for worker in worker_list:
+            worker.start()
+        for worker in worker_list:
+            worker.join()
+        failed = [ind for ind, worker in enumerate(worker_list) if worker.exitcode != 0]
+        if failed:
+            raise RuntimeError(
+                'Shards %s failed, rerun to resume' % ', '.join(map(str, failed)))
+    merge_shards(output_path, num_workers)
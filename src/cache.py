@@ -0,0 +1,107 @@
+import time
+from collections import OrderedDict
+
+
+class LRUCache():
+    """Least recently used cache with hit rate and latency metrics
+
+    Keyword Arguments:
+        max_size {int} -- max number of entries, least recently used
+            entry is evicted when full (default: {10000})
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.num_calls = 0
+        self.total_call_time = 0.0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        if key in self.data:
+            self.data.move_to_end(key)
+            self.hits += 1
+            return self.data[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        if key in self.data:
+            self.data.move_to_end(key)
+        self.data[key] = value
+        while len(self.data) > self.max_size:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.data.clear()
+
+    def record_call(self, sec):
+        self.num_calls += 1
+        self.total_call_time += sec
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def metrics(self):
+        return {
+            'size': len(self.data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hit_rate,
+            'mean_call_ms': self.total_call_time / max(self.num_calls, 1) * 1000}
+
+
+def cached_map(fn, input_list, cache=None, key_fn=None):
+    """Apply fn to a list of inputs, computing each distinct key once.
+
+    Inputs with the same key are deduplicated before calling fn, and
+    if cache is given, keys found in cache are not computed again.
+
+    Arguments:
+        fn {callable} -- list of input -> list of result
+        input_list {list} -- inputs
+
+    Keyword Arguments:
+        cache {LRUCache} -- cache of results (default: {None})
+        key_fn {callable} -- input -> hashable key, identity
+            if None (default: {None})
+
+    Returns:
+        list -- results in input order
+    """
+    start = time.time()
+    key_list = [key_fn(x) if key_fn is not None else x for x in input_list]
+
+    result_dict = {}
+    missing_input_list = []
+    missing_key_list = []
+    for key, x in zip(key_list, input_list):
+        if key in result_dict:
+            continue
+        result = cache.get(key) if cache is not None else None
+        if result is not None:
+            result_dict[key] = result
+        else:
+            # placeholder, so duplicates in batch are computed once
+            result_dict[key] = None
+            missing_input_list.append(x)
+            missing_key_list.append(key)
+
+    if missing_input_list:
+        for key, result in zip(missing_key_list, fn(missing_input_list)):
+            result_dict[key] = result
+            if cache is not None:
+                cache.put(key, result)
+
+    if cache is not None:
+        cache.record_call(time.time() - start)
+    return [result_dict[key] for key in key_list]
@@ -1,4 +1,6 @@
 import tensorflow as tf
+from tensorflow.python.ops import io_ops
+from tensorflow.python.training.saver import BaseSaverBuilder
 
 from bert import modeling
 
@@ -34,3 +36,76 @@ class RestoreCheckpointHook(tf.train.SessionRunHook):
 
     def end(self, session):
         pass
+
+
+class PartialRestoreSaver(tf.train.Saver):
+    """Saver that restores variables found in checkpoint and initializes
+    the others, instead of failing on missing keys.
+
+    This is needed when variables are added to a model_dir that is
+    already trained, e.g. optimizer slots of layers unfrozen by
+    layer_freeze_schedule. Variables stored with another shape are
+    initialized as well, e.g. flat moment buffers of
+    FusedAdamWeightDecayOptimizer, whose size follows the trainable
+    variables of a phase. Since graph is finalized before restore,
+    the restore saver is built against checkpoint_path at creation.
+    """
+
+    def __init__(self, checkpoint_path, var_list=None, **kwargs):
+        super(PartialRestoreSaver, self).__init__(var_list=var_list, **kwargs)
+        if var_list is None:
+            var_list = tf.global_variables()
+
+        ckpt_var_shapes = dict(tf.train.list_variables(checkpoint_path))
+        restore_var_list = []
+        missing_var_list = []
+        for var in var_list:
+            ckpt_shape = ckpt_var_shapes.get(var.op.name)
+            if ckpt_shape is not None and var.shape.as_list() == list(ckpt_shape):
+                restore_var_list.append(var)
+            else:
+                missing_var_list.append(var)
+
+        self.checkpoint_path = checkpoint_path
+        self.restore_saver = tf.train.Saver(
+            var_list=restore_var_list, sharded=True)
+        self.init_missing_op = tf.variables_initializer(missing_var_list)
+        if missing_var_list:
+            tf.logging.info(
+                'Variables not in %s or of another shape will be initialized: %s' % (
+                    checkpoint_path, [v.op.name for v in missing_var_list]))
+
+    def restore(self, sess, save_path):
+        if save_path != self.checkpoint_path:
+            return super(PartialRestoreSaver, self).restore(sess, save_path)
+        self.restore_saver.restore(sess, save_path)
+        sess.run(self.init_missing_op)
+
+
+class CastingSaverBuilder(BaseSaverBuilder):
+    """Saver builder that restores tensors stored in another dtype than
+    the variable, e.g. float16 weights of an exported inference
+    checkpoint into float32 variables, by casting after restore.
+    """
+
+    def __init__(self, checkpoint_path):
+        super(CastingSaverBuilder, self).__init__()
+        self.dtype_map = tf.train.load_checkpoint(
+            checkpoint_path).get_variable_to_dtype_map()
+
+    @staticmethod
+    def need_cast(checkpoint_path):
+        """Whether checkpoint stores float16 tensors"""
+        dtype_map = tf.train.load_checkpoint(
+            checkpoint_path).get_variable_to_dtype_map()
+        return any([dtype == tf.float16 for dtype in dtype_map.values()])
+
+    def restore_op(self, filename_tensor, saveable, preferred_shard):
+        tensors = []
+        for spec in saveable.specs:
+            stored_dtype = self.dtype_map.get(spec.name, spec.dtype)
+            tensor = io_ops.restore_v2(
+                filename_tensor, [spec.name], [spec.slice_spec],
+                [stored_dtype])[0]
+            tensors.append(tf.cast(tensor, spec.dtype))
+        return tensors
@@ -0,0 +1,283 @@
+import copy
+import math
+
+import tensorflow as tf
+
+from bert import modeling
+
+
+def get_layer_bert_config(bert_config, is_training):
+    """Same as BertModel, dropout is disabled if not training"""
+    bert_config = copy.deepcopy(bert_config)
+    if not is_training:
+        bert_config.hidden_dropout_prob = 0.0
+        bert_config.attention_probs_dropout_prob = 0.0
+    return bert_config
+
+
+def is_pruned(bert_config):
+    """True if layers of bert_config have their own sizes, see get_layer_sizes"""
+    return getattr(bert_config, 'layer_num_attention_heads', None) is not None
+
+
+def get_layer_sizes(bert_config, layer_idx):
+    """Number of attention heads and intermediate size of a layer.
+
+    Pruned configs keep num_attention_heads of the original model, which
+    determines size_per_head, and list the sizes left in each layer in
+    layer_num_attention_heads and layer_intermediate_size.
+
+    Returns:
+        tuple -- (num_attention_heads, intermediate_size)
+    """
+    if not is_pruned(bert_config):
+        return bert_config.num_attention_heads, bert_config.intermediate_size
+    return (bert_config.layer_num_attention_heads[layer_idx],
+            bert_config.layer_intermediate_size[layer_idx])
+
+
+def dropout(input_tensor, dropout_prob, seed=None):
+    """Same as modeling.dropout. If seed is specified, stateless random
+    op is used, so the same mask is drawn when the graph is recomputed.
+
+    Arguments:
+        input_tensor {tensor} -- input
+        dropout_prob {float} -- probability of dropping out a value
+
+    Keyword Arguments:
+        seed {tensor} -- int64, [2] (default: {None})
+    """
+    if seed is None:
+        return modeling.dropout(input_tensor, dropout_prob)
+    if dropout_prob is None or dropout_prob == 0.0:
+        return input_tensor
+
+    keep_prob = 1.0 - dropout_prob
+    random_tensor = keep_prob + tf.contrib.stateless.stateless_random_uniform(
+        tf.shape(input_tensor), seed=seed, dtype=input_tensor.dtype)
+    return input_tensor / keep_prob * tf.floor(random_tensor)
+
+
+def attention_layer(layer_input_2d, attention_mask, bert_config,
+                    batch_size, seq_length, dropout_seed=None,
+                    num_attention_heads=None, head_mask=None):
+    """Self attention, same as modeling.attention_layer with 2d output,
+    except that attention probs dropout takes dropout_seed.
+
+    Arguments:
+        layer_input_2d {tensor} -- [batch_size*seq_length, hidden_size]
+        attention_mask {tensor} -- [batch_size, seq_length, seq_length]
+        bert_config {BertConfig} -- bert config
+
+    Keyword Arguments:
+        dropout_seed {tensor} -- see dropout (default: {None})
+        num_attention_heads {int} -- number of heads of this layer,
+            bert_config.num_attention_heads if None (default: {None})
+        head_mask {tensor} -- multiplies context of each head,
+            [num_attention_heads] (default: {None})
+
+    Returns:
+        tensor -- [batch_size*seq_length, num_attention_heads*size_per_head]
+    """
+    size_per_head = int(bert_config.hidden_size / bert_config.num_attention_heads)
+    if num_attention_heads is None:
+        num_attention_heads = bert_config.num_attention_heads
+    initializer = modeling.create_initializer(bert_config.initializer_range)
+
+    def transpose_for_scores(input_tensor):
+        output_tensor = tf.reshape(
+            input_tensor, [batch_size, seq_length, num_attention_heads, size_per_head])
+        return tf.transpose(output_tensor, [0, 2, 1, 3])
+
+    # [batch_size, num_attention_heads, seq_length, size_per_head]
+    query_layer = transpose_for_scores(tf.layers.dense(
+        layer_input_2d, num_attention_heads * size_per_head,
+        name="query", kernel_initializer=initializer))
+    key_layer = transpose_for_scores(tf.layers.dense(
+        layer_input_2d, num_attention_heads * size_per_head,
+        name="key", kernel_initializer=initializer))
+    value_layer = transpose_for_scores(tf.layers.dense(
+        layer_input_2d, num_attention_heads * size_per_head,
+        name="value", kernel_initializer=initializer))
+
+    # [batch_size, num_attention_heads, seq_length, seq_length]
+    attention_scores = tf.matmul(query_layer, key_layer, transpose_b=True)
+    attention_scores = attention_scores * (1.0 / math.sqrt(size_per_head))
+    adder = (1.0 - tf.cast(tf.expand_dims(attention_mask, axis=[1]),
+                           tf.float32)) * -10000.0
+    attention_probs = tf.nn.softmax(attention_scores + adder)
+    attention_probs = dropout(
+        attention_probs, bert_config.attention_probs_dropout_prob, dropout_seed)
+
+    # [batch_size, num_attention_heads, seq_length, size_per_head]
+    context_layer = tf.matmul(attention_probs, value_layer)
+    if head_mask is not None:
+        context_layer = context_layer * tf.reshape(
+            head_mask, [1, num_attention_heads, 1, 1])
+
+    # [batch_size, seq_length, num_attention_heads, size_per_head]
+    context_layer = tf.transpose(context_layer, [0, 2, 1, 3])
+    return tf.reshape(
+        context_layer,
+        [batch_size * seq_length, num_attention_heads * size_per_head])
+
+
+def embedding(bert_config, input_ids, segment_ids, use_one_hot_embeddings):
+    """Embedding of bert, should be called under 'bert' variable scope
+
+    Returns:
+        tuple -- (embedding_output, embedding_table)
+            embedding_output: [batch_size, seq_length, hidden_size]
+            embedding_table: [vocab_size, hidden_size]
+    """
+    with tf.variable_scope("embeddings"):
+        (embedding_output, embedding_table) = modeling.embedding_lookup(
+            input_ids=input_ids,
+            vocab_size=bert_config.vocab_size,
+            embedding_size=bert_config.hidden_size,
+            initializer_range=bert_config.initializer_range,
+            word_embedding_name="word_embeddings",
+            use_one_hot_embeddings=use_one_hot_embeddings)
+
+        embedding_output = modeling.embedding_postprocessor(
+            input_tensor=embedding_output,
+            use_token_type=True,
+            token_type_ids=segment_ids,
+            token_type_vocab_size=bert_config.type_vocab_size,
+            token_type_embedding_name="token_type_embeddings",
+            use_position_embeddings=True,
+            position_embedding_name="position_embeddings",
+            initializer_range=bert_config.initializer_range,
+            max_position_embeddings=bert_config.max_position_embeddings,
+            dropout_prob=bert_config.hidden_dropout_prob)
+    return embedding_output, embedding_table
+
+
+def transformer_layer(layer_input, attention_mask, bert_config, layer_idx,
+                      dropout_seed=None, head_mask=None, ffn_mask=None):
+    """One transformer layer of bert, should be called under
+    'bert/encoder' variable scope.
+
+    Variables are named the same as modeling.transformer_model, so
+    checkpoints of BertModel can be restored. Sizes of pruned layers
+    are read from bert_config, see get_layer_sizes.
+
+    Arguments:
+        layer_input {tensor} -- [batch_size, seq_length, hidden_size]
+        attention_mask {tensor} -- [batch_size, seq_length, seq_length]
+        bert_config {BertConfig} -- bert config, see get_layer_bert_config
+        layer_idx {int} -- index of layer, starts from 0
+
+    Keyword Arguments:
+        dropout_seed {tensor} -- int64, [2]. If specified, dropout masks
+            are determined by it, see dropout (default: {None})
+        head_mask {tensor} -- multiplies context of each attention head,
+            [num_attention_heads] (default: {None})
+        ffn_mask {tensor} -- multiplies each intermediate activation,
+            [intermediate_size] (default: {None})
+
+    Returns:
+        tensor -- [batch_size, seq_length, hidden_size]
+    """
+    input_shape = modeling.get_shape_list(layer_input, expected_rank=3)
+    batch_size = input_shape[0]
+    seq_length = input_shape[1]
+    hidden_size = input_shape[2]
+    num_attention_heads, intermediate_size = get_layer_sizes(bert_config, layer_idx)
+    initializer = modeling.create_initializer(bert_config.initializer_range)
+
+    def get_seed(ind):
+        if dropout_seed is None:
+            return None
+        return dropout_seed + tf.constant([0, ind], dtype=tf.int64)
+
+    layer_input_2d = modeling.reshape_to_matrix(layer_input)
+    with tf.variable_scope("layer_%d" % layer_idx):
+        with tf.variable_scope("attention"):
+            with tf.variable_scope("self"):
+                attention_output = attention_layer(
+                    layer_input_2d, attention_mask, bert_config,
+                    batch_size, seq_length, get_seed(0),
+                    num_attention_heads=num_attention_heads, head_mask=head_mask)
+
+            with tf.variable_scope("output"):
+                attention_output = tf.layers.dense(
+                    attention_output,
+                    hidden_size,
+                    kernel_initializer=initializer)
+                attention_output = dropout(
+                    attention_output, bert_config.hidden_dropout_prob,
+                    get_seed(1))
+                attention_output = modeling.layer_norm(
+                    attention_output + layer_input_2d)
+
+        with tf.variable_scope("intermediate"):
+            intermediate_output = tf.layers.dense(
+                attention_output,
+                intermediate_size,
+                activation=modeling.get_activation(bert_config.hidden_act),
+                kernel_initializer=initializer)
+            if ffn_mask is not None:
+                intermediate_output = intermediate_output * ffn_mask
+
+        with tf.variable_scope("output"):
+            layer_output = tf.layers.dense(
+                intermediate_output,
+                hidden_size,
+                kernel_initializer=initializer)
+            layer_output = dropout(
+                layer_output, bert_config.hidden_dropout_prob, get_seed(2))
+            layer_output = modeling.layer_norm(
+                layer_output + attention_output)
+
+    return tf.reshape(layer_output, [batch_size, seq_length, hidden_size])
+
+
+def pooler(sequence_output, bert_config):
+    """Pooler of bert, reuses bert/pooler variables if exist"""
+    with tf.variable_scope('bert/pooler', reuse=tf.AUTO_REUSE):
+        first_token_tensor = tf.squeeze(sequence_output[:, 0:1, :], axis=1)
+        return tf.layers.dense(
+            first_token_tensor,
+            bert_config.hidden_size,
+            activation=tf.tanh,
+            kernel_initializer=modeling.create_initializer(
+                bert_config.initializer_range),
+            name='dense')
+
+
+def recompute_encoder(embedding_output, attention_mask, bert_config):
+    """Encoder of bert for training with activation recomputation.
+    Only the output of each layer is kept for backprop, activations
+    inside layers are recomputed in backward pass. Should be called
+    under 'bert/encoder' variable scope with use_resource=True, which
+    is required by recompute_grad.
+
+    Dropout masks are seeded by global step and layer, so the recomputed
+    forward pass is identical to the original one.
+
+    Arguments:
+        embedding_output {tensor} -- [batch_size, seq_length, hidden_size]
+        attention_mask {tensor} -- [batch_size, seq_length, seq_length]
+        bert_config {BertConfig} -- bert config, see get_layer_bert_config
+
+    Returns:
+        list -- num_hidden_layers * [batch_size, seq_length, hidden_size]
+    """
+    global_step = tf.cast(tf.train.get_or_create_global_step(), tf.int64)
+
+    all_layer_outputs = []
+    layer_output = embedding_output
+    for layer_idx in range(bert_config.num_hidden_layers):
+        # 3 dropouts in each layer, see transformer_layer
+        dropout_seed = tf.stack(
+            [global_step, tf.constant(layer_idx * 3, dtype=tf.int64)])
+
+        def layer_fn(layer_input, layer_idx=layer_idx, dropout_seed=dropout_seed):
+            return transformer_layer(
+                layer_input, attention_mask, bert_config, layer_idx,
+                dropout_seed=dropout_seed)
+
+        layer_output = tf.contrib.layers.recompute_grad(layer_fn)(layer_output)
+        all_layer_outputs.append(layer_output)
+    return all_layer_outputs
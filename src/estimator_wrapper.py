@@ -1,3 +1,10 @@
+import os
+import re
+import glob
+import time
+import json
+import shutil
+import itertools
 
 import tensorflow as tf
 
@@ -6,29 +13,158 @@ from tqdm import tqdm
 import numpy as np
 
 from .model_fn import BertMultiTask
-from .input_fn import predict_input_fn
+from .input_fn import (predict_input_fn, create_predict_example, reorder_predictions,
+                       create_predict_windows, iter_file_chunks)
 from .estimator import Estimator
-from .utils import get_or_make_label_encoder
+from .utils import get_or_make_label_encoder, assign_central_window, create_generator
 from .params import Params
+from .viterbi import ViterbiDecoder, create_transition_mask
+from .teacher_store import TeacherLogitsStore
+from .cache import LRUCache, cached_map
+from .postprocess import SeqTagDecoder, NERDecoder, CWSDecoder
+from .numpy_bert import NumpyBert, WEIGHT_DIR_NAME, MANIFEST_NAME, weight_file_name
+from .quantization import INT8_WEIGHT_DIR_NAME, calibrate, quantize_numpy_weights
+
+
+class WarmPredictor():
+    """Predictor that builds predict graph and restores checkpoint once,
+    and keeps the session open across predict calls.
+
+    Estimator.predict rebuilds the graph, creates a session and restores
+    the checkpoint on every call, which costs seconds for a few inputs.
+    WarmPredictor pays that once at construction, see cold_start_time.
+    Like predict_input_fn, inputs are padded to the longest one in the
+    batch and sorted by length if params.predict_sort_by_length.
+
+    Arguments:
+        params {Params} -- params
+        model_dir {str} -- checkpoint dir
+    """
+
+    def __init__(self, params, model_dir):
+        self.params = params
+        self.tokenizer = FullTokenizer(params.vocab_file)
+        self.last_call_time = None
+
+        start = time.time()
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.train.get_or_create_global_step()
+            self.features = {
+                k: tf.placeholder(tf.int32, [None, None], name=k)
+                for k in ['input_ids', 'input_mask', 'segment_ids']}
+            model = BertMultiTask(params=params)
+            spec = model.get_model_fn(warm_start=False)(
+                self.features, None, tf.estimator.ModeKeys.PREDICT, params,
+                config=tf.estimator.RunConfig(model_dir=model_dir))
+            self.predictions = spec.predictions
+
+            saver = spec.scaffold.saver if spec.scaffold.saver is not None \
+                else tf.train.Saver()
+            session_config = tf.ConfigProto(allow_soft_placement=True)
+            session_config.gpu_options.allow_growth = True
+            self.sess = tf.Session(config=session_config)
+            checkpoint_path = tf.train.latest_checkpoint(model_dir)
+            if checkpoint_path is None:
+                raise ValueError('No checkpoint found in %s' % model_dir)
+            saver.restore(self.sess, checkpoint_path)
+            self.graph.finalize()
+        self.cold_start_time = time.time() - start
+        tf.logging.info('WarmPredictor restored %s in %.2f sec' % (
+            checkpoint_path, self.cold_start_time))
+
+    def predict_batch(self, example_list):
+        """Run one forward pass of a list of examples
+
+        Arguments:
+            example_list {list} -- list of dict created by
+                create_predict_example
+
+        Returns:
+            list -- list of prediction dict, same as Estimator.predict
+        """
+        seq_length = max([sum(example['input_mask']) for example in example_list])
+        feed_dict = {
+            self.features[k]: np.array(
+                [example[k][:seq_length] for example in example_list])
+            for k in self.features}
+        pred = self.sess.run(self.predictions, feed_dict=feed_dict)
+        return [{k: v[ind] for k, v in pred.items()}
+                for ind in range(len(example_list))]
+
+    def predict(self, input_list):
+        """Predict a list of raw strings, batch by batch
+
+        Arguments:
+            input_list {list} -- list of str, or examples created by
+                create_predict_example or create_predict_windows
+
+        Returns:
+            list -- list of prediction dict, same as Estimator.predict
+        """
+        start = time.time()
+        example_list = [
+            doc if isinstance(doc, dict) else create_predict_example(
+                doc, self.tokenizer, self.params)
+            for doc in input_list]
+        order = list(range(len(example_list)))
+        if self.params.predict_sort_by_length:
+            order.sort(key=lambda ind: sum(example_list[ind]['input_mask']))
+        batch_size = self.params.batch_size*2
+        pred_list = [None] * len(example_list)
+        for batch_start in range(0, len(order), batch_size):
+            batch_order = order[batch_start:batch_start+batch_size]
+            batch_pred = self.predict_batch(
+                [example_list[ind] for ind in batch_order])
+            for ind, p in zip(batch_order, batch_pred):
+                p['example_index'] = ind
+                pred_list[ind] = p
+        self.last_call_time = time.time() - start
+        return pred_list
+
+    def close(self):
+        self.sess.close()
 
 
 class PredictModel():
-    def __init__(self, params, model_dir=None, gpu=1):
+    def __init__(self, params, model_dir=None, gpu=1, warm=False):
 
         self.model_dir = model_dir
         self.params = params
         self.gpu = gpu
+        # if True, keep a WarmPredictor for predict calls
+        self.warm = warm
+        self.warm_predictor = None
         self.tokenizer = FullTokenizer(self.params.vocab_file)
+        # tagging scheme used to constrain host viterbi decoding
+        self.decode_scheme = None
+        self.decoder_dict = {}
+        # results of repeated inputs, see cached_annotate
+        self.cache = LRUCache(self.params.predict_cache_size) \
+            if self.params.predict_cache_size else None
+        self.model_version = None
+        # batched post processing, created after label encoder is loaded
+        self.seq_tag_decoder = None
 
     @property
     def label_encoder(self):
         return get_or_make_label_encoder(self.params, self.problem, 'predict')
 
     def init_estimator(self, problem):
-        self.params.assign_problem(problem, gpu=int(self.gpu))
+        # exported inference dir or trained checkpoint dir carries its own
+        # params, vocab and label encoders
+        if self.model_dir is not None and os.path.exists(
+                os.path.join(self.model_dir, 'params.json')):
+            self.params.from_predict_dir(self.model_dir)
+            self.tokenizer = FullTokenizer(self.params.vocab_file)
+        else:
+            self.params.assign_problem(problem, gpu=int(self.gpu))
 
         # change max length
-        self.params.max_seq_len = 350
+        if self.params.predict_window_size:
+            self.params.max_seq_len = self.params.predict_window_size
+        else:
+            self.params.max_seq_len = 350
 
         model = BertMultiTask(params=self.params)
         model_fn = model.get_model_fn(warm_start=False)
@@ -51,90 +187,648 @@ class PredictModel():
             params=self.params,
             config=run_config)
 
-    def remove_special_tokens(self, l1, l2):
-        ind_list = []
-        for ind, char in enumerate(l1):
-            if char in ['[PAD]', '[CLS]', '[SEP]']:
-                ind_list.append(ind)
-        return [e for ie, e in enumerate(l1) if ie not in ind_list], [e for ie, e in enumerate(l2) if ie not in ind_list]
+        if self.warm:
+            self.warm_predictor = WarmPredictor(self.params, model_dir)
+
+        # cached results of other checkpoints are never hit
+        self.model_version = tf.train.latest_checkpoint(model_dir)
+
+    def cached_annotate(self, annotate_fn, input_list, *key_args):
+        """Apply annotate_fn to input_list, through the result cache if
+        params.predict_cache_size is set. Identical inputs of a call are
+        annotated once either way.
+
+        Inputs are keyed by raw text, model version and key_args. Text
+        is not stripped, since offsets of results depend on leading
+        white spaces.
+
+        Arguments:
+            annotate_fn {callable} -- list of str -> list of result
+            input_list {list} -- list of str
+
+        Returns:
+            list -- results in input order
+        """
+        def key_fn(doc):
+            return (self.model_version, doc) + key_args
+        return cached_map(annotate_fn, input_list, cache=self.cache, key_fn=key_fn)
+
+    def cache_metrics(self):
+        """Size, hit rate and mean call latency of result cache"""
+        if self.cache is None:
+            return {}
+        return self.cache.metrics()
+
+    def get_decoder(self, problem):
+        """Get numpy viterbi decoder of problem, transition params
+        are read from the checkpoint"""
+        if problem not in self.decoder_dict:
+            top_name = self.params.share_top.get(problem, problem)
+            top_scope_name = '%s_top' % top_name
+            if self.params.label_transfer:
+                top_scope_name = top_scope_name + '_lt'
+            transition_params = self.estimator.get_variable_value(
+                '%s/crf_transition' % top_scope_name)
+
+            # decode scheme can be given per problem
+            decode_scheme = self.decode_scheme
+            if isinstance(decode_scheme, dict):
+                decode_scheme = decode_scheme.get(problem)
+
+            transition_mask, start_mask = None, None
+            if decode_scheme is not None:
+                label_encoder = get_or_make_label_encoder(
+                    self.params, problem, 'predict')
+                transition_mask, start_mask = create_transition_mask(
+                    label_encoder, decode_scheme)
+
+            self.decoder_dict[problem] = ViterbiDecoder(
+                transition_params,
+                transition_mask=transition_mask,
+                start_mask=start_mask,
+                num_threads=self.params.crf_decode_threads)
+        return self.decoder_dict[problem]
+
+    def decode_on_host(self, pred):
+        """Replace emission logits of seq_tag problems in predictions
+        with viterbi decoded tags, batch by batch"""
+        seq_tag_problems = [problem for problem_dict in self.params.run_problem_list
+                            for problem in problem_dict
+                            if self.params.problem_type[problem] == 'seq_tag']
+
+        def decode_batch(batch):
+            # [PAD] id is 0
+            seq_length = np.array(
+                [np.sum(np.array(p['input_ids']) != 0) for p in batch])
+            for problem in seq_tag_problems:
+                # predictions may be padded to different lengths
+                # in different batches, see predict_input_fn
+                max_length = max([len(p[problem]) for p in batch])
+                logits = np.stack([
+                    np.pad(p[problem], [[0, max_length - len(p[problem])], [0, 0]],
+                           'constant') for p in batch])
+                tags, _ = self.get_decoder(problem).decode(logits, seq_length)
+                for p, tag in zip(batch, tags):
+                    p[problem] = tag[:len(p['input_ids'])]
+            return batch
+
+        batch = []
+        for p in pred:
+            batch.append(p)
+            if len(batch) == self.params.batch_size*2:
+                for decoded in decode_batch(batch):
+                    yield decoded
+                batch = []
+        if batch:
+            for decoded in decode_batch(batch):
+                yield decoded
+
+    def map_input(self, fn, input_file_or_list):
+        """Apply fn, list of str -> list of result, to input_file_or_list.
+        A file is read lazily and fn is applied to chunks of
+        params.predict_file_chunk_size lines.
+
+        Returns:
+            list -- results in input order
+        """
+        if not isinstance(input_file_or_list, str):
+            return fn(input_file_or_list)
+        result = []
+        for chunk in iter_file_chunks(
+                input_file_or_list, self.params.predict_file_chunk_size):
+            result.extend(fn(chunk))
+        return result
 
     def predict(self, input_file_or_list):
-        def input_fn(): return predict_input_fn(
-            input_file_or_list, self.params, mode='predict')
+        if self.params.predict_window_size:
+            return self.map_input(self.predict_windows, input_file_or_list)
+        return self.predict_examples(input_file_or_list)
+
+    def predict_examples(self, input_file_or_list):
+        if self.warm_predictor is not None:
+            if isinstance(input_file_or_list, str):
+                return self.map_input(self.predict_examples, input_file_or_list)
+            pred = self.warm_predictor.predict(input_file_or_list)
+        else:
+            def input_fn(): return predict_input_fn(
+                input_file_or_list, self.params, mode='predict')
+
+            pred = self.estimator.predict(
+                input_fn=input_fn)
+        if self.params.crf_decode_on_host:
+            pred = self.decode_on_host(pred)
+        return reorder_predictions(pred)
+
+    def predict_windows(self, input_list):
+        """Predict documents of any length by overlapping windows,
+        see create_predict_windows.
+
+        Windows of all documents are predicted in batches, then outputs
+        of seq_tag problems are stitched back per document. A token
+        covered by several windows takes the prediction of the window
+        it is most central in, since that window sees the most context
+        on both sides. Other outputs are taken from the first window.
+
+        Arguments:
+            input_list {list} -- list of str
+
+        Returns:
+            list -- prediction dict of each document, input_ids and
+                seq_tag outputs cover the whole document with [CLS] and
+                [SEP]. 'char_offsets' is the char index in document of
+                every token between [CLS] and [SEP].
+        """
+        seq_tag_problems = [problem for problem_dict in self.params.run_problem_list
+                            for problem in problem_dict
+                            if self.params.problem_type[problem] == 'seq_tag']
+
+        doc_list = []
+        example_list = []
+        for doc in input_list:
+            tokens, char_offsets, window_list = create_predict_windows(
+                doc, self.tokenizer, self.params)
+            doc_list.append((
+                tokens, char_offsets,
+                [(start, len(example_list) + ind)
+                 for ind, (start, _) in enumerate(window_list)]))
+            example_list.extend([example for _, example in window_list])
+
+        window_pred = self.predict_examples(example_list)
 
-        pred = self.estimator.predict(
-            input_fn=input_fn)
-        return pred
+        result_list = []
+        window_length = self.params.predict_window_size - 2
+        for tokens, char_offsets, window_ind_list in doc_list:
+            num_tokens = len(tokens)
+            best_window = assign_central_window(
+                num_tokens, window_length, [start for start, _ in window_ind_list])
+
+            first_pred = window_pred[window_ind_list[0][1]]
+            last_pred = window_pred[window_ind_list[-1][1]]
+            p = {k: v for k, v in first_pred.items() if k != 'example_index'}
+            p['input_ids'] = np.array(self.tokenizer.convert_tokens_to_ids(
+                ['[CLS]'] + tokens + ['[SEP]']))
+            p['char_offsets'] = np.array(char_offsets, dtype=np.int32)
+            for problem in seq_tag_problems:
+                stitched = [first_pred[problem][0]]
+                for position in range(num_tokens):
+                    start, window_ind = window_ind_list[best_window[position]]
+                    stitched.append(
+                        window_pred[window_ind][problem][position - start + 1])
+                last_start = window_ind_list[-1][0]
+                stitched.append(last_pred[problem][num_tokens - last_start + 1])
+                p[problem] = np.stack(stitched)
+            result_list.append(p)
+        return result_list
 
 
 class ChineseNER(PredictModel):
 
-    def __init__(self, params, model_dir=None, gpu=1):
-        super().__init__(params, model_dir, gpu)
+    def __init__(self, params, model_dir=None, gpu=1, warm=False):
+        super().__init__(params, model_dir, gpu, warm)
         self.problem = 'NER'
+        self.decode_scheme = 'BIO'
         self.init_estimator(self.problem)
 
-    def merge_entity(self, tokens, labels):
-        merged_tokens = []
-        merged_labels = []
-        for token, label in zip(tokens, labels):
-            if label == 'O':
-                merged_tokens.append(token)
-                merged_labels.append(label)
-            elif label[0] == 'B':
-                merged_tokens.append(token)
-                merged_labels.append(label[2:])
-            else:
-                merged_tokens[-1] += token
-                # merged_labels[-1] += label
-        return merged_tokens, merged_labels
-
-    def ner(self, input_file_or_list, extract_ent=True):
-
+    def ner(self, input_file_or_list, extract_ent=True, with_offsets=False):
+        """Extract entities
+
+        Arguments:
+            input_file_or_list {list or str} -- list of str, or path of file
+                with a text per line
+
+        Keyword Arguments:
+            extract_ent {bool} -- if True, return entities only, otherwise
+                every segment with 'O' for non entity (default: {True})
+            with_offsets {bool} -- add char start and end (exclusive)
+                of entities (default: {False})
+
+        Returns:
+            list -- for each text, list of (entity, type) or
+                (entity, type, start, end)
+        """
+        return self.map_input(lambda chunk: self.cached_annotate(
+            lambda doc_list: self._ner(doc_list, extract_ent, with_offsets),
+            chunk, 'ner', extract_ent, with_offsets), input_file_or_list)
+
+    def _ner(self, input_file_or_list, extract_ent, with_offsets):
+        if self.seq_tag_decoder is None:
+            self.seq_tag_decoder = NERDecoder(self.label_encoder, self.tokenizer)
         pred = self.predict(input_file_or_list)
+        return self.seq_tag_decoder.decode(
+            pred, self.problem, input_file_or_list,
+            extract_ent=extract_ent, with_offsets=with_offsets)
 
-        result_list = []
 
-        for d, p in enumerate(pred):
-            input_ids = p['input_ids']
-            ner_pred = p[self.problem]
-            tokens = self.tokenizer.convert_ids_to_tokens(input_ids)
-            labels = self.label_encoder.inverse_transform(ner_pred)
+class ChineseWordSegment(PredictModel):
+    def __init__(self, params, model_dir=None, gpu=1, warm=False):
+        super().__init__(params, model_dir, gpu, warm)
+        self.problem = 'CWS'
+        self.decode_scheme = 'BMES'
+        self.init_estimator(self.problem)
 
-            tokens, labels = self.remove_special_tokens(tokens, labels)
-            tokens, labels = self.merge_entity(tokens, labels)
-            if extract_ent:
+    def cws(self, input_file_or_list, with_offsets=False):
+        """Segment words
 
-                result_list.append([(ent, ent_type) for ent, ent_type in zip(
-                    tokens, labels) if ent_type != 'O'])
+        Arguments:
+            input_file_or_list {list or str} -- list of str, or path of file
+                with a text per line
 
-            else:
-                result_list.append(
-                    list(zip(tokens, labels)))
-        return result_list
+        Keyword Arguments:
+            with_offsets {bool} -- return list of (word, start, end),
+                char offsets in text, instead of words seperated by
+                space (default: {False})
 
+        Returns:
+            list -- segmented result of each text
+        """
+        return self.map_input(lambda chunk: self.cached_annotate(
+            lambda doc_list: self._cws(doc_list, with_offsets),
+            chunk, 'cws', with_offsets), input_file_or_list)
 
-class ChineseWordSegment(PredictModel):
-    def __init__(self, params, model_dir=None, gpu=1):
-        super().__init__(params, model_dir, gpu)
-        self.problem = 'CWS'
+    def _cws(self, input_file_or_list, with_offsets):
+        if self.seq_tag_decoder is None:
+            self.seq_tag_decoder = CWSDecoder(self.label_encoder, self.tokenizer)
+        pred = self.predict(input_file_or_list)
+        return self.seq_tag_decoder.decode(
+            pred, self.problem, input_file_or_list, with_offsets=with_offsets)
+
+
+class MultiTaskAnnotator(PredictModel):
+    """Annotate texts with all seq_tag problems of a multitask
+    checkpoint, e.g. CWS|NER|POS. The encoder runs once per text and
+    every head of top is evaluated on its output, instead of running
+    a PredictModel per problem.
+
+    Arguments:
+        params {Params} -- params
+
+    Keyword Arguments:
+        model_dir {str} -- checkpoint dir (default: {None})
+        gpu {int} -- number of gpu (default: {1})
+        warm {bool} -- use WarmPredictor (default: {False})
+        problem {str} -- problems of checkpoint (default: {'CWS|NER|POS'})
+    """
+
+    def __init__(self, params, model_dir=None, gpu=1, warm=False, problem='CWS|NER|POS'):
+        super().__init__(params, model_dir, gpu, warm)
+        self.problem = problem
+        self.decode_scheme = {'NER': 'BIO', 'CWS': 'BMES'}
         self.init_estimator(self.problem)
-
-    def cws(self, input_file_or_list):
+        self.problem_list = [
+            p for p in re.split(r'[&|]', problem)
+            if self.params.problem_type[p] == 'seq_tag']
+        if not self.problem_list:
+            raise ValueError('No seq_tag problem in %s' % problem)
+        self.decoder_dict_by_problem = {
+            p: SeqTagDecoder(
+                get_or_make_label_encoder(self.params, p, 'predict'), self.tokenizer)
+            for p in self.problem_list}
+
+    def annotate(self, input_file_or_list):
+        """Annotate every char of texts
+
+        Arguments:
+            input_file_or_list {list or str} -- list of str, or path of file
+                with a text per line
+
+        Returns:
+            list -- for each text, a list of dict per char with 'char'
+                and the label of every seq_tag problem,
+                e.g. [{'char': '上', 'CWS': 'b', 'NER': 'B-LOC', 'POS': 'NR'}, ...]
+        """
+        return self.map_input(lambda chunk: self.cached_annotate(
+            self._annotate, chunk, 'annotate'), input_file_or_list)
+
+    def _annotate(self, input_file_or_list):
         pred = self.predict(input_file_or_list)
-        result_list = []
 
-        for d, p in enumerate(pred):
-            input_ids = p['input_ids']
-            ner_pred = p[self.problem]
-            tokens = self.tokenizer.convert_ids_to_tokens(input_ids)
-            labels = self.label_encoder.inverse_transform(ner_pred)
-            tokens, labels = self.remove_special_tokens(tokens, labels)
-            output_str = ''
-            for char, char_label in zip(tokens, labels):
-                if char_label in ['s', 'e']:
-                    output_str += char + ' '
-                else:
-                    output_str += char
-            result_list.append(output_str)
+        flat = None
+        label_dict = {}
+        for problem, decoder in self.decoder_dict_by_problem.items():
+            problem_flat = decoder.flatten(pred, problem, input_file_or_list)
+            if flat is None:
+                flat = problem_flat
+            label_dict[problem] = decoder.labels[problem_flat['label_ids']]
+
+        bounds = np.cumsum(flat['lengths'])
+        result_list = []
+        for end, length in zip(bounds, flat['lengths']):
+            result_list.append([
+                dict([('char', flat['tokens'][ind])] + [
+                    (problem, label_dict[problem][ind]) for problem in self.problem_list])
+                for ind in range(end - length, end)])
         return result_list
+
+
+def dump_teacher_logits(params, store_dir):
+    """Run teacher checkpoint over the train set of seq_tag problems once
+    and dump top k emission logits and viterbi tags to TeacherLogitsStore
+
+    Examples are stored in the order the problem generator yields them,
+    which is how create_generator looks them up at student training.
+
+    Arguments:
+        params {Params} -- params, assign_problem should be called
+            with ckpt_dir pointing to the teacher checkpoint
+        store_dir {str} -- dir to write the store
+    """
+    params.crf_decode_on_host = True
+    # teacher targets should be computed with unmasked inputs
+    params.augument_mask_lm = False
+
+    model = BertMultiTask(params=params)
+    estimator = Estimator(
+        model.get_model_fn(warm_start=False),
+        model_dir=params.ckpt_dir,
+        params=params,
+        config=tf.estimator.RunConfig(
+            log_step_count_steps=params.log_every_n_steps))
+
+    input_keys = ['input_ids', 'input_mask', 'segment_ids']
+    for problem_dict in params.run_problem_list:
+        for problem in problem_dict:
+            if params.problem_type[problem] != 'seq_tag':
+                continue
+
+            def gen():
+                for example in params.read_data_fn[problem](params, 'train'):
+                    yield {k: example[k] for k in input_keys}
+
+            def input_fn():
+                dataset = tf.data.Dataset.from_generator(
+                    gen,
+                    output_types={k: tf.int32 for k in input_keys},
+                    output_shapes={k: [params.max_seq_len] for k in input_keys})
+                return dataset.batch(params.batch_size*2)
+
+            num_examples = sum(1 for _ in gen())
+            store = TeacherLogitsStore.create(
+                store_dir, problem, num_examples, params.max_seq_len,
+                params.teacher_logits_top_k, params.num_classes[problem])
+
+            decoder = ViterbiDecoder(
+                estimator.get_variable_value(
+                    '%s/crf_transition' % model.get_top_scope_name(problem)),
+                num_threads=params.crf_decode_threads)
+
+            def write_batch(start_index, batch):
+                logits = np.stack([p[problem] for p in batch])
+                seq_length = np.array(
+                    [np.sum(np.array(p['input_ids']) != 0) for p in batch])
+                tags, _ = decoder.decode(logits, seq_length)
+                store.write(start_index, logits, tags)
+
+            start_index = 0
+            batch = []
+            for p in tqdm(estimator.predict(input_fn=input_fn),
+                          total=num_examples, desc='Dumping %s' % problem):
+                batch.append(p)
+                if len(batch) == params.batch_size*2:
+                    write_batch(start_index, batch)
+                    start_index += len(batch)
+                    batch = []
+            if batch:
+                write_batch(start_index, batch)
+            store.flush()
+
+
+def get_predict_variable_names(params):
+    """Build predict graph of params to find out variables used by prediction
+
+    Returns:
+        list -- variable names
+    """
+    with tf.Graph().as_default():
+        tf.train.get_or_create_global_step()
+        features = {
+            k: tf.placeholder(tf.int32, [None, params.max_seq_len], name=k)
+            for k in ['input_ids', 'input_mask', 'segment_ids']}
+        model = BertMultiTask(params=params)
+        model.get_model_fn(warm_start=False)(
+            features, None, tf.estimator.ModeKeys.PREDICT, params)
+        return [v.op.name for v in tf.global_variables()]
+
+
+def save_variables(value_dict, save_path):
+    """Save numpy values as a checkpoint
+
+    Arguments:
+        value_dict {dict} -- key: variable name, value: np.ndarray
+        save_path {str} -- checkpoint prefix, e.g. <dir>/model.ckpt
+    """
+    with tf.Graph().as_default():
+        var_list = []
+        assign_op_list = []
+        feed_dict = {}
+        for var_name, value in value_dict.items():
+            var = tf.get_variable(
+                var_name, shape=value.shape, dtype=tf.as_dtype(value.dtype),
+                trainable=False)
+            value_placeholder = tf.placeholder(var.dtype, value.shape)
+            assign_op_list.append(tf.assign(var, value_placeholder))
+            feed_dict[value_placeholder] = value
+            var_list.append(var)
+
+        saver = tf.train.Saver(var_list=var_list, sharded=True)
+        with tf.Session() as sess:
+            sess.run(assign_op_list, feed_dict=feed_dict)
+            saver.save(sess, save_path, write_meta_graph=False)
+
+
+def write_predict_files(params, export_dir):
+    """Write vocab, bert config, label encoders and params.json
+    of params to export_dir, which are needed besides checkpoint
+    to predict, see Params.from_predict_dir"""
+    shutil.copy2(params.vocab_file, export_dir)
+    with open(os.path.join(export_dir, 'bert_config.json'), 'w') as f:
+        f.write(params.bert_config.to_json_string())
+    for le_path in glob.glob(os.path.join(params.ckpt_dir, '*_label_encoder.pkl')):
+        shutil.copy2(le_path, export_dir)
+    params_path = params.params_path
+    params.params_path = os.path.join(export_dir, 'params.json')
+    params.to_json()
+    params.params_path = params_path
+
+
+def export_inference_checkpoint(params, export_dir, dtype='float32'):
+    """Export an inference only checkpoint of params.ckpt_dir.
+
+    Only variables used by prediction are kept, optimizer slots and
+    other training states are dropped. Float variables are stored in
+    dtype and cast back to float32 when restored, see CastingSaverBuilder.
+    Vocab, bert config, label encoders and params.json are copied to
+    export_dir, and the whole dir is archived to export_dir.tar.gz.
+
+    Arguments:
+        params {Params} -- params, assign_problem should be called
+            with ckpt_dir pointing to the trained checkpoint
+        export_dir {str} -- dir to write the inference checkpoint
+
+    Keyword Arguments:
+        dtype {str} -- float32 or float16 (default: {'float32'})
+
+    Returns:
+        str -- path of the archive
+    """
+    checkpoint_path = tf.train.latest_checkpoint(params.ckpt_dir)
+    if checkpoint_path is None:
+        raise ValueError('No checkpoint found in %s' % params.ckpt_dir)
+    if dtype not in ('float32', 'float16'):
+        raise ValueError('dtype should be float32 or float16, got %s' % dtype)
+
+    var_name_list = get_predict_variable_names(params)
+    reader = tf.train.load_checkpoint(checkpoint_path)
+    if os.path.exists(export_dir):
+        shutil.rmtree(export_dir)
+    os.makedirs(export_dir)
+
+    value_dict = {}
+    for var_name in var_name_list:
+        value = reader.get_tensor(var_name)
+        if value.dtype == np.float32:
+            value = value.astype(dtype)
+        value_dict[var_name] = value
+    save_variables(value_dict, os.path.join(export_dir, 'model.ckpt'))
+    write_predict_files(params, export_dir)
+
+    archive_path = shutil.make_archive(export_dir, 'gztar', export_dir)
+
+    def get_size(pattern):
+        return sum(os.path.getsize(f) for f in glob.glob(pattern))
+    tf.logging.info(
+        'Exported %d variables in %s. Checkpoint size: %.1f MB -> %.1f MB, '
+        'archive: %s %.1f MB' % (
+            len(var_name_list), dtype,
+            get_size(checkpoint_path + '.data-*') / 1024**2,
+            get_size(os.path.join(export_dir, 'model.ckpt.data-*')) / 1024**2,
+            archive_path, os.path.getsize(archive_path) / 1024**2))
+    return archive_path
+
+
+def export_numpy_weights(params, weight_dir=None):
+    """Export weights of the latest checkpoint of params.ckpt_dir for
+    NumpyBert, one float32 .npy per weight plus a manifest with bert
+    config and heads. Query, key and value kernels of each layer are
+    fused into one [hidden_size, 3*hidden_size] kernel.
+
+    Arguments:
+        params {Params} -- params of the checkpoint
+
+    Keyword Arguments:
+        weight_dir {str} -- dir to write weights, defaults to
+            params.ckpt_dir/numpy_weights (default: {None})
+
+    Returns:
+        str -- weight_dir
+    """
+    checkpoint_path = tf.train.latest_checkpoint(params.ckpt_dir)
+    if checkpoint_path is None:
+        raise ValueError('No checkpoint found in %s' % params.ckpt_dir)
+    if params.label_transfer:
+        raise ValueError('NumpyBert does not support label_transfer')
+    if weight_dir is None:
+        weight_dir = os.path.join(params.ckpt_dir, WEIGHT_DIR_NAME)
+
+    model = BertMultiTask(params=params)
+    bert_config = model.get_bert_config()
+    head_dict = {}
+    for problem_dict in params.run_problem_list:
+        for problem in problem_dict:
+            if params.problem_type[problem] not in ('seq_tag', 'cls'):
+                raise ValueError(
+                    'NumpyBert supports seq_tag and cls problems, got %s: %s' % (
+                        problem, params.problem_type[problem]))
+            head_dict[problem] = {
+                'type': params.problem_type[problem],
+                'scope': model.get_top_scope_name(problem),
+                'num_layers': model.get_problem_depth(problem, bert_config)}
+
+    reader = tf.train.load_checkpoint(checkpoint_path)
+    weight_dict = {}
+
+    def add_weight(name, value=None):
+        if value is None:
+            value = reader.get_tensor(name)
+        weight_dict[name] = np.ascontiguousarray(value, dtype=np.float32)
+
+    for name in ['word_embeddings', 'token_type_embeddings', 'position_embeddings',
+                 'LayerNorm/gamma', 'LayerNorm/beta']:
+        add_weight('bert/embeddings/%s' % name)
+    for layer_idx in range(max([head['num_layers'] for head in head_dict.values()])):
+        prefix = 'bert/encoder/layer_%d/' % layer_idx
+        for var_type in ['kernel', 'bias']:
+            add_weight(prefix + 'attention/self/qkv/%s' % var_type, np.concatenate(
+                [reader.get_tensor(prefix + 'attention/self/%s/%s' % (name, var_type))
+                 for name in ['query', 'key', 'value']], axis=-1))
+            for name in ['attention/output/dense', 'intermediate/dense', 'output/dense']:
+                add_weight(prefix + '%s/%s' % (name, var_type))
+        for name in ['attention/output/LayerNorm', 'output/LayerNorm']:
+            add_weight(prefix + '%s/gamma' % name)
+            add_weight(prefix + '%s/beta' % name)
+    if any([head['type'] == 'cls' for head in head_dict.values()]):
+        add_weight('bert/pooler/dense/kernel')
+        add_weight('bert/pooler/dense/bias')
+    for head in head_dict.values():
+        add_weight('%s/dense/kernel' % head['scope'])
+        add_weight('%s/dense/bias' % head['scope'])
+        if head['type'] == 'seq_tag':
+            add_weight('%s/crf_transition' % head['scope'])
+
+    if os.path.exists(weight_dir):
+        shutil.rmtree(weight_dir)
+    os.makedirs(weight_dir)
+    for name, value in weight_dict.items():
+        np.save(os.path.join(weight_dir, weight_file_name(name)), value)
+    # manifest is written last, a partial export is not loaded
+    with open(os.path.join(weight_dir, MANIFEST_NAME), 'w', encoding='utf8') as f:
+        json.dump({
+            'checkpoint': os.path.basename(checkpoint_path),
+            'bert_config': bert_config.to_dict(),
+            'heads': head_dict,
+            'weights': sorted(weight_dict)}, f, indent=2)
+    tf.logging.info('Exported %d weights of %s to %s, %.1f MB' % (
+        len(weight_dict), checkpoint_path, weight_dir,
+        sum([value.nbytes for value in weight_dict.values()]) / 1024**2))
+    return weight_dir
+
+
+def quantize_checkpoint(params, quant_dir=None, num_examples=512):
+    """Post-training int8 quantization of the latest checkpoint of
+    params.ckpt_dir for QuantizedNumpyBert.
+
+    Float weights are exported with export_numpy_weights if needed,
+    activation ranges are calibrated on the first num_examples examples
+    of the eval problem generators, then kernels of encoder, pooler and
+    heads are quantized, see quantization.quantize_numpy_weights.
+
+    Arguments:
+        params {Params} -- params, assign_problem should be called
+            with ckpt_dir pointing to the trained checkpoint
+
+    Keyword Arguments:
+        quant_dir {str} -- dir to write int8 weights, defaults to
+            params.ckpt_dir/numpy_weights_int8 (default: {None})
+        num_examples {int} -- number of calibration examples (default: {512})
+
+    Returns:
+        str -- quant_dir
+    """
+    if quant_dir is None:
+        quant_dir = os.path.join(params.ckpt_dir, INT8_WEIGHT_DIR_NAME)
+    weight_dir = os.path.join(params.ckpt_dir, WEIGHT_DIR_NAME)
+    NumpyBert.from_checkpoint(params.ckpt_dir, weight_dir)
+
+    example_list = list(itertools.islice(
+        create_generator(params, 'eval', epoch=1), num_examples))
+    activation_range = calibrate(
+        weight_dir, example_list, batch_size=params.batch_size)
+    quantize_numpy_weights(weight_dir, quant_dir, activation_range)
+
+    def get_size(weight_dir):
+        return sum(os.path.getsize(f) for f in glob.glob(
+            os.path.join(weight_dir, '*.npy')))
+    tf.logging.info(
+        'Calibrated %d dense layers on %d examples. Weights: %.1f MB -> %.1f MB' % (
+            len(activation_range), len(example_list),
+            get_size(weight_dir) / 1024**2, get_size(quant_dir) / 1024**2))
+    return quant_dir
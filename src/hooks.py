@@ -0,0 +1,75 @@
+import time
+
+import numpy as np
+import tensorflow as tf
+
+
+class StepTimeHook(tf.train.SessionRunHook):
+    """Record wall time of every training step and log the mean at the end
+
+    Keyword Arguments:
+        name {str} -- name in log (default: {''})
+        skip_steps {int} -- first steps excluded from mean
+            as warm up (default: {10})
+    """
+
+    def __init__(self, name='', skip_steps=10):
+        self.name = name
+        self.skip_steps = skip_steps
+        self.step_time_list = []
+
+    def before_run(self, run_context):
+        self._start_time = time.time()
+
+    def after_run(self, run_context, run_values):
+        self.step_time_list.append(time.time() - self._start_time)
+
+    @property
+    def mean_step_time(self):
+        step_time_list = self.step_time_list[self.skip_steps:] or \
+            self.step_time_list
+        if not step_time_list:
+            return 0.0
+        return float(np.mean(step_time_list))
+
+    def end(self, session):
+        tf.logging.info('%s: %d steps, %.2f ms/step' % (
+            self.name, len(self.step_time_list), self.mean_step_time*1000))
+
+
+class PeakMemoryHook(tf.train.SessionRunHook):
+    """Log peak memory allocated by the allocator of device
+
+    Keyword Arguments:
+        every_n_iter {int} -- log every n steps (default: {100})
+        device {str} -- device to report, default device if None,
+            e.g. '/gpu:0' (default: {None})
+    """
+
+    def __init__(self, every_n_iter=100, device=None):
+        self.every_n_iter = every_n_iter
+        self.device = device
+        self.peak_bytes = 0
+
+    def begin(self):
+        self._iter_count = 0
+        with tf.device(self.device):
+            self._max_bytes_in_use = tf.contrib.memory_stats.MaxBytesInUse()
+
+    def before_run(self, run_context):
+        if self._iter_count % self.every_n_iter == 0:
+            return tf.train.SessionRunArgs(self._max_bytes_in_use)
+        return None
+
+    def after_run(self, run_context, run_values):
+        if run_values.results is not None:
+            self.peak_bytes = max(self.peak_bytes, int(run_values.results))
+            tf.logging.info('Peak memory: %.2f MB' % (
+                self.peak_bytes / 1024 / 1024))
+        self._iter_count += 1
+
+    def end(self, session):
+        self.peak_bytes = max(
+            self.peak_bytes, int(session.run(self._max_bytes_in_use)))
+        tf.logging.info('Peak memory: %.2f MB' % (
+            self.peak_bytes / 1024 / 1024))
@@ -1,3 +1,4 @@
+import itertools
 from collections import defaultdict
 from tqdm import tqdm
 
@@ -7,7 +8,8 @@ from bert.tokenization import FullTokenizer
 
 from .params import Params
 from .utils import (create_generator, tokenize_text_with_seqs, truncate_seq_pair,
-                    add_special_tokens_with_seqs, create_mask_and_padding)
+                    add_special_tokens_with_seqs, create_mask_and_padding,
+                    get_window_starts)
 
 
 def train_eval_input_fn(config: Params, mode='train', epoch=None):
@@ -53,6 +55,23 @@ def train_eval_input_fn(config: Params, mode='train', epoch=None):
                 output_type.update({'%s_label_ids' % problem: tf.int32})
                 output_shapes.update(
                     {'%s_label_ids' % problem: [config.max_seq_len]})
+                if config.train_window_stride:
+                    output_type.update({'%s_label_mask' % problem: tf.int32})
+                    output_shapes.update(
+                        {'%s_label_mask' % problem: [config.max_seq_len]})
+                if config.use_teacher_logits_store and mode == 'train':
+                    output_type.update({
+                        '%s_teacher_topk_ids' % problem: tf.int32,
+                        '%s_teacher_topk_logits' % problem: tf.float32,
+                        '%s_teacher_tags' % problem: tf.int32
+                    })
+                    output_shapes.update({
+                        '%s_teacher_topk_ids' % problem: [
+                            config.max_seq_len, config.teacher_logits_top_k],
+                        '%s_teacher_topk_logits' % problem: [
+                            config.max_seq_len, config.teacher_logits_top_k],
+                        '%s_teacher_tags' % problem: [config.max_seq_len]
+                    })
             elif problem_type in ['cls']:
                 output_type.update({'%s_label_ids' % problem: tf.int32})
                 output_shapes.update({'%s_label_ids' % problem: []})
@@ -88,60 +107,204 @@ def train_eval_input_fn(config: Params, mode='train', epoch=None):
     return dataset
 
 
-def predict_input_fn(input_file_or_list, config: Params, mode='predict'):
+def create_predict_example(doc, tokenizer, config: Params):
+    """Tokenize, truncate and pad a raw string to max_seq_len
 
-    # if is string, treat it as path to file
-    if isinstance(input_file_or_list, str):
-        inputs = open(input_file_or_list, 'r', encoding='utf8').readlines()
-    else:
-        inputs = input_file_or_list
+    Arguments:
+        doc {str} -- raw text
+        tokenizer {FullTokenizer} -- tokenizer
+        config {Params} -- params
 
-    tokenizer = FullTokenizer(config.vocab_file)
+    Returns:
+        dict -- input_ids, input_mask and segment_ids
+    """
+    inputs_a = list(doc)
+    tokens, target = tokenize_text_with_seqs(
+        tokenizer, inputs_a, None)
 
-    # data_dict = {}
-    # data_dict['input_ids'] = []
-    # data_dict['input_mask'] = []
-    # data_dict['segment_ids'] = []
+    tokens_a, tokens_b, target = truncate_seq_pair(
+        tokens, None, target, config.max_seq_len)
 
-    def gen():
-        data_dict = {}
-        for doc in tqdm(inputs, desc='Processing Inputs'):
-            inputs_a = list(doc)
-            tokens, target = tokenize_text_with_seqs(
-                tokenizer, inputs_a, None)
+    return create_example_from_tokens(tokens_a, tokenizer, config.max_seq_len)
+
+
+def create_example_from_tokens(tokens_a, tokenizer, max_length):
+    """Add [CLS], [SEP] and padding to tokens
+
+    Arguments:
+        tokens_a {list} -- tokens, at most max_length - 2
+        tokenizer {FullTokenizer} -- tokenizer
+        max_length {int} -- length after padding
+
+    Returns:
+        dict -- input_ids, input_mask and segment_ids
+    """
+    tokens, segment_ids, _ = add_special_tokens_with_seqs(
+        tokens_a, None, None)
+
+    input_mask, tokens, segment_ids, _ = create_mask_and_padding(
+        tokens, segment_ids, None, max_length)
+
+    input_ids = tokenizer.convert_tokens_to_ids(tokens)
+    return {
+        'input_ids': input_ids,
+        'input_mask': input_mask,
+        'segment_ids': segment_ids}
+
+
+def tokenize_with_offsets(doc, tokenizer):
+    """Tokenize raw text char by char, keeping the char index of
+    every token. Chars dropped by tokenizer, like white spaces, have
+    no token.
+
+    Arguments:
+        doc {str} -- raw text
+        tokenizer {FullTokenizer} -- tokenizer
+
+    Returns:
+        tuple -- (tokens, char_offsets)
+    """
+    tokens = []
+    char_offsets = []
+    for char_ind, char in enumerate(doc):
+        char_tokens = tokenizer.tokenize(char)
+        tokens.extend(char_tokens)
+        char_offsets.extend([char_ind] * len(char_tokens))
+    return tokens, char_offsets
+
+
+def create_predict_windows(doc, tokenizer, config: Params):
+    """Split a raw string into overlapping windows of
+    config.predict_window_size tokens, including [CLS] and [SEP].
+    Windows start every config.predict_window_stride tokens, and the
+    last window ends at the last token.
+
+    Arguments:
+        doc {str} -- raw text
+        tokenizer {FullTokenizer} -- tokenizer
+        config {Params} -- params
+
+    Returns:
+        tuple -- (tokens, char_offsets, window_list)
+            window_list: list of (start token index, example)
+    """
+    tokens, char_offsets = tokenize_with_offsets(doc, tokenizer)
+    window_length = config.predict_window_size - 2
+    num_tokens = len(tokens)
 
-            tokens_a, tokens_b, target = truncate_seq_pair(
-                tokens, None, target, config.max_seq_len)
+    start_list = get_window_starts(
+        num_tokens, window_length, config.predict_window_stride)
 
-            tokens, segment_ids, target = add_special_tokens_with_seqs(
-                tokens_a, tokens_b, target)
+    window_list = [
+        (start, create_example_from_tokens(
+            tokens[start:start+window_length], tokenizer,
+            config.predict_window_size))
+        for start in start_list]
+    return tokens, char_offsets, window_list
 
-            input_mask, tokens, segment_ids, target = create_mask_and_padding(
-                tokens, segment_ids, target, config.max_seq_len)
 
-            input_ids = tokenizer.convert_tokens_to_ids(tokens)
-            data_dict['input_ids'] = input_ids
-            data_dict['input_mask'] = input_mask
-            data_dict['segment_ids'] = segment_ids
+def sort_in_buffer(iterable, buffer_size, key):
+    """Sort items by key within consecutive buffers of buffer_size
+    items, so at most buffer_size items are held at a time"""
+    iterator = iter(iterable)
+    while True:
+        buffer = list(itertools.islice(iterator, buffer_size))
+        if not buffer:
+            return
+        for item in sorted(buffer, key=key):
+            yield item
+
+
+def iter_file_chunks(input_file, chunk_size):
+    """Read lines of a text file, chunk_size lines at a time
+
+    Yields:
+        list -- lines of a chunk, with line breaks
+    """
+    with open(input_file, 'r', encoding='utf8') as f:
+        while True:
+            chunk = list(itertools.islice(f, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+def predict_input_fn(input_file_or_list, config: Params, mode='predict'):
+    """Input fn of prediction. Each input is padded to the longest one
+    in its batch. If config.predict_sort_by_length, inputs are sorted by
+    length within buffers of config.predict_sort_buffer_batches batches,
+    so a batch holds inputs of similar length and inputs are read lazily.
+    'example_index', the position in input, is included to restore the
+    order, see reorder_predictions.
+
+    Inputs are raw strings, or examples created by create_predict_example
+    or create_predict_windows.
+    """
+
+    def iter_inputs():
+        # if is string, treat it as path to file, read lazily
+        if isinstance(input_file_or_list, str):
+            with open(input_file_or_list, 'r', encoding='utf8') as f:
+                for line in f:
+                    yield line
+        else:
+            for doc in input_file_or_list:
+                yield doc
+
+    tokenizer = FullTokenizer(config.vocab_file)
+    input_keys = ['input_ids', 'input_mask', 'segment_ids']
+
+    def gen():
+        example_iter = enumerate(
+            doc if isinstance(doc, dict) else create_predict_example(
+                doc, tokenizer, config)
+            for doc in tqdm(iter_inputs(), desc='Processing Inputs'))
+        if config.predict_sort_by_length:
+            example_iter = sort_in_buffer(
+                example_iter, config.batch_size*2*config.predict_sort_buffer_batches,
+                key=lambda x: sum(x[1]['input_mask']))
+        for example_index, example in example_iter:
+            seq_length = sum(example['input_mask'])
+            data_dict = {k: example[k][:seq_length] for k in input_keys}
+            data_dict['example_index'] = example_index
             yield data_dict
     output_type = {
         'input_ids': tf.int32,
         'input_mask': tf.int32,
-        'segment_ids': tf.int32
+        'segment_ids': tf.int32,
+        'example_index': tf.int32
     }
     output_shapes = {
-        'input_ids': [config.max_seq_len],
-        'input_mask': [config.max_seq_len],
-        'segment_ids': [config.max_seq_len]
+        'input_ids': [None],
+        'input_mask': [None],
+        'segment_ids': [None],
+        'example_index': []
     }
-    # dataset = tf.data.Dataset.from_tensor_slices(data_dict)
     dataset = tf.data.Dataset.from_generator(
         gen, output_types=output_type, output_shapes=output_shapes)
-    dataset = dataset.batch(config.batch_size*2)
+    # [PAD] id, input mask and segment id of padding are all 0
+    dataset = dataset.padded_batch(
+        config.batch_size*2, padded_shapes=output_shapes)
 
     return dataset
 
 
+def reorder_predictions(pred):
+    """Restore input order of predictions of predict_input_fn
+
+    Arguments:
+        pred {iterable} -- predictions with 'example_index'
+
+    Returns:
+        list -- predictions in input order
+    """
+    pred_list = list(pred)
+    result = [None] * len(pred_list)
+    for p in pred_list:
+        result[p['example_index']] = p
+    return result
+
+
 def no_dataset_input_fn(config: Params, mode='train', epoch=None):
     """This function is for evaluation only
 
@@ -2,13 +2,28 @@ import tensorflow as tf
 from tensorflow.contrib import autograph
 import pickle
 import os
+import re
+from copy import deepcopy
 
 from bert import modeling
 from bert.modeling import BertModel
 
 from .params import Params
-from .optimizer import AdamWeightDecayOptimizer
+from .optimizer import (AdamWeightDecayOptimizer, LAMBOptimizer,
+                        FusedAdamWeightDecayOptimizer,
+                        QuantizedAdamWeightDecayOptimizer)
+from .ckpt_restore_hook import PartialRestoreSaver, CastingSaverBuilder
 from .top import PreTrain, SequenceLabel, Classification, MaskLM, LabelTransferHidden
+from .encoder import (get_layer_bert_config, embedding, transformer_layer,
+                      pooler, recompute_encoder, is_pruned)
+from .hooks import PeakMemoryHook
+from .xla import xla_jit_scope
+
+
+TOP_LAYERS = {
+    'seq_tag': SequenceLabel,
+    'cls': Classification
+}
 
 
 @autograph.convert()
@@ -48,8 +63,54 @@ def filter_loss(loss, features, problem):
 class BertMultiTask():
     def __init__(self, params: Params):
         self.config = params
+        # set by training loop of layer_freeze_schedule
+        self.num_frozen_layers = 0
 
-    def body(self, features, mode):
+    def get_bert_config(self):
+        """Bert config of the model to train. Student config is used
+        for distillation, and only layers needed by run problems are built.
+        """
+        config = self.config
+        if config.distillation:
+            bert_config = config.student_bert_config
+        else:
+            bert_config = config.bert_config
+
+        num_layers = max([
+            config.problem_encoder_layers.get(
+                problem, bert_config.num_hidden_layers)
+            for problem_dict in config.run_problem_list
+            for problem in problem_dict])
+        if num_layers < bert_config.num_hidden_layers:
+            bert_config = deepcopy(bert_config)
+            bert_config.num_hidden_layers = num_layers
+        return bert_config
+
+    def get_problem_depth(self, problem, bert_config):
+        """Number of encoder layers the final head of problem is on"""
+        return min(
+            self.config.problem_encoder_layers.get(
+                problem, bert_config.num_hidden_layers),
+            bert_config.num_hidden_layers)
+
+    def get_exit_layers(self, problem, bert_config):
+        """Layers to attach early exit heads of problem"""
+        depth = self.get_problem_depth(problem, bert_config)
+        return sorted(set(
+            [l for l in self.config.early_exit_layers if 0 < l < depth]))
+
+    def get_top_scope_name(self, problem, num_layers=None):
+        """Variable scope of problem top. If num_layers is specified,
+        the scope of early exit head after that layer is returned"""
+        top_name = self.config.share_top.get(problem, problem)
+        top_scope_name = '%s_top' % top_name
+        if num_layers is not None:
+            top_scope_name = '%s_layer_%d' % (top_scope_name, num_layers)
+        if self.config.label_transfer:
+            top_scope_name = top_scope_name + '_lt'
+        return top_scope_name
+
+    def body(self, features, mode, bert_config=None):
         """Body of the model, aka Bert
 
         Arguments:
@@ -57,6 +118,10 @@ class BertMultiTask():
                 keys: input_ids, input_mask, segment_ids
             mode {mode} -- mode
 
+        Keyword Arguments:
+            bert_config {BertConfig} -- if None, student_bert_config is used
+                for distillation, otherwise bert_config (default: {None})
+
         Returns:
             dict -- features extracted from bert.
                 keys: 'seq', 'pooled', 'all', 'embed'
@@ -72,20 +137,31 @@ class BertMultiTask():
         """
 
         config = self.config
+        if bert_config is None:
+            bert_config = self.get_bert_config()
         input_ids = features["input_ids"]
         input_mask = features["input_mask"]
         segment_ids = features["segment_ids"]
         is_training = (mode == tf.estimator.ModeKeys.TRAIN)
-        model = BertModel(
-            config=config.bert_config,
-            is_training=is_training,
-            input_ids=input_ids,
-            input_mask=input_mask,
-            token_type_ids=segment_ids,
-            use_one_hot_embeddings=config.use_one_hot_embeddings)
-
-        feature_dict = {}
-        for logit_type in ['seq', 'pooled', 'all', 'embed', 'embed_table']:
+        if is_training and config.recompute_grad:
+            feature_dict = self.recompute_body(features, bert_config)
+            logit_type_list = []
+        elif is_pruned(bert_config):
+            # BertModel builds layers of the same size
+            feature_dict = self.layer_body(features, bert_config, is_training)
+            logit_type_list = []
+        else:
+            model = BertModel(
+                config=bert_config,
+                is_training=is_training,
+                input_ids=input_ids,
+                input_mask=input_mask,
+                token_type_ids=segment_ids,
+                use_one_hot_embeddings=config.use_one_hot_embeddings)
+            feature_dict = {}
+            logit_type_list = ['seq', 'pooled', 'all', 'embed', 'embed_table']
+
+        for logit_type in logit_type_list:
             if logit_type == 'seq':
                                 # tensor, [batch_size, seq_length, hidden_size]
                 feature_dict[logit_type] = model.get_sequence_output()
@@ -109,6 +185,181 @@ class BertMultiTask():
 
         return feature_dict
 
+    def recompute_body(self, features, bert_config):
+        """Same as BertModel in train mode, except that activations inside
+        encoder layers are recomputed in backward pass instead of kept in
+        memory, see encoder.recompute_encoder.
+
+        Arguments:
+            features {dict} -- feature dict
+            bert_config {BertConfig} -- bert config
+
+        Returns:
+            dict -- same as body
+        """
+        bert_config = get_layer_bert_config(bert_config, is_training=True)
+        input_ids = features['input_ids']
+        with tf.variable_scope('bert', use_resource=True):
+            embedding_output, embedding_table = embedding(
+                bert_config, input_ids, features['segment_ids'],
+                self.config.use_one_hot_embeddings)
+            with tf.variable_scope('encoder'):
+                attention_mask = modeling.create_attention_mask_from_input_mask(
+                    input_ids, features['input_mask'])
+                all_layer_outputs = recompute_encoder(
+                    embedding_output, attention_mask, bert_config)
+
+        return {
+            'seq': all_layer_outputs[-1],
+            'pooled': pooler(all_layer_outputs[-1], bert_config),
+            'all': all_layer_outputs,
+            'embed': embedding_output,
+            'embed_table': embedding_table
+        }
+
+    def layer_body(self, features, bert_config, is_training,
+                   head_mask_list=None, ffn_mask_list=None):
+        """Same as BertModel, built layer by layer with
+        encoder.transformer_layer, so layers of pruned bert_config can
+        have different sizes, and heads and intermediate activations
+        can be masked.
+
+        Arguments:
+            features {dict} -- feature dict
+            bert_config {BertConfig} -- bert config
+            is_training {bool} -- if True, dropout is applied
+
+        Keyword Arguments:
+            head_mask_list {list} -- head_mask of each layer,
+                see transformer_layer (default: {None})
+            ffn_mask_list {list} -- ffn_mask of each layer,
+                see transformer_layer (default: {None})
+
+        Returns:
+            dict -- same as body
+        """
+        bert_config = get_layer_bert_config(bert_config, is_training)
+        input_ids = features['input_ids']
+        with tf.variable_scope('bert'):
+            embedding_output, embedding_table = embedding(
+                bert_config, input_ids, features['segment_ids'],
+                self.config.use_one_hot_embeddings)
+            with tf.variable_scope('encoder'):
+                attention_mask = modeling.create_attention_mask_from_input_mask(
+                    input_ids, features['input_mask'])
+                all_layer_outputs = []
+                layer_output = embedding_output
+                for layer_idx in range(bert_config.num_hidden_layers):
+                    layer_output = transformer_layer(
+                        layer_output, attention_mask, bert_config, layer_idx,
+                        head_mask=head_mask_list[layer_idx] if head_mask_list else None,
+                        ffn_mask=ffn_mask_list[layer_idx] if ffn_mask_list else None)
+                    all_layer_outputs.append(layer_output)
+
+        return {
+            'seq': all_layer_outputs[-1],
+            'pooled': pooler(all_layer_outputs[-1], bert_config),
+            'all': all_layer_outputs,
+            'embed': embedding_output,
+            'embed_table': embedding_table
+        }
+
+    def teacher(self, features):
+        """Teacher model for distillation.
+
+        Teacher variables are created under 'teacher' scope as
+        non-trainable variables and initialized from teacher_checkpoint.
+
+        Arguments:
+            features {dict} -- feature dict
+
+        Returns:
+            dict -- key: problem, value: teacher outputs,
+                (logits, viterbi tags) for seq_tag, (logits, ) for cls
+        """
+        def non_trainable_getter(getter, *args, **kwargs):
+            kwargs['trainable'] = False
+            return getter(*args, **kwargs)
+
+        mode = tf.estimator.ModeKeys.PREDICT
+        teacher_dict = {}
+        assignment_map = {'bert/': 'teacher/bert/'}
+        with tf.variable_scope('teacher', custom_getter=non_trainable_getter):
+            hidden_feature = self.body(
+                features, mode, bert_config=self.config.bert_config)
+            seq_length = tf.reduce_sum(features['input_mask'], axis=-1)
+            if self.config.label_transfer:
+                hidden_feature = LabelTransferHidden(self.config)(
+                    features, hidden_feature, mode)
+
+            for problem_dict in self.config.run_problem_list:
+                for problem in problem_dict:
+                    top_scope_name = self.get_top_scope_name(problem)
+                    scope_list = [top_scope_name]
+                    if self.config.label_transfer:
+                        # heads feeding LabelTransferHidden
+                        scope_list.append(
+                            '%s_top' % self.config.share_top.get(problem, problem))
+                    for scope_name in scope_list:
+                        assignment_map['%s/' % scope_name] = \
+                            'teacher/%s/' % scope_name
+
+                    with tf.variable_scope(top_scope_name, reuse=tf.AUTO_REUSE):
+                        if self.config.problem_type[problem] == 'seq_tag':
+                            seq_tag = SequenceLabel(self.config)
+                            tags = seq_tag(features, hidden_feature, mode, problem)
+                            logits = tf.stop_gradient(seq_tag.get_logit())
+                            if self.config.crf_decode_on_host:
+                                # predict mode returns logits, see SequenceLabel
+                                tags, _ = tf.contrib.crf.crf_decode(
+                                    logits, seq_tag.crf_transition_param, seq_length)
+                            teacher_dict[problem] = (logits, tags)
+                        elif self.config.problem_type[problem] == 'cls':
+                            cls = Classification(self.config)
+                            cls(features, hidden_feature, mode, problem)
+                            teacher_dict[problem] = (
+                                tf.stop_gradient(cls.get_logit()), )
+
+        tf.train.init_from_checkpoint(
+            self.config.teacher_checkpoint, assignment_map)
+        return teacher_dict
+
+    def get_layer_hidden_feature(self, hidden_feature, num_layers):
+        """Get hidden feature of the first num_layers encoder layers.
+        Pooled feature is computed with the pooler of bert.
+
+        Arguments:
+            hidden_feature {dict} -- hidden feature dict extracted by bert
+            num_layers {int} -- number of encoder layers
+
+        Returns:
+            dict -- hidden feature dict
+        """
+        global_step = tf.train.get_or_create_global_step()
+        seq_feature = hidden_feature['all'][num_layers - 1]
+        layer_hidden_feature = dict(hidden_feature)
+        layer_hidden_feature['seq'] = stop_grad(
+            global_step, seq_feature, self.config.freeze_step)
+        layer_hidden_feature['pooled'] = pooler(
+            seq_feature, self.config.bert_config)
+        return layer_hidden_feature
+
+    def get_problem_hidden_feature(self, hidden_feature, problem):
+        """Get hidden feature of the first N encoder layers, where N is
+        specified by problem_encoder_layers.
+
+        Arguments:
+            hidden_feature {dict} -- hidden feature dict extracted by bert
+            problem {str} -- problem name
+
+        Returns:
+            dict -- hidden feature dict
+        """
+        num_layers = self.config.problem_encoder_layers.get(problem)
+        if num_layers is None or num_layers >= len(hidden_feature['all']):
+            return hidden_feature
+        return self.get_layer_hidden_feature(hidden_feature, num_layers)
+
     def top(self, features, hidden_feature, mode):
         """Top model. This fn will return:
         1. loss, if mode is train
@@ -126,6 +377,18 @@ class BertMultiTask():
             hidden_feature = label_transfer_layer(
                 features, hidden_feature, mode)
 
+        distill = self.config.distillation and mode == tf.estimator.ModeKeys.TRAIN
+        if distill and self.config.use_teacher_logits_store:
+            teacher_dict = {
+                problem: (features['%s_teacher_topk_logits' % problem],
+                          features['%s_teacher_tags' % problem],
+                          features['%s_teacher_topk_ids' % problem])
+                for problem_dict in self.config.run_problem_list
+                for problem in problem_dict
+                if '%s_teacher_tags' % problem in features}
+        elif distill:
+            teacher_dict = self.teacher(features)
+
         global_step = tf.train.get_or_create_global_step()
 
         hidden_feature['seq'] = stop_grad(
@@ -146,6 +409,8 @@ class BertMultiTask():
                     return_dict[problem] = pretrain(
                         features, hidden_feature, mode, problem)
                 else:
+                    problem_hidden_feature = self.get_problem_hidden_feature(
+                        hidden_feature, problem)
                     # get features with ind == 1
                     if mode == tf.estimator.ModeKeys.TRAIN:
                         record_ind = tf.cast(
@@ -153,10 +418,10 @@ class BertMultiTask():
                         feature_this_round = {k: tf.boolean_mask(v, record_ind)
                                               for k, v in features.items()}
                         hidden_feature_this_round = {k: tf.boolean_mask(v, record_ind)
-                                                     for k, v in hidden_feature.items()}
+                                                     for k, v in problem_hidden_feature.items()}
                     else:
                         feature_this_round = features
-                        hidden_feature_this_round = hidden_feature
+                        hidden_feature_this_round = problem_hidden_feature
 
                     top_scope_name = '%s_top' % top_name
                     mask = None
@@ -166,19 +431,31 @@ class BertMultiTask():
 
                     with tf.variable_scope(top_scope_name, reuse=tf.AUTO_REUSE):
                         if self.config.problem_type[problem] == 'seq_tag':
-                            seq_tag = SequenceLabel(self.config)
+                            top_layer = SequenceLabel(self.config)
                             return_dict[problem] = \
-                                seq_tag(feature_this_round,
-                                        hidden_feature_this_round, mode, problem, mask)
+                                top_layer(feature_this_round,
+                                          hidden_feature_this_round, mode, problem, mask)
                         elif self.config.problem_type[problem] == 'cls':
-                            cls = Classification(self.config)
+                            top_layer = Classification(self.config)
                             return_dict[problem] = \
-                                cls(feature_this_round,
-                                    hidden_feature_this_round, mode, problem)
+                                top_layer(feature_this_round,
+                                          hidden_feature_this_round, mode, problem)
+
+                        if distill and problem in teacher_dict:
+                            teacher_this_round = [
+                                tf.boolean_mask(t, record_ind)
+                                for t in teacher_dict[problem]]
+                            distill_loss = top_layer.distill_loss(
+                                feature_this_round, problem, *teacher_this_round)
+                            alpha = self.config.distillation_alpha
+                            return_dict[problem] = alpha * return_dict[problem] + \
+                                (1 - alpha) * distill_loss
 
-                        if mode == tf.estimator.ModeKeys.TRAIN:
-                            return_dict[problem] = filter_loss(
-                                return_dict[problem], feature_this_round, problem)
+                    if mode == tf.estimator.ModeKeys.TRAIN:
+                        return_dict[problem] += self.early_exit_loss(
+                            feature_this_round, hidden_feature, record_ind, problem)
+                        return_dict[problem] = filter_loss(
+                            return_dict[problem], feature_this_round, problem)
 
         if self.config.augument_mask_lm and mode == tf.estimator.ModeKeys.TRAIN:
             try:
@@ -190,6 +467,168 @@ class BertMultiTask():
                 pass
         return return_dict
 
+    def early_exit_loss(self, features, hidden_feature, record_ind, problem):
+        """Loss of early exit heads of problem
+
+        Arguments:
+            features {dict} -- feature dict of records of problem
+            hidden_feature {dict} -- hidden feature dict extracted by bert
+            record_ind {tensor} -- bool, records of problem in batch
+            problem {str} -- problem name
+
+        Returns:
+            tensor -- sum of loss of early exit heads, 0 if no head
+        """
+        loss = 0.0
+        top_class = TOP_LAYERS[self.config.problem_type[problem]]
+        for num_layers in self.get_exit_layers(
+                problem, self.get_bert_config()):
+            layer_hidden_feature = self.get_layer_hidden_feature(
+                hidden_feature, num_layers)
+            layer_hidden_feature = {
+                k: tf.boolean_mask(layer_hidden_feature[k], record_ind)
+                for k in ['seq', 'pooled']}
+            with tf.variable_scope(self.get_top_scope_name(problem, num_layers),
+                                   reuse=tf.AUTO_REUSE):
+                exit_head = top_class(self.config)
+                loss += exit_head(
+                    features, layer_hidden_feature,
+                    tf.estimator.ModeKeys.TRAIN, problem)
+        return loss
+
+    def use_early_exit(self, mode):
+        config = self.config
+        return mode == tf.estimator.ModeKeys.PREDICT and \
+            bool(config.early_exit_layers) and \
+            not config.label_transfer and \
+            all([config.problem_type[problem] in TOP_LAYERS
+                 for problem_dict in config.run_problem_list
+                 for problem in problem_dict])
+
+    def early_exit_predict(self, features):
+        """Prediction with confidence based early exit.
+
+        Encoder layers are built one by one. After each layer in
+        early_exit_layers, exit heads predict for sequences left in batch,
+        and sequences whose confidence of every problem passes
+        early_exit_threshold exit with these predictions. The remaining
+        sequences are compacted before going through the next layer.
+
+        Variables are the same as body and top, so the same checkpoint
+        is used.
+
+        Arguments:
+            features {dict} -- feature dict
+
+        Returns:
+            dict -- predictions of problems, and 'exit_layer',
+                number of encoder layers each sequence went through
+        """
+        config = self.config
+        bert_config = get_layer_bert_config(
+            self.get_bert_config(), is_training=False)
+        problem_list = [problem for problem_dict in config.run_problem_list
+                        for problem in problem_dict]
+        depth_dict = {problem: self.get_problem_depth(problem, bert_config)
+                      for problem in problem_list}
+        exit_layers_dict = {problem: self.get_exit_layers(problem, bert_config)
+                            for problem in problem_list}
+        exit_layer_list = set(depth_dict.values())
+        for problem in problem_list:
+            exit_layer_list.update(exit_layers_dict[problem])
+
+        input_ids = features['input_ids']
+        batch_shape = tf.shape(input_ids)[:1]
+        with tf.variable_scope('bert', reuse=tf.AUTO_REUSE):
+            layer_output, _ = embedding(
+                bert_config, input_ids, features['segment_ids'],
+                config.use_one_hot_embeddings)
+            attention_mask = modeling.create_attention_mask_from_input_mask(
+                input_ids, features['input_mask'])
+
+        # index in batch of sequences not exited yet
+        active_ind = tf.range(batch_shape[0])
+        active_features = {k: features[k] for k in [
+            'input_ids', 'input_mask', 'segment_ids']}
+        exit_layer = tf.zeros(batch_shape, dtype=tf.int32)
+        pred_dict = {}
+        for layer_idx in range(max(depth_dict.values())):
+            with tf.variable_scope('bert/encoder', reuse=tf.AUTO_REUSE):
+                layer_output = transformer_layer(
+                    layer_output, attention_mask, bert_config, layer_idx)
+            num_layers = layer_idx + 1
+            if num_layers not in exit_layer_list:
+                continue
+
+            layer_hidden_feature = {
+                'seq': layer_output,
+                'pooled': pooler(layer_output, bert_config)}
+            # sequences can exit only if every problem not finished
+            # yet has a trained exit head here, see early_exit_loss
+            can_exit = all([
+                depth_dict[problem] <= num_layers or
+                num_layers in exit_layers_dict[problem]
+                for problem in problem_list])
+            layer_pred = {}
+            confidence = None
+            for problem in problem_list:
+                if depth_dict[problem] < num_layers:
+                    continue
+                is_final = depth_dict[problem] == num_layers
+                if not is_final and not can_exit:
+                    continue
+                top_scope_name = self.get_top_scope_name(
+                    problem, None if is_final else num_layers)
+                with tf.variable_scope(top_scope_name, reuse=tf.AUTO_REUSE):
+                    top_layer = TOP_LAYERS[config.problem_type[problem]](
+                        config)
+                    layer_pred[problem] = top_layer(
+                        active_features, layer_hidden_feature,
+                        tf.estimator.ModeKeys.PREDICT, problem)
+                    if not is_final:
+                        problem_confidence = top_layer.confidence(
+                            active_features)
+                        confidence = problem_confidence if confidence is None \
+                            else tf.minimum(confidence, problem_confidence)
+
+            # if all problems are on their final heads, every sequence exits
+            if not can_exit:
+                exit_ind = tf.zeros_like(active_ind, dtype=tf.bool)
+            elif confidence is None:
+                exit_ind = tf.ones_like(active_ind, dtype=tf.bool)
+            else:
+                exit_ind = confidence >= config.early_exit_threshold
+            exit_rows = tf.expand_dims(
+                tf.boolean_mask(active_ind, exit_ind), axis=-1)
+
+            # write predictions back to the position in batch
+            for problem, pred in layer_pred.items():
+                if depth_dict[problem] == num_layers:
+                    rows = tf.expand_dims(active_ind, axis=-1)
+                else:
+                    rows = exit_rows
+                    pred = tf.boolean_mask(pred, exit_ind)
+                pred = tf.scatter_nd(
+                    rows, pred, tf.concat([batch_shape, tf.shape(pred)[1:]], axis=0))
+                if problem in pred_dict:
+                    pred_dict[problem] += pred
+                else:
+                    pred_dict[problem] = pred
+            exit_layer += tf.scatter_nd(
+                exit_rows, tf.fill(tf.shape(exit_rows)[:1], num_layers),
+                batch_shape)
+
+            # compact the batch
+            keep_ind = tf.logical_not(exit_ind)
+            active_ind = tf.boolean_mask(active_ind, keep_ind)
+            layer_output = tf.boolean_mask(layer_output, keep_ind)
+            attention_mask = tf.boolean_mask(attention_mask, keep_ind)
+            active_features = {k: tf.boolean_mask(v, keep_ind)
+                               for k, v in active_features.items()}
+
+        pred_dict['exit_layer'] = exit_layer
+        return pred_dict
+
     def create_optimizer(self, init_lr, num_train_steps, num_warmup_steps):
         """Creates an optimizer training op."""
         global_step = tf.train.get_or_create_global_step()
@@ -231,16 +670,56 @@ class BertMultiTask():
         # It is recommended that you use this optimizer for fine tuning, since this
         # is how the model was trained (note that the Adam m/v variables are NOT
         # loaded from init_checkpoint.)
-        optimizer = AdamWeightDecayOptimizer(
+        optimizer_kwargs = {}
+        if self.config.fused_optimizer and self.config.quantize_optimizer_state:
+            raise ValueError(
+                'fused_optimizer and quantize_optimizer_state can not be used together')
+        if self.config.optimizer == 'lamb':
+            if self.config.fused_optimizer or self.config.quantize_optimizer_state:
+                raise ValueError(
+                    'Fused or quantized optimizer is only available for adam')
+            optimizer_class = LAMBOptimizer
+        elif self.config.optimizer == 'adam':
+            if self.config.fused_optimizer:
+                optimizer_class = FusedAdamWeightDecayOptimizer
+            elif self.config.quantize_optimizer_state:
+                optimizer_class = QuantizedAdamWeightDecayOptimizer
+                optimizer_kwargs['block_size'] = self.config.optimizer_state_block_size
+            else:
+                optimizer_class = AdamWeightDecayOptimizer
+        else:
+            raise ValueError('Unknown optimizer: %s' % self.config.optimizer)
+
+        optimizer = optimizer_class(
             learning_rate=learning_rate,
             weight_decay_rate=0.01,
             beta_1=0.9,
             beta_2=0.999,
             epsilon=1e-6,
-            exclude_from_weight_decay=["LayerNorm", "layer_norm", "bias"])
+            exclude_from_weight_decay=["LayerNorm", "layer_norm", "bias"],
+            **optimizer_kwargs)
 
         return optimizer
 
+    def is_frozen(self, var):
+        """Whether var is frozen by num_frozen_layers"""
+        if self.num_frozen_layers <= 0:
+            return False
+        if var.op.name.startswith('bert/embeddings/'):
+            return True
+        layer_match = re.match(r'^bert/encoder/layer_(\d+)/', var.op.name)
+        return layer_match is not None and \
+            int(layer_match.group(1)) < self.num_frozen_layers
+
+    def add_partial_restore_saver(self):
+        checkpoint_path = tf.train.latest_checkpoint(self.config.ckpt_dir)
+        if checkpoint_path is None or tf.get_collection(tf.GraphKeys.SAVERS):
+            return
+        tf.add_to_collection(
+            tf.GraphKeys.SAVERS,
+            PartialRestoreSaver(
+                checkpoint_path, sharded=True, save_relative_paths=True))
+
     def create_train_spec(self, features, hidden_features, loss_eval_pred, mode, scaffold_fn):
         optimizer = self.create_optimizer(
             self.config.lr,
@@ -249,7 +728,8 @@ class BertMultiTask():
 
         global_step = tf.train.get_or_create_global_step()
 
-        tvars = tf.trainable_variables()
+        # frozen variables get neither gradients nor optimizer slots
+        tvars = [v for v in tf.trainable_variables() if not self.is_frozen(v)]
 
         total_loss = 0
         hook_dict = {}
@@ -285,15 +765,25 @@ class BertMultiTask():
 
         new_global_step = global_step + 1
         train_op = tf.group(train_op, [global_step.assign(new_global_step)])
+
+        if self.config.layer_freeze_schedule:
+            # slots of unfrozen layers are not in checkpoint of last phase
+            self.add_partial_restore_saver()
+        training_hooks = [logging_hook]
+        if self.config.recompute_grad:
+            # log the memory saved by recompute_grad
+            training_hooks.append(
+                PeakMemoryHook(every_n_iter=self.config.log_every_n_steps))
         output_spec = tf.estimator.EstimatorSpec(
             mode=mode,
             loss=total_loss,
             train_op=train_op,
-            training_hooks=[logging_hook],
+            training_hooks=training_hooks,
             scaffold=scaffold_fn)
         return output_spec
 
-    def create_spec(self, features, hidden_features, loss_eval_pred, mode, warm_start):
+    def create_spec(self, features, hidden_features, loss_eval_pred, mode, warm_start,
+                    model_dir=None):
         """Function to create spec for different mode
 
         Arguments:
@@ -302,6 +792,10 @@ class BertMultiTask():
             loss_eval_pred {None} -- see self.top
             mode {mode} -- mode
 
+        Keyword Arguments:
+            model_dir {str} -- model dir of estimator, used to restore
+                float16 exported checkpoints in predict mode (default: {None})
+
         Returns:
             spec -- train\eval\predict spec
         """
@@ -353,20 +847,40 @@ class BertMultiTask():
         else:
             # include input ids
             loss_eval_pred['input_ids'] = features['input_ids']
+            # position in input, see predict_input_fn
+            if 'example_index' in features:
+                loss_eval_pred['example_index'] = features['example_index']
+
+            scaffold = None
+            checkpoint_path = None
+            if model_dir is not None:
+                checkpoint_path = tf.train.latest_checkpoint(model_dir)
+            if checkpoint_path is not None and \
+                    CastingSaverBuilder.need_cast(checkpoint_path):
+                scaffold = tf.train.Scaffold(saver=tf.train.Saver(
+                    builder=CastingSaverBuilder(checkpoint_path), sharded=True))
+
             output_spec = tf.estimator.EstimatorSpec(
-                mode=mode, predictions=loss_eval_pred)
+                mode=mode, predictions=loss_eval_pred, scaffold=scaffold)
             return output_spec
 
     def get_model_fn(self, warm_start=True):
-        def model_fn(features, labels, mode, params: Params):
+        def model_fn(features, labels, mode, params: Params, config=None):
 
-            hidden_feature = self.body(
-                features, mode)
+            # optimizer is built outside, fused_optimizer cuts its ops
+            with xla_jit_scope(self.config.xla_jit):
+                if self.use_early_exit(mode):
+                    hidden_feature = None
+                    loss_eval_pred = self.early_exit_predict(features)
+                else:
+                    hidden_feature = self.body(
+                        features, mode)
 
-            loss_eval_pred = self.top(features, hidden_feature, mode)
+                    loss_eval_pred = self.top(features, hidden_feature, mode)
 
             spec = self.create_spec(
-                features, hidden_feature, loss_eval_pred, mode, warm_start)
+                features, hidden_feature, loss_eval_pred, mode, warm_start,
+                model_dir=config.model_dir if config is not None else None)
             return spec
 
         return model_fn
@@ -0,0 +1,301 @@
+import os
+import re
+import json
+import math
+
+import numpy as np
+
+from .viterbi import viterbi_decode
+
+WEIGHT_DIR_NAME = 'numpy_weights'
+MANIFEST_NAME = 'numpy_bert.json'
+
+
+def latest_checkpoint_name(ckpt_dir):
+    """Name of latest checkpoint of ckpt_dir, read from the checkpoint
+    state file. Same as tf.train.latest_checkpoint without tensorflow.
+
+    Returns:
+        str -- checkpoint name, e.g. model.ckpt-1000, None if not found
+    """
+    state_path = os.path.join(ckpt_dir, 'checkpoint')
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, 'r', encoding='utf8') as f:
+        match = re.search(
+            r'^model_checkpoint_path:\s*"(.*)"', f.read(), flags=re.M)
+    if match is None:
+        return None
+    return os.path.basename(match.group(1))
+
+
+def weight_file_name(weight_name):
+    return weight_name.replace('/', '.') + '.npy'
+
+
+def erf(x):
+    # Abramowitz and Stegun 7.1.26, max absolute error 1.5e-7
+    sign = np.sign(x)
+    x = np.abs(x)
+    t = 1.0 / (1.0 + 0.3275911 * x)
+    y = 1.0 - ((((1.061405429 * t - 1.453152027) * t + 1.421413741) * t
+                - 0.284496736) * t + 0.254829592) * t * np.exp(-x * x)
+    return (sign * y).astype(x.dtype)
+
+
+def gelu(x):
+    """Same as modeling.gelu"""
+    return 0.5 * x * (1.0 + erf(x / np.float32(math.sqrt(2.0))))
+
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'gelu': gelu,
+    'tanh': np.tanh
+}
+
+
+def layer_norm(x, gamma, beta, epsilon=1e-12):
+    """Same as modeling.layer_norm, over the last axis"""
+    mean = np.mean(x, axis=-1, keepdims=True)
+    variance = np.mean(np.square(x - mean), axis=-1, keepdims=True)
+    return (x - mean) / np.sqrt(variance + epsilon) * gamma + beta
+
+
+def softmax(x):
+    x = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return x / np.sum(x, axis=-1, keepdims=True)
+
+
+class NumpyBert():
+    """Bert encoder with SequenceLabel and Classification heads in numpy,
+    for CPU inference without tensorflow session and graph.
+
+    Weights are read from a dir written by
+    estimator_wrapper.export_numpy_weights, one .npy per weight,
+    and memory mapped, so loading costs almost nothing and processes
+    on the same host share the pages. Query, key and value kernels of
+    each layer are exported as one fused kernel.
+
+    Prediction is the same as WarmPredictor with crf decoded by
+    viterbi.viterbi_decode: viterbi tags for seq_tag problems and
+    class probabilities for cls problems. Early exit and label
+    transfer are not supported, every head runs on the output of its
+    full depth, see BertMultiTask.get_problem_depth.
+
+    Arguments:
+        weight_dir {str} -- dir of exported weights
+    """
+
+    def __init__(self, weight_dir):
+        with open(os.path.join(weight_dir, MANIFEST_NAME), 'r', encoding='utf8') as f:
+            manifest = json.load(f)
+        self.manifest = manifest
+        self.checkpoint = manifest['checkpoint']
+        self.bert_config = manifest['bert_config']
+        self.head_dict = manifest['heads']
+        self.weights = {
+            name: np.load(os.path.join(weight_dir, weight_file_name(name)),
+                          mmap_mode='r')
+            for name in manifest['weights']}
+
+        self.num_attention_heads = self.bert_config['num_attention_heads']
+        self.size_per_head = self.bert_config['hidden_size'] // self.num_attention_heads
+        # heads left in each layer of pruned models, see encoder.get_layer_sizes
+        self.layer_num_attention_heads = self.bert_config.get(
+            'layer_num_attention_heads') or \
+            [self.num_attention_heads] * self.bert_config['num_hidden_layers']
+        self.activation = ACTIVATIONS[self.bert_config['hidden_act']]
+        self.num_layers = max(
+            [head['num_layers'] for head in self.head_dict.values()])
+
+    @classmethod
+    def from_checkpoint(cls, model_dir, weight_dir=None):
+        """Load weights of the latest checkpoint of model_dir. Weights
+        are exported to weight_dir first if not exported yet or exported
+        from an older checkpoint, which needs tensorflow. Once exported,
+        loading only reads the weight dir.
+
+        Arguments:
+            model_dir {str} -- checkpoint dir or exported inference dir
+
+        Keyword Arguments:
+            weight_dir {str} -- dir of exported weights, defaults to
+                model_dir/numpy_weights (default: {None})
+
+        Returns:
+            NumpyBert -- engine
+        """
+        if weight_dir is None:
+            weight_dir = os.path.join(model_dir, WEIGHT_DIR_NAME)
+        manifest_path = os.path.join(weight_dir, MANIFEST_NAME)
+        checkpoint = latest_checkpoint_name(model_dir)
+
+        exported_checkpoint = None
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf8') as f:
+                exported_checkpoint = json.load(f)['checkpoint']
+        if exported_checkpoint is None or \
+                (checkpoint is not None and checkpoint != exported_checkpoint):
+            # tensorflow is only needed to export a new checkpoint
+            from .params import Params
+            from .estimator_wrapper import export_numpy_weights
+            params = Params()
+            params.from_predict_dir(model_dir)
+            export_numpy_weights(params, weight_dir)
+        return cls(weight_dir)
+
+    def dense(self, x, name, activation=None):
+        x = np.matmul(x, self.weights[name + '/kernel']) + \
+            self.weights[name + '/bias']
+        if activation is not None:
+            x = activation(x)
+        return x
+
+    def layer_norm(self, x, name):
+        return layer_norm(
+            x, self.weights[name + '/gamma'], self.weights[name + '/beta'])
+
+    def embedding(self, input_ids, segment_ids):
+        """Same as encoder.embedding in predict mode
+
+        Returns:
+            np.ndarray -- [batch_size, seq_length, hidden_size]
+        """
+        seq_length = input_ids.shape[1]
+        embedding_output = self.weights['bert/embeddings/word_embeddings'][input_ids] + \
+            self.weights['bert/embeddings/token_type_embeddings'][segment_ids] + \
+            self.weights['bert/embeddings/position_embeddings'][:seq_length]
+        return self.layer_norm(embedding_output, 'bert/embeddings/LayerNorm')
+
+    def transformer_layer(self, layer_input, attention_adder, layer_idx):
+        """Same as encoder.transformer_layer in predict mode
+
+        Arguments:
+            layer_input {np.ndarray} -- [batch_size, seq_length, hidden_size]
+            attention_adder {np.ndarray} -- 0 for tokens and -10000 for
+                padding, [batch_size, 1, 1, seq_length]
+            layer_idx {int} -- index of layer, starts from 0
+
+        Returns:
+            np.ndarray -- [batch_size, seq_length, hidden_size]
+        """
+        batch_size, seq_length, hidden_size = layer_input.shape
+        prefix = 'bert/encoder/layer_%d/' % layer_idx
+        layer_input_2d = layer_input.reshape([-1, hidden_size])
+
+        # [3, batch_size, num_attention_heads, seq_length, size_per_head]
+        qkv = self.dense(layer_input_2d, prefix + 'attention/self/qkv').reshape(
+            [batch_size, seq_length, 3, self.layer_num_attention_heads[layer_idx],
+             self.size_per_head]).transpose([2, 0, 3, 1, 4])
+        attention_scores = np.matmul(qkv[0], qkv[1].transpose([0, 1, 3, 2])) * \
+            np.float32(1.0 / math.sqrt(self.size_per_head))
+        attention_probs = softmax(attention_scores + attention_adder)
+        context_layer = np.matmul(attention_probs, qkv[2]).transpose(
+            [0, 2, 1, 3]).reshape([batch_size * seq_length, -1])
+
+        attention_output = self.layer_norm(
+            self.dense(context_layer, prefix + 'attention/output/dense') + layer_input_2d,
+            prefix + 'attention/output/LayerNorm')
+        intermediate_output = self.dense(
+            attention_output, prefix + 'intermediate/dense', self.activation)
+        layer_output = self.layer_norm(
+            self.dense(intermediate_output, prefix + 'output/dense') + attention_output,
+            prefix + 'output/LayerNorm')
+        return layer_output.reshape([batch_size, seq_length, hidden_size])
+
+    def encode(self, input_ids, input_mask, segment_ids):
+        """Run encoder layers needed by heads
+
+        Returns:
+            dict -- key: number of layers, value: output of that layer,
+                [batch_size, seq_length, hidden_size], for depths of heads
+        """
+        layer_output = self.embedding(input_ids, segment_ids)
+        attention_adder = (1.0 - input_mask[:, None, None, :].astype(np.float32)) * \
+            np.float32(-10000.0)
+        depth_set = set([head['num_layers'] for head in self.head_dict.values()])
+        output_dict = {}
+        for layer_idx in range(self.num_layers):
+            layer_output = self.transformer_layer(
+                layer_output, attention_adder, layer_idx)
+            if layer_idx + 1 in depth_set:
+                output_dict[layer_idx + 1] = layer_output
+        return output_dict
+
+    def predict_batch(self, input_ids, input_mask, segment_ids, return_logits=False):
+        """Run one forward pass of a padded batch
+
+        Arguments:
+            input_ids {np.ndarray} -- [batch_size, seq_length]
+            input_mask {np.ndarray} -- [batch_size, seq_length]
+            segment_ids {np.ndarray} -- [batch_size, seq_length]
+
+        Keyword Arguments:
+            return_logits {bool} -- return logits of heads instead of
+                tags and probabilities (default: {False})
+
+        Returns:
+            dict -- key: problem, value: viterbi tags [batch_size, seq_length]
+                for seq_tag, probabilities [batch_size, num_classes] for cls,
+                or logits if return_logits
+        """
+        input_ids = np.asarray(input_ids, dtype=np.int64)
+        input_mask = np.asarray(input_mask, dtype=np.int64)
+        segment_ids = np.asarray(segment_ids, dtype=np.int64)
+        output_dict = self.encode(input_ids, input_mask, segment_ids)
+        seq_length = np.sum(input_mask, axis=-1)
+
+        pooled_dict = {}
+        pred = {}
+        for problem, head in self.head_dict.items():
+            sequence_output = output_dict[head['num_layers']]
+            if head['type'] == 'seq_tag':
+                logits = self.dense(sequence_output, head['scope'] + '/dense')
+                if return_logits:
+                    pred[problem] = logits
+                else:
+                    pred[problem], _ = viterbi_decode(
+                        logits, self.weights[head['scope'] + '/crf_transition'],
+                        seq_length)
+            else:
+                if head['num_layers'] not in pooled_dict:
+                    pooled_dict[head['num_layers']] = self.dense(
+                        sequence_output[:, 0], 'bert/pooler/dense', np.tanh)
+                logits = self.dense(
+                    pooled_dict[head['num_layers']], head['scope'] + '/dense')
+                pred[problem] = logits if return_logits else softmax(logits)
+        return pred
+
+    def predict(self, example_list, batch_size=64, return_logits=False):
+        """Predict a list of examples, batch by batch. Examples are sorted
+        by length and each batch is padded to its longest example.
+
+        Arguments:
+            example_list {list} -- list of dict with input_ids, input_mask
+                and segment_ids, e.g. created by create_predict_example
+
+        Keyword Arguments:
+            batch_size {int} -- batch size (default: {64})
+            return_logits {bool} -- see predict_batch (default: {False})
+
+        Returns:
+            list -- list of prediction dict in input order, with input_ids
+                and the prediction of every problem
+        """
+        length_list = [int(np.sum(example['input_mask'])) for example in example_list]
+        order = sorted(range(len(example_list)), key=lambda ind: length_list[ind])
+        pred_list = [None] * len(example_list)
+        for batch_start in range(0, len(order), batch_size):
+            batch_order = order[batch_start:batch_start+batch_size]
+            seq_length = max([length_list[ind] for ind in batch_order])
+            features = {
+                k: np.array([example_list[ind][k][:seq_length] for ind in batch_order])
+                for k in ['input_ids', 'input_mask', 'segment_ids']}
+            batch_pred = self.predict_batch(return_logits=return_logits, **features)
+            for batch_ind, ind in enumerate(batch_order):
+                p = {k: v[batch_ind] for k, v in batch_pred.items()}
+                p['input_ids'] = features['input_ids'][batch_ind]
+                pred_list[ind] = p
+        return pred_list
@@ -13,6 +13,8 @@ from tensorflow.python.ops import math_ops
 from tensorflow.python.training import optimizer
 from tensorflow.python.ops import state_ops
 from tensorflow.python.ops import resource_variable_ops
+from tensorflow.python.ops import variable_scope
+from tensorflow.python.training import distribution_strategy_context
 
 
 class AdamWeightDecayOptimizer(optimizer.Optimizer):
@@ -72,10 +74,10 @@ class AdamWeightDecayOptimizer(optimizer.Optimizer):
 
         update = next_m / (tf.sqrt(next_v) + epsilon_t)
 
-        if self._do_use_weight_decay(self._get_variable_name(var)):
+        if self._do_use_weight_decay(self._get_variable_name(var.name)):
             update += weight_decay_rate_t * var
 
-        update_with_lr = learning_rate_t * update
+        update_with_lr = learning_rate_t * self._scale_update(update, var)
 
         next_param = var - update_with_lr
 
@@ -105,10 +107,10 @@ class AdamWeightDecayOptimizer(optimizer.Optimizer):
 
         update = next_m / (tf.sqrt(next_v) + epsilon_t)
 
-        if self._do_use_weight_decay(var.name):
+        if self._do_use_weight_decay(self._get_variable_name(var.name)):
             update += weight_decay_rate_t * var
 
-        update_with_lr = learning_rate_t * update
+        update_with_lr = learning_rate_t * self._scale_update(update, var)
 
         next_param = var - update_with_lr
 
@@ -142,10 +144,10 @@ class AdamWeightDecayOptimizer(optimizer.Optimizer):
 
         update = m_t / (math_ops.sqrt(v_t) + epsilon_t)
 
-        if self._do_use_weight_decay(var.name):
+        if self._do_use_weight_decay(self._get_variable_name(var.name)):
             update += weight_decay_rate_t * var
 
-        update_with_lr = learning_rate_t * update
+        update_with_lr = learning_rate_t * self._scale_update(update, var)
 
         var_update = state_ops.assign_sub(var,
                                           update_with_lr,
@@ -168,6 +170,18 @@ class AdamWeightDecayOptimizer(optimizer.Optimizer):
         return self._apply_sparse_shared(
             grad, var, indices, self._resource_scatter_add)
 
+    def _scale_update(self, update, var):
+        """Scale of update before multiplied by learning rate,
+        identity for Adam"""
+        return update
+
+    def _get_variable_name(self, param_name):
+        """Get the variable name from the tensor name."""
+        m = re.match("^(.*):\\d+$", param_name)
+        if m is not None:
+            param_name = m.group(1)
+        return param_name
+
     def _do_use_weight_decay(self, param_name):
         """Whether to use L2 weight decay for `param_name`."""
         if not self.weight_decay_rate:
@@ -177,3 +191,374 @@ class AdamWeightDecayOptimizer(optimizer.Optimizer):
                 if re.search(r, param_name) is not None:
                     return False
         return True
+
+
+class LAMBOptimizer(AdamWeightDecayOptimizer):
+    """Layer-wise adaptive moments optimizer (LAMB) for large batch training.
+
+    Same as AdamWeightDecayOptimizer, except that the update of every
+    variable is scaled by the trust ratio ||var|| / ||update||, so the
+    step size of each layer is proportional to its weight norm.
+
+    Like AdamWeightDecayOptimizer, there is no bias correction of m and v.
+    Variables excluded from weight decay are excluded from layer
+    adaptation as well, unless exclude_from_layer_adaptation is given.
+    """
+
+    def __init__(self,
+                 learning_rate,
+                 weight_decay_rate=0.0,
+                 beta_1=0.9,
+                 beta_2=0.999,
+                 epsilon=1e-6,
+                 exclude_from_weight_decay=None,
+                 exclude_from_layer_adaptation=None,
+                 name="LAMBOptimizer"):
+        """Constructs a LAMBOptimizer."""
+        super(LAMBOptimizer, self).__init__(
+            learning_rate,
+            weight_decay_rate=weight_decay_rate,
+            beta_1=beta_1,
+            beta_2=beta_2,
+            epsilon=epsilon,
+            exclude_from_weight_decay=exclude_from_weight_decay,
+            name=name)
+        if exclude_from_layer_adaptation is None:
+            exclude_from_layer_adaptation = exclude_from_weight_decay
+        self.exclude_from_layer_adaptation = exclude_from_layer_adaptation
+
+    def _scale_update(self, update, var):
+        if not self._do_layer_adaptation(self._get_variable_name(var.name)):
+            return update
+
+        var_norm = tf.norm(var)
+        update_norm = tf.norm(update)
+        # trust ratio is 1 if either norm is 0, e.g. zero initialized var
+        trust_ratio = tf.where(
+            tf.greater(var_norm, 0.),
+            tf.where(tf.greater(update_norm, 0.),
+                     var_norm / update_norm, 1.0),
+            1.0)
+        return trust_ratio * update
+
+    def _do_layer_adaptation(self, param_name):
+        """Whether to use trust ratio for `param_name`."""
+        if self.exclude_from_layer_adaptation:
+            for r in self.exclude_from_layer_adaptation:
+                if re.search(r, param_name) is not None:
+                    return False
+        return True
+
+
+class FusedAdamWeightDecayOptimizer(AdamWeightDecayOptimizer):
+    """AdamWeightDecayOptimizer that updates all variables in a few bulk ops.
+
+    Variables are split into two groups, with and without weight decay.
+    m and v of each group are kept in flat buffers, and grads and
+    variables of each group are concatenated, so the adam update is
+    computed once per group instead of once per variable. Variables
+    still need one assign each.
+
+    The update is elementwise the same as AdamWeightDecayOptimizer, so
+    results are identical on dense gradients. Sparse gradients are
+    densified. m and v are stored as non-slot variables, so optimizer
+    states of the two optimizers are not interchangeable in checkpoints.
+    """
+
+    def __init__(self,
+                 learning_rate,
+                 weight_decay_rate=0.0,
+                 beta_1=0.9,
+                 beta_2=0.999,
+                 epsilon=1e-6,
+                 exclude_from_weight_decay=None,
+                 name="FusedAdamWeightDecayOptimizer"):
+        """Constructs a FusedAdamWeightDecayOptimizer."""
+        super(FusedAdamWeightDecayOptimizer, self).__init__(
+            learning_rate,
+            weight_decay_rate=weight_decay_rate,
+            beta_1=beta_1,
+            beta_2=beta_2,
+            epsilon=epsilon,
+            exclude_from_weight_decay=exclude_from_weight_decay,
+            name=name)
+
+    def _group_grads_and_vars(self, grads_and_vars):
+        """Split grads_and_vars into groups with and without weight decay"""
+        group_dict = {True: [], False: []}
+        for grad, var in grads_and_vars:
+            if grad is None:
+                continue
+            if isinstance(grad, ops.IndexedSlices):
+                grad = ops.convert_to_tensor(grad)
+            use_weight_decay = self._do_use_weight_decay(
+                self._get_variable_name(var.name))
+            group_dict[use_weight_decay].append((grad, var))
+        return {k: v for k, v in group_dict.items() if v}
+
+    def _create_flat_slots(self, group_dict):
+        """Create flat m and v buffer of each group"""
+        slot_dict = {}
+        with variable_scope.variable_scope(self._name):
+            for use_weight_decay, grads_and_vars in group_dict.items():
+                group_name = 'decay' if use_weight_decay else 'no_decay'
+                total_size = sum([var.shape.num_elements()
+                                  for _, var in grads_and_vars])
+                slot_dict[use_weight_decay] = [
+                    tf.get_variable(
+                        '%s_%s' % (group_name, slot_name),
+                        shape=[total_size],
+                        dtype=tf.float32,
+                        initializer=tf.zeros_initializer(),
+                        trainable=False)
+                    for slot_name in ['m', 'v']]
+        return slot_dict
+
+    def _fused_update(self, m, v, use_weight_decay, num_vars, *grads_and_vars):
+        """Adam update of a group of variables, grads_and_vars is
+        num_vars grads followed by num_vars vars"""
+        grads = grads_and_vars[:num_vars]
+        var_list = grads_and_vars[num_vars:]
+        size_list = [var.shape.num_elements() for var in var_list]
+
+        grad = tf.concat([tf.reshape(g, [-1]) for g in grads], axis=0)
+        var = tf.concat([tf.reshape(v, [-1]) for v in var_list], axis=0)
+
+        learning_rate_t = math_ops.cast(
+            self.learning_rate_t, var.dtype.base_dtype)
+        beta_1_t = math_ops.cast(self.beta_1_t, var.dtype.base_dtype)
+        beta_2_t = math_ops.cast(self.beta_2_t, var.dtype.base_dtype)
+        epsilon_t = math_ops.cast(self.epsilon_t, var.dtype.base_dtype)
+        weight_decay_rate_t = math_ops.cast(
+            self.weight_decay_rate_t, var.dtype.base_dtype)
+
+        # Standard Adam update.
+        next_m = (
+            tf.multiply(beta_1_t, m) +
+            tf.multiply(1.0 - beta_1_t, grad))
+        next_v = (
+            tf.multiply(beta_2_t, v) + tf.multiply(1.0 - beta_2_t,
+                                                   tf.square(grad)))
+
+        update = next_m / (tf.sqrt(next_v) + epsilon_t)
+
+        if use_weight_decay:
+            update += weight_decay_rate_t * var
+
+        update_with_lr = learning_rate_t * update
+
+        next_param = var - update_with_lr
+
+        assign_list = [m.assign(next_m), v.assign(next_v)]
+        for param, next_param_flat in zip(
+                var_list, tf.split(next_param, size_list)):
+            assign_list.append(param.assign(
+                tf.reshape(next_param_flat, param.shape)))
+        return control_flow_ops.group(*assign_list)
+
+    def apply_gradients(self, grads_and_vars, global_step=None, name=None):
+        if distribution_strategy_context.has_distribution_strategy():
+            # calls _distributed_apply in cross tower context
+            return super(FusedAdamWeightDecayOptimizer, self).apply_gradients(
+                grads_and_vars, global_step=global_step, name=name)
+
+        group_dict = self._group_grads_and_vars(grads_and_vars)
+        if not group_dict:
+            raise ValueError("No gradients provided for any variable")
+        slot_dict = self._create_flat_slots(group_dict)
+        with ops.name_scope(name, self._name) as name:
+            self._prepare()
+            update_ops = []
+            for use_weight_decay, grads_and_vars in group_dict.items():
+                grads, var_list = zip(*grads_and_vars)
+                m, v = slot_dict[use_weight_decay]
+                update_ops.append(self._fused_update(
+                    m, v, use_weight_decay, len(var_list), *(grads + var_list)))
+            if global_step is None:
+                return control_flow_ops.group(*update_ops, name=name)
+            with ops.control_dependencies(update_ops):
+                return state_ops.assign_add(global_step, 1, name=name).op
+
+    def _distributed_apply(self, distribution, grads_and_vars,
+                           global_step=None, name=None):
+        grads_and_vars = [(g, v) for g, v in grads_and_vars if g is not None]
+        reduced_grads = distribution.batch_reduce(
+            variable_scope.VariableAggregation.SUM, grads_and_vars)
+        group_dict = self._group_grads_and_vars(
+            zip(reduced_grads, [v for _, v in grads_and_vars]))
+        if not group_dict:
+            raise ValueError("No gradients provided for any variable")
+        slot_dict = self._create_flat_slots(group_dict)
+
+        with ops.name_scope(name, self._name) as name:
+            self._prepare()
+            update_ops = []
+            for use_weight_decay, grads_and_vars in group_dict.items():
+                grads, var_list = zip(*grads_and_vars)
+                m, v = slot_dict[use_weight_decay]
+
+                def update(m, v, *grads_and_vars,
+                           use_weight_decay=use_weight_decay,
+                           num_vars=len(var_list)):
+                    return self._fused_update(
+                        m, v, use_weight_decay, num_vars, *grads_and_vars)
+
+                update_ops.extend(distribution.unwrap(distribution.update(
+                    m, update, v, *(grads + var_list))))
+
+            if global_step is None:
+                return distribution.group(update_ops, name=name)
+            with ops.control_dependencies(update_ops):
+                return distribution.group(distribution.update(
+                    global_step, lambda g: state_ops.assign_add(g, 1)),
+                    name=name)
+
+
+class QuantizedAdamWeightDecayOptimizer(AdamWeightDecayOptimizer):
+    """AdamWeightDecayOptimizer with m and v stored as 8 bit integers.
+
+    Moments of each variable are flattened and split into blocks of
+    block_size, every block is quantized with its own float32 scale,
+    which is the absmax of the block. m and v are dequantized before
+    the adam update and quantized again after it.
+
+    Since v spans many orders of magnitude, linear quantization would
+    round most of it to 0. Values are companded before rounding instead:
+    m is stored as int8 of sign(m) * sqrt(|m| / scale), v as uint8 of
+    (v / scale) ** (1/4).
+
+    Optimizer state takes about 2 bytes per parameter instead of 8.
+    """
+
+    def __init__(self,
+                 learning_rate,
+                 weight_decay_rate=0.0,
+                 beta_1=0.9,
+                 beta_2=0.999,
+                 epsilon=1e-6,
+                 exclude_from_weight_decay=None,
+                 block_size=2048,
+                 name="QuantizedAdamWeightDecayOptimizer"):
+        """Constructs a QuantizedAdamWeightDecayOptimizer."""
+        super(QuantizedAdamWeightDecayOptimizer, self).__init__(
+            learning_rate,
+            weight_decay_rate=weight_decay_rate,
+            beta_1=beta_1,
+            beta_2=beta_2,
+            epsilon=epsilon,
+            exclude_from_weight_decay=exclude_from_weight_decay,
+            name=name)
+        self.block_size = block_size
+
+    def _num_blocks(self, var):
+        return -(-var.shape.num_elements() // self.block_size)
+
+    def _create_slots(self, var_list):
+        for v in var_list:
+            num_blocks = self._num_blocks(v)
+            for slot_name, dtype in [('m', tf.int8), ('v', tf.uint8)]:
+                self._get_or_make_slot_with_initializer(
+                    v, tf.zeros_initializer(),
+                    tf.TensorShape([num_blocks, self.block_size]),
+                    dtype, slot_name, self._name)
+                self._get_or_make_slot_with_initializer(
+                    v, tf.zeros_initializer(),
+                    tf.TensorShape([num_blocks, 1]),
+                    tf.float32, '%s_scale' % slot_name, self._name)
+
+    def _to_blocks(self, tensor, var):
+        """Flatten and pad tensor to [num_blocks, block_size]"""
+        num_blocks = self._num_blocks(var)
+        flat = tf.reshape(tensor, [-1])
+        pad_size = num_blocks * self.block_size - var.shape.num_elements()
+        flat = tf.pad(flat, [[0, pad_size]])
+        return tf.reshape(flat, [num_blocks, self.block_size])
+
+    def _from_blocks(self, blocks, var):
+        flat = tf.reshape(blocks, [-1])[:var.shape.num_elements()]
+        return tf.reshape(flat, var.shape)
+
+    def _dequantize(self, var, slot_name):
+        quantized = tf.cast(self.get_slot(var, slot_name), tf.float32)
+        scale = self.get_slot(var, '%s_scale' % slot_name)
+        if slot_name == 'm':
+            value = tf.sign(quantized) * tf.square(quantized / 127.) * scale
+        else:
+            value = tf.square(tf.square(quantized / 255.)) * scale
+        return self._from_blocks(value, var)
+
+    def _quantize(self, value, var, slot_name):
+        blocks = self._to_blocks(value, var)
+        scale = tf.reduce_max(tf.abs(blocks), axis=-1, keepdims=True)
+        normalized = blocks / tf.where(scale > 0, scale, tf.ones_like(scale))
+        if slot_name == 'm':
+            quantized = tf.cast(tf.round(
+                tf.sign(normalized) * tf.sqrt(tf.abs(normalized)) * 127.), tf.int8)
+        else:
+            quantized = tf.cast(tf.round(
+                tf.sqrt(tf.sqrt(normalized)) * 255.), tf.uint8)
+        return [self.get_slot(var, slot_name).assign(quantized),
+                self.get_slot(var, '%s_scale' % slot_name).assign(scale)]
+
+    def _quantized_apply(self, grad, grad_square, var):
+        """Adam update with dequantized moments
+
+        Arguments:
+            grad {tensor} -- gradient, same shape as var
+            grad_square {tensor} -- square of gradient, same shape as var
+            var {Variable} -- variable to update
+        """
+        learning_rate_t = math_ops.cast(
+            self.learning_rate_t, var.dtype.base_dtype)
+        beta_1_t = math_ops.cast(self.beta_1_t, var.dtype.base_dtype)
+        beta_2_t = math_ops.cast(self.beta_2_t, var.dtype.base_dtype)
+        epsilon_t = math_ops.cast(self.epsilon_t, var.dtype.base_dtype)
+        weight_decay_rate_t = math_ops.cast(
+            self.weight_decay_rate_t, var.dtype.base_dtype)
+
+        m = self._dequantize(var, 'm')
+        v = self._dequantize(var, 'v')
+
+        # Standard Adam update.
+        next_m = (
+            tf.multiply(beta_1_t, m) +
+            tf.multiply(1.0 - beta_1_t, grad))
+        next_v = (
+            tf.multiply(beta_2_t, v) + tf.multiply(1.0 - beta_2_t,
+                                                   grad_square))
+
+        update = next_m / (tf.sqrt(next_v) + epsilon_t)
+
+        if self._do_use_weight_decay(self._get_variable_name(var.name)):
+            update += weight_decay_rate_t * var
+
+        update_with_lr = learning_rate_t * self._scale_update(update, var)
+
+        next_param = var - update_with_lr
+
+        return control_flow_ops.group(*(
+            [var.assign(next_param)] +
+            self._quantize(next_m, var, 'm') +
+            self._quantize(next_v, var, 'v')))
+
+    def _apply_dense(self, grad, var):
+        return self._quantized_apply(grad, tf.square(grad), var)
+
+    def _resource_apply_dense(self, grad, var):
+        return self._quantized_apply(grad, tf.square(grad), var)
+
+    def _apply_sparse_shared(self, grad, var, indices, scatter_add):
+        # same as scatter_add of AdamWeightDecayOptimizer, square
+        # of duplicated indices are summed
+        num_rows = tf.shape(var)[0]
+        dense_grad = tf.unsorted_segment_sum(grad, indices, num_rows)
+        dense_grad_square = tf.unsorted_segment_sum(
+            grad * grad, indices, num_rows)
+        return self._quantized_apply(dense_grad, dense_grad_square, var)
+
+    def _apply_sparse(self, grad, var):
+        return self._apply_sparse_shared(
+            grad.values, var, grad.indices, None)
+
+    def _resource_apply_sparse(self, grad, var, indices):
+        return self._apply_sparse_shared(grad, var, indices, None)
@@ -1,7 +1,9 @@
 import os
 import re
+import math
 import json
 import shutil
+from copy import deepcopy
 
 from bert.modeling import BertConfig
 
@@ -87,15 +89,76 @@ class Params():
 
         # training
         self.init_lr = 2e-5
+        # 'adam' or 'lamb'. init_lr is scaled linearly with gpu for adam,
+        # and with square root of the effective batch size over 32 for lamb
+        self.optimizer = 'adam'
+        # update all variables of adam in a few bulk ops,
+        # see FusedAdamWeightDecayOptimizer
+        self.fused_optimizer = False
+        # store adam m and v as 8 bit integers with a scale per block,
+        # see QuantizedAdamWeightDecayOptimizer
+        self.quantize_optimizer_state = False
+        self.optimizer_state_block_size = 2048
         self.batch_size = 32
         self.train_epoch = 15
         self.freeze_step = 0
+        # list of [step, num_frozen_layers]. From step on, embeddings and
+        # the lowest num_frozen_layers encoder layers are excluded from
+        # gradients and optimizer slots, e.g. [[0, 8], [1000, 4], [2000, 0]].
+        # Training runs phase by phase, see layer_freeze_phases
+        self.layer_freeze_schedule = []
+        # keep only the output of encoder layers for backprop and
+        # recompute the inside of layers in backward pass. Trades about
+        # one extra forward pass for memory of long max_seq_len
+        self.recompute_grad = False
+        # if set, seq_tag examples longer than max_seq_len are split into
+        # windows starting every train_window_stride tokens instead of
+        # truncated. Tokens in overlaps are labelled in one window only,
+        # see split_seq_windows
+        self.train_window_stride = None
+        # compile encoder and heads, and their gradients, with XLA JIT.
+        # Ops XLA cannot compile are left out, see xla.is_compilable
+        self.xla_jit = False
 
         # hparm
         self.dropout_keep_prob = 0.9
         self.max_seq_len = 128
         self.use_one_hot_embeddings = True
         self.label_smoothing = 0.1
+        # use the output of the first N encoder layers for a problem,
+        # e.g. {'CWS': 6}. Layers above the deepest N needed by
+        # run problems are not built.
+        self.problem_encoder_layers = {}
+        # early exit
+        # heads are attached after these encoder layers (counted from 1)
+        # and trained together with the final head. At prediction, a
+        # sequence exits at the first of these layers where confidence
+        # of every problem passes early_exit_threshold.
+        self.early_exit_layers = []
+        self.early_exit_threshold = 0.9
+
+        # prediction
+        # if True, seq_tag problems output emission logits at prediction
+        # and PredictModel runs viterbi decoding in numpy
+        self.crf_decode_on_host = False
+        self.crf_decode_threads = 4
+        # group inputs of similar length into a batch, and pad each batch
+        # to its longest input instead of max_seq_len
+        self.predict_sort_by_length = True
+        # inputs are sorted within buffers of this many predict batches
+        self.predict_sort_buffer_batches = 16
+        # files are read and predicted this many lines at a time
+        self.predict_file_chunk_size = 10000
+        # if set, PredictModel splits documents into overlapping windows
+        # of predict_window_size tokens, starting every
+        # predict_window_stride tokens, and stitches seq_tag outputs back.
+        # Other problems only see the first window. If None, documents
+        # are truncated at 350 tokens
+        self.predict_window_size = None
+        self.predict_window_stride = 64
+        # number of results of ChineseNER and ChineseWordSegment kept in
+        # a LRU cache for repeated inputs, 0 to disable
+        self.predict_cache_size = 0
 
         # multitask training
         self.label_transfer = False
@@ -103,6 +166,20 @@ class Params():
         self.augument_rate = 0.5
         self.distillation = False
 
+        # distillation
+        # train a shallow student against a trained teacher checkpoint,
+        # the teacher should be trained on the same problems
+        self.teacher_checkpoint = None
+        self.student_num_hidden_layers = 4
+        self.distillation_temperature = 2.0
+        # weight of the hard label loss, 1 - alpha for teacher loss
+        self.distillation_alpha = 0.5
+        # if specified, read teacher outputs of seq_tag problems from
+        # the store dumped by `main.py --schedule dump_teacher` instead
+        # of running the teacher at every step
+        self.teacher_logits_dir = None
+        self.teacher_logits_top_k = 4
+
         # bert config
         self.init_checkpoint = 'chinese_L-12_H-768_A-12'
         self.vocab_file = os.path.join(self.init_checkpoint, 'vocab.txt')
@@ -138,7 +215,8 @@ class Params():
         1. parse the flag string to form the run_problem_list
         2. create checkpoint saving path
         3. calculate total number of training data and training steps
-        4. scale learning rate with the number of gpu linearly
+        4. scale learning rate with the number of gpu linearly,
+            or with square root of effective batch size for lamb
 
         Arguments:
             flag_string {str} -- run problem string
@@ -197,27 +275,113 @@ class Params():
             self.data_num * self.train_epoch * dup_fac) / (self.batch_size*gpu))
         self.num_warmup_steps = int(0.1 * self.train_steps)
 
-        # linear scale learing rate
-        self.lr = self.init_lr * gpu
+        if self.optimizer == 'lamb':
+            # square root scale learning rate with effective batch size
+            self.lr = self.init_lr * math.sqrt(self.batch_size * gpu / 32)
+        else:
+            # linear scale learing rate
+            self.lr = self.init_lr * gpu
         self.to_json()
 
+    def set_init_checkpoint(self, init_checkpoint):
+        """Fine-tune from init_checkpoint instead of the pretrained bert,
+        vocab and bert config are read from it. Should be called
+        before assign_problem.
+
+        Arguments:
+            init_checkpoint {str} -- dir contains checkpoint, vocab.txt
+                and bert_config.json, e.g. written by write_pruned_checkpoint
+        """
+        self.init_checkpoint = init_checkpoint
+        self.vocab_file = os.path.join(init_checkpoint, 'vocab.txt')
+        self.bert_config = BertConfig.from_json_file(
+            os.path.join(init_checkpoint, 'bert_config.json'))
+        self.bert_config_dict = self.bert_config.__dict__
+
+    def from_predict_dir(self, model_dir):
+        """Load params of a checkpoint dir or an exported inference dir
+        for prediction. Unlike assign_problem, training data and
+        init_checkpoint are not touched.
+
+        Arguments:
+            model_dir {str} -- dir contains params.json, vocab.txt
+                and label encoders
+        """
+        self.from_json(os.path.join(model_dir, 'params.json'))
+        self.bert_config = BertConfig.from_dict(self.bert_config_dict)
+        self.vocab_file = os.path.join(model_dir, 'vocab.txt')
+        self.ckpt_dir = model_dir
+        self.params_path = os.path.join(model_dir, 'params.json')
+
+    @property
+    def layer_freeze_phases(self):
+        """Training phases of layer_freeze_schedule
+
+        Returns:
+            list -- list of (start_step, end_step, num_frozen_layers)
+        """
+        schedule = sorted([list(phase) for phase in self.layer_freeze_schedule])
+        if not schedule or schedule[0][0] > 0:
+            schedule = [[0, 0]] + schedule
+        phases = []
+        for ind, (start_step, num_frozen_layers) in enumerate(schedule):
+            if ind + 1 < len(schedule):
+                end_step = min(schedule[ind + 1][0], self.train_steps)
+            else:
+                end_step = self.train_steps
+            if end_step > start_step:
+                phases.append((start_step, end_step, num_frozen_layers))
+        return phases
+
+    @property
+    def student_bert_config(self):
+        """Bert config of distillation student, same as bert_config
+        except the number of hidden layers"""
+        student_config = deepcopy(self.bert_config)
+        student_config.num_hidden_layers = self.student_num_hidden_layers
+        return student_config
+
+    @property
+    def use_teacher_logits_store(self):
+        return self.distillation and bool(self.teacher_logits_dir)
+
     @property
     def features_to_dump(self):
         # training
         return [
                 'init_lr',
+                'optimizer',
+                'fused_optimizer',
+                'quantize_optimizer_state',
+                'optimizer_state_block_size',
                 'batch_size',
                 'train_epoch',
                 'freeze_step',
+                'layer_freeze_schedule',
+                'recompute_grad',
+                'train_window_stride',
+                'xla_jit',
                 'augument_mask_lm',
                 'augument_rate',
                 'label_transfer',
 
+                # distillation
+                'distillation',
+                'teacher_checkpoint',
+                'student_num_hidden_layers',
+                'distillation_temperature',
+                'distillation_alpha',
+                'teacher_logits_dir',
+                'teacher_logits_top_k',
+
                 # hparm
                 'dropout_keep_prob',
                 'max_seq_len',
                 'use_one_hot_embeddings',
                 'label_smoothing',
+                'problem_encoder_layers',
+                'early_exit_layers',
+                'early_exit_threshold',
 
                 # pretrain hparm
                 'dupe_factor',
@@ -0,0 +1,218 @@
+import numpy as np
+
+
+class SeqTagDecoder():
+    """Batched post processing of seq_tag predictions.
+
+    Predictions of a batch are flattened into arrays of text tokens,
+    with [CLS], [SEP] and padding dropped by position. Token strings and
+    labels are looked up by indexing arrays built once from vocab and
+    label encoder, and spans like entities and words are found with
+    array ops over the whole batch.
+
+    Arguments:
+        label_encoder {LabelEncoder} -- label encoder of problem
+        tokenizer {FullTokenizer} -- tokenizer
+    """
+
+    def __init__(self, label_encoder, tokenizer):
+        num_labels = max(label_encoder.decode_dict) + 1
+        self.labels = np.array(
+            [label_encoder.decode_dict.get(ind, '[PAD]') for ind in range(num_labels)],
+            dtype=object)
+        self.tokenizer = tokenizer
+        num_tokens = max(tokenizer.inv_vocab) + 1
+        self.id_to_token = np.array(
+            [tokenizer.inv_vocab.get(ind, '[UNK]') for ind in range(num_tokens)],
+            dtype=object)
+
+    def label_flag(self, fn):
+        """Bool array over label ids, fn(label) for each label"""
+        return np.array([fn(label) for label in self.labels], dtype=bool)
+
+    def flatten(self, pred_list, problem, doc_list, with_offsets=False):
+        """Flatten text tokens of predictions
+
+        Arguments:
+            pred_list {list} -- predictions of PredictModel.predict
+            problem {str} -- problem name
+            doc_list {list} -- input texts of predictions
+
+        Keyword Arguments:
+            with_offsets {bool} -- compute offsets for predictions
+                without char_offsets, which tokenizes doc_list again
+                (default: {False})
+
+        Returns:
+            dict -- flat arrays over text tokens of all predictions
+                tokens: token strings, original chars of doc if
+                    predictions have char_offsets
+                label_ids: label id of tokens
+                offsets: char index in doc of tokens, None if
+                    predictions have no char_offsets and not with_offsets
+                example_ind: index of prediction of tokens
+                lengths: number of text tokens of each prediction
+        """
+        # [PAD] id is 0, [CLS] and [SEP] are the first and last non padding
+        lengths = np.array(
+            [max(np.count_nonzero(p['input_ids']) - 2, 0) for p in pred_list],
+            dtype=np.int64)
+        label_ids = np.concatenate(
+            [np.asarray(p[problem])[1:1+n] for p, n in zip(pred_list, lengths)] +
+            [np.zeros([0], dtype=np.int64)]).astype(np.int64)
+
+        if all(['char_offsets' in p for p in pred_list]):
+            offsets = np.concatenate(
+                [p['char_offsets'] for p in pred_list] +
+                [np.zeros([0], dtype=np.int64)]).astype(np.int64)
+            tokens = np.concatenate(
+                [np.array(list(doc), dtype=object)[p['char_offsets']]
+                 for p, doc in zip(pred_list, doc_list)] +
+                [np.zeros([0], dtype=object)])
+        else:
+            input_ids = np.concatenate(
+                [np.asarray(p['input_ids'])[1:1+n] for p, n in zip(pred_list, lengths)] +
+                [np.zeros([0], dtype=np.int64)]).astype(np.int64)
+            tokens = self.id_to_token[input_ids]
+            offsets = None
+            if with_offsets:
+                # create_predict_example tokenizes char by char as well
+                from .input_fn import tokenize_with_offsets
+                offsets = np.concatenate(
+                    [np.array(tokenize_with_offsets(doc, self.tokenizer)[1][:n], dtype=np.int64)
+                     for doc, n in zip(doc_list, lengths)] +
+                    [np.zeros([0], dtype=np.int64)])
+
+        return {
+            'tokens': tokens,
+            'label_ids': label_ids,
+            'offsets': offsets,
+            'example_ind': np.repeat(np.arange(len(pred_list)), lengths),
+            'lengths': lengths}
+
+    @staticmethod
+    def split_segments(is_start, lengths):
+        """Split flat tokens into segments. A segment starts where
+        is_start is True or at the first token of a prediction, and ends
+        before the next start.
+
+        Returns:
+            tuple -- (segment start index, segment end index inclusive)
+        """
+        is_start = is_start.copy()
+        example_start = (np.cumsum(lengths) - lengths)[lengths > 0]
+        is_start[example_start] = True
+        seg_start = np.flatnonzero(is_start)
+        # no segment end if batch has no text tokens
+        seg_end = np.append(seg_start[1:], len(is_start))[:len(seg_start)] - 1
+        return seg_start, seg_end
+
+    @staticmethod
+    def group_by_example(flat, seg_start, num_examples):
+        """Index of segments of each prediction"""
+        seg_example = flat['example_ind'][seg_start]
+        bounds = np.searchsorted(seg_example, np.arange(num_examples + 1))
+        return [range(bounds[ind], bounds[ind+1]) for ind in range(num_examples)]
+
+    def join_tokens(self, tokens, seg_start, seg_end):
+        return [''.join(tokens[start:end+1]) for start, end in zip(seg_start, seg_end)]
+
+
+class NERDecoder(SeqTagDecoder):
+    """Merge BIO tags into entities. A token tagged I joins the segment
+    before it, any other token starts a new segment."""
+
+    def __init__(self, label_encoder, tokenizer):
+        super().__init__(label_encoder, tokenizer)
+        self.is_begin = self.label_flag(lambda label: label[0] == 'B')
+        self.is_inside = self.label_flag(lambda label: label[0] == 'I')
+        self.label_type = np.array(
+            [label if label == 'O' else label[2:] for label in self.labels], dtype=object)
+
+    def decode(self, pred_list, problem, doc_list, extract_ent=True, with_offsets=False):
+        """Decode predictions into entities
+
+        Arguments:
+            pred_list {list} -- predictions of PredictModel.predict
+            problem {str} -- problem name
+            doc_list {list} -- input texts of predictions
+
+        Keyword Arguments:
+            extract_ent {bool} -- if True, return entities only, otherwise
+                every segment with 'O' for non entity (default: {True})
+            with_offsets {bool} -- add char start and end (exclusive)
+                in doc, see SeqTagDecoder.flatten (default: {False})
+
+        Returns:
+            list -- for each prediction, list of (text, type) or
+                (text, type, start, end)
+        """
+        flat = self.flatten(pred_list, problem, doc_list, with_offsets)
+        label_ids = flat['label_ids']
+        seg_start, seg_end = self.split_segments(
+            ~self.is_inside[label_ids], flat['lengths'])
+        seg_text = self.join_tokens(flat['tokens'], seg_start, seg_end)
+        seg_type = self.label_type[label_ids[seg_start]]
+        seg_keep = self.is_begin[label_ids[seg_start]] if extract_ent \
+            else np.ones(len(seg_start), dtype=bool)
+        if with_offsets:
+            seg_char_start = flat['offsets'][seg_start]
+            seg_char_end = flat['offsets'][seg_end] + 1
+
+        result_list = []
+        for seg_range in self.group_by_example(flat, seg_start, len(pred_list)):
+            if with_offsets:
+                result_list.append([
+                    (seg_text[ind], seg_type[ind], int(seg_char_start[ind]), int(seg_char_end[ind]))
+                    for ind in seg_range if seg_keep[ind]])
+            else:
+                result_list.append([
+                    (seg_text[ind], seg_type[ind]) for ind in seg_range if seg_keep[ind]])
+        return result_list
+
+
+class CWSDecoder(SeqTagDecoder):
+    """Merge BMES tags into words. A word ends at a token tagged s or e,
+    or at the last token."""
+
+    def __init__(self, label_encoder, tokenizer):
+        super().__init__(label_encoder, tokenizer)
+        self.is_end = self.label_flag(lambda label: label in ['s', 'e'])
+
+    def decode(self, pred_list, problem, doc_list, with_offsets=False):
+        """Decode predictions into words
+
+        Arguments:
+            pred_list {list} -- predictions of PredictModel.predict
+            problem {str} -- problem name
+            doc_list {list} -- input texts of predictions
+
+        Keyword Arguments:
+            with_offsets {bool} -- return words with offsets instead of
+                segmented string (default: {False})
+
+        Returns:
+            list -- for each prediction, words seperated by space, or
+                list of (word, start, end) if with_offsets
+        """
+        flat = self.flatten(pred_list, problem, doc_list, with_offsets)
+        is_end = self.is_end[flat['label_ids']]
+        seg_start, seg_end = self.split_segments(
+            np.roll(is_end, 1), flat['lengths'])
+        seg_text = self.join_tokens(flat['tokens'], seg_start, seg_end)
+        # space follows a word ended by s or e
+        seg_sep = np.where(is_end[seg_end], ' ', '')
+        if with_offsets:
+            seg_char_start = flat['offsets'][seg_start]
+            seg_char_end = flat['offsets'][seg_end] + 1
+
+        result_list = []
+        for seg_range in self.group_by_example(flat, seg_start, len(pred_list)):
+            if with_offsets:
+                result_list.append([
+                    (seg_text[ind], int(seg_char_start[ind]), int(seg_char_end[ind]))
+                    for ind in seg_range])
+            else:
+                result_list.append(''.join(
+                    [seg_text[ind] + seg_sep[ind] for ind in seg_range]))
+        return result_list
@@ -0,0 +1,276 @@
+import os
+import re
+import glob
+import copy
+import shutil
+
+import numpy as np
+import tensorflow as tf
+
+from .model_fn import BertMultiTask
+from .input_fn import train_eval_input_fn
+from .params import Params
+from .estimator import Estimator
+from .encoder import get_layer_sizes
+from .utils import create_path
+from .ckpt_restore_hook import RestoreCheckpointHook
+from .estimator_wrapper import get_predict_variable_names, save_variables, write_predict_files
+
+
+def compute_importance(params, num_batches=None):
+    """Importance of attention heads and intermediate neurons of the
+    latest checkpoint of params.ckpt_dir, on the eval set of its problems.
+
+    The context of every head and every intermediate activation is
+    multiplied by a mask of ones. Importance of a unit is the absolute
+    gradient of eval loss w.r.t. its mask summed over batches, the first
+    order estimate of the loss change if the unit is removed. Head
+    importance is normalized by its l2 norm within each layer.
+
+    Arguments:
+        params {Params} -- params, assign_problem should be called
+            with ckpt_dir pointing to the trained checkpoint
+
+    Keyword Arguments:
+        num_batches {int} -- number of eval batches, the whole eval
+            set if None (default: {None})
+
+    Returns:
+        tuple -- (head_importance, ffn_importance), lists of np.ndarray,
+            [num_attention_heads] and [intermediate_size] of each layer
+    """
+    checkpoint_path = tf.train.latest_checkpoint(params.ckpt_dir)
+    if checkpoint_path is None:
+        raise ValueError('No checkpoint found in %s' % params.ckpt_dir)
+    model = BertMultiTask(params=params)
+    bert_config = model.get_bert_config()
+
+    with tf.Graph().as_default():
+        tf.train.get_or_create_global_step()
+        features = train_eval_input_fn(
+            params, mode='eval').make_one_shot_iterator().get_next()
+        head_mask_list = []
+        ffn_mask_list = []
+        for layer_idx in range(bert_config.num_hidden_layers):
+            num_attention_heads, intermediate_size = get_layer_sizes(
+                bert_config, layer_idx)
+            head_mask_list.append(tf.ones([num_attention_heads]))
+            ffn_mask_list.append(tf.ones([intermediate_size]))
+        hidden_feature = model.layer_body(
+            features, bert_config, is_training=False,
+            head_mask_list=head_mask_list, ffn_mask_list=ffn_mask_list)
+        # eval top returns (metrics, loss) of each problem
+        return_dict = model.top(
+            features, hidden_feature, tf.estimator.ModeKeys.EVAL)
+        loss = tf.add_n([return_dict[problem][1] for problem in return_dict])
+        grad_list = tf.gradients(loss, head_mask_list + ffn_mask_list)
+
+        importance_list = [np.zeros(mask.shape.as_list(), dtype=np.float64)
+                           for mask in head_mask_list + ffn_mask_list]
+        batch_ind = 0
+        with tf.Session() as sess:
+            tf.train.Saver().restore(sess, checkpoint_path)
+            while num_batches is None or batch_ind < num_batches:
+                try:
+                    grad_value_list = sess.run(grad_list)
+                except tf.errors.OutOfRangeError:
+                    break
+                for importance, grad_value in zip(importance_list, grad_value_list):
+                    importance += np.abs(grad_value)
+                batch_ind += 1
+    tf.logging.info('Importance computed on %d eval batches' % batch_ind)
+
+    num_layers = bert_config.num_hidden_layers
+    head_importance = [
+        importance / (np.linalg.norm(importance) + 1e-20)
+        for importance in importance_list[:num_layers]]
+    return head_importance, importance_list[num_layers:]
+
+
+def select_units(head_importance, ffn_importance, head_prune_ratio, ffn_prune_ratio):
+    """Select heads and intermediate neurons to keep.
+
+    The least important head_prune_ratio of all heads are pruned,
+    ranked across layers, but every layer keeps at least one head.
+    In each layer, the least important ffn_prune_ratio of intermediate
+    neurons are pruned.
+
+    Arguments:
+        head_importance {list} -- see compute_importance
+        ffn_importance {list} -- see compute_importance
+        head_prune_ratio {float} -- ratio of heads to prune
+        ffn_prune_ratio {float} -- ratio of intermediate neurons to prune
+
+    Returns:
+        tuple -- (head_keep_list, ffn_keep_list), sorted index of
+            heads and neurons to keep in each layer
+    """
+    num_pruned = int(sum([len(importance) for importance in head_importance]) *
+                     head_prune_ratio)
+    flat_head_list = sorted([
+        (score, layer_idx, head_idx)
+        for layer_idx, importance in enumerate(head_importance)
+        for head_idx, score in enumerate(importance)])
+    num_left = [len(importance) for importance in head_importance]
+    pruned_head_set = set()
+    for _, layer_idx, head_idx in flat_head_list:
+        if len(pruned_head_set) == num_pruned:
+            break
+        if num_left[layer_idx] == 1:
+            continue
+        pruned_head_set.add((layer_idx, head_idx))
+        num_left[layer_idx] -= 1
+    head_keep_list = [
+        [head_idx for head_idx in range(len(importance))
+         if (layer_idx, head_idx) not in pruned_head_set]
+        for layer_idx, importance in enumerate(head_importance)]
+
+    ffn_keep_list = []
+    for importance in ffn_importance:
+        num_keep = max(int(round(len(importance) * (1 - ffn_prune_ratio))), 1)
+        ffn_keep_list.append(sorted(np.argsort(-importance)[:num_keep].tolist()))
+    return head_keep_list, ffn_keep_list
+
+
+def write_pruned_checkpoint(params, head_keep_list, ffn_keep_list, output_dir):
+    """Write a physically smaller checkpoint of the latest checkpoint of
+    params.ckpt_dir, with only the kept heads and intermediate neurons.
+
+    Columns of query, key and value and rows of attention output of
+    pruned heads, and columns of intermediate and rows of output of
+    pruned neurons are removed. Sizes left in each layer are written to
+    bert_config.json as layer_num_attention_heads and
+    layer_intermediate_size, see encoder.get_layer_sizes. Vocab, label
+    encoders and params.json are copied, so output_dir can be used to
+    predict, or as init checkpoint to fine-tune, see Params.set_init_checkpoint.
+
+    Arguments:
+        params {Params} -- params of the checkpoint
+        head_keep_list {list} -- heads to keep of each layer, see select_units
+        ffn_keep_list {list} -- intermediate neurons to keep of each layer
+        output_dir {str} -- dir to write
+    """
+    checkpoint_path = tf.train.latest_checkpoint(params.ckpt_dir)
+    if checkpoint_path is None:
+        raise ValueError('No checkpoint found in %s' % params.ckpt_dir)
+    bert_config = copy.deepcopy(params.bert_config)
+    size_per_head = bert_config.hidden_size // bert_config.num_attention_heads
+
+    # layers not scored, e.g. beyond problem_encoder_layers, are kept
+    layer_num_attention_heads = []
+    layer_intermediate_size = []
+    for layer_idx in range(bert_config.num_hidden_layers):
+        num_attention_heads, intermediate_size = get_layer_sizes(bert_config, layer_idx)
+        if layer_idx < len(head_keep_list):
+            num_attention_heads = len(head_keep_list[layer_idx])
+            intermediate_size = len(ffn_keep_list[layer_idx])
+        layer_num_attention_heads.append(num_attention_heads)
+        layer_intermediate_size.append(intermediate_size)
+    bert_config.layer_num_attention_heads = layer_num_attention_heads
+    bert_config.layer_intermediate_size = layer_intermediate_size
+
+    reader = tf.train.load_checkpoint(checkpoint_path)
+    value_dict = {}
+    for var_name in get_predict_variable_names(params):
+        value = reader.get_tensor(var_name)
+        match = re.match(r'^bert/encoder/layer_(\d+)/(.*)$', var_name)
+        if match is not None and int(match.group(1)) < len(head_keep_list):
+            layer_idx = int(match.group(1))
+            layer_var_name = match.group(2)
+            head_columns = np.concatenate([
+                np.arange(head_idx * size_per_head, (head_idx + 1) * size_per_head)
+                for head_idx in head_keep_list[layer_idx]])
+            ffn_keep = ffn_keep_list[layer_idx]
+            if re.match(r'^attention/self/(query|key|value)/', layer_var_name):
+                value = value[..., head_columns]
+            elif layer_var_name == 'attention/output/dense/kernel':
+                value = value[head_columns]
+            elif layer_var_name.startswith('intermediate/dense/'):
+                value = value[..., ffn_keep]
+            elif layer_var_name == 'output/dense/kernel':
+                value = value[ffn_keep]
+        value_dict[var_name] = value
+
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+    os.makedirs(output_dir)
+    save_variables(value_dict, os.path.join(output_dir, 'model.ckpt'))
+    pruned_params = copy.copy(params)
+    pruned_params.bert_config = bert_config
+    pruned_params.bert_config_dict = bert_config.__dict__
+    write_predict_files(pruned_params, output_dir)
+
+    def num_units(size_list, num_layers):
+        return sum(size_list[:num_layers])
+    num_layers = len(head_keep_list)
+    tf.logging.info(
+        'Pruned %s to %s. Heads: %d -> %d, intermediate neurons: %d -> %d' % (
+            checkpoint_path, output_dir,
+            num_units([get_layer_sizes(params.bert_config, ind)[0]
+                       for ind in range(num_layers)], num_layers),
+            num_units(layer_num_attention_heads, num_layers),
+            num_units([get_layer_sizes(params.bert_config, ind)[1]
+                       for ind in range(num_layers)], num_layers),
+            num_units(layer_intermediate_size, num_layers)))
+
+
+def prune(params, output_dir, head_prune_ratio, ffn_prune_ratio,
+          finetune_epoch=1, num_batches=None):
+    """Prune heads and intermediate neurons of the latest checkpoint of
+    params.ckpt_dir by importance on eval set, then fine-tune the pruned
+    model on the same problems to recover accuracy.
+
+    The pruned checkpoint is written to output_dir/pruned_init, see
+    write_pruned_checkpoint, and the fine-tuned model to output_dir.
+
+    Arguments:
+        params {Params} -- params, assign_problem should be called
+            with ckpt_dir pointing to the trained checkpoint
+        output_dir {str} -- checkpoint dir of fine-tuned model
+        head_prune_ratio {float} -- ratio of heads to prune
+        ffn_prune_ratio {float} -- ratio of intermediate neurons to prune
+
+    Keyword Arguments:
+        finetune_epoch {float} -- epochs of fine-tuning, no fine-tuning
+            if 0 (default: {1})
+        num_batches {int} -- eval batches to compute importance,
+            see compute_importance (default: {None})
+
+    Returns:
+        Params -- params of fine-tuned model
+    """
+    head_importance, ffn_importance = compute_importance(params, num_batches)
+    head_keep_list, ffn_keep_list = select_units(
+        head_importance, ffn_importance, head_prune_ratio, ffn_prune_ratio)
+    init_dir = os.path.join(output_dir, 'pruned_init')
+    write_pruned_checkpoint(params, head_keep_list, ffn_keep_list, init_dir)
+
+    problem = '|'.join(['&'.join(problem_dict)
+                        for problem_dict in params.run_problem_list])
+    pruned_params = Params()
+    pruned_params.from_json(os.path.join(init_dir, 'params.json'))
+    pruned_params.set_init_checkpoint(init_dir)
+    pruned_params.train_epoch = finetune_epoch
+    # heads are trained with label ids of these encoders
+    create_path(output_dir)
+    for le_path in glob.glob(os.path.join(init_dir, '*_label_encoder.pkl')):
+        shutil.copy2(le_path, output_dir)
+    base_dir, dir_name = os.path.split(output_dir)
+    pruned_params.assign_problem(
+        problem, gpu=1, base_dir=base_dir, dir_name=dir_name)
+    if finetune_epoch <= 0:
+        return pruned_params
+
+    model = BertMultiTask(params=pruned_params)
+    estimator = Estimator(
+        model.get_model_fn(warm_start=False),
+        model_dir=pruned_params.ckpt_dir,
+        params=pruned_params,
+        config=tf.estimator.RunConfig(
+            log_step_count_steps=pruned_params.log_every_n_steps))
+
+    def train_input_fn(): return train_eval_input_fn(pruned_params)
+    estimator.train(
+        train_input_fn, max_steps=pruned_params.train_steps,
+        hooks=[RestoreCheckpointHook(pruned_params)])
+    return pruned_params
@@ -0,0 +1,200 @@
+import os
+import json
+
+import numpy as np
+
+from .numpy_bert import NumpyBert, MANIFEST_NAME, weight_file_name, latest_checkpoint_name
+
+INT8_WEIGHT_DIR_NAME = 'numpy_weights_int8'
+
+
+def quantize_symmetric(x, scale):
+    """Round x / scale to the int8 grid [-127, 127]. Values are returned
+    as float32, see QuantizedNumpyBert.dense"""
+    x = np.rint(x / scale)
+    return np.clip(x, -127, 127, out=x).astype(np.float32, copy=False)
+
+
+class CalibrationNumpyBert(NumpyBert):
+    """NumpyBert that records the range of inputs of every dense layer.
+
+    For each batch, the percentile of absolute input values is recorded,
+    and the range of a dense layer is the mean over batches, so a few
+    outliers do not stretch the int8 grid.
+
+    Arguments:
+        weight_dir {str} -- dir of float weights, see NumpyBert
+
+    Keyword Arguments:
+        percentile {float} -- percentile of absolute values (default: {99.99})
+    """
+
+    def __init__(self, weight_dir, percentile=99.99):
+        super().__init__(weight_dir)
+        self.percentile = percentile
+        self.batch_range_dict = {}
+
+    def dense(self, x, name, activation=None):
+        self.batch_range_dict.setdefault(name, []).append(
+            float(np.percentile(np.abs(x), self.percentile)))
+        return super().dense(x, name, activation)
+
+    def activation_range(self):
+        """Range of inputs of every dense layer seen so far
+
+        Returns:
+            dict -- key: dense name, value: range
+        """
+        return {name: float(np.mean(range_list))
+                for name, range_list in self.batch_range_dict.items()}
+
+
+def calibrate(weight_dir, example_list, batch_size=32, percentile=99.99):
+    """Run float weights over example_list and record activation ranges,
+    see CalibrationNumpyBert
+
+    Arguments:
+        weight_dir {str} -- dir of float weights
+        example_list {list} -- list of dict with input_ids, input_mask
+            and segment_ids
+
+    Keyword Arguments:
+        batch_size {int} -- batch size (default: {32})
+        percentile {float} -- percentile of absolute values (default: {99.99})
+
+    Returns:
+        dict -- key: dense name, value: range
+    """
+    engine = CalibrationNumpyBert(weight_dir, percentile=percentile)
+    engine.predict(example_list, batch_size=batch_size)
+    return engine.activation_range()
+
+
+def quantize_numpy_weights(weight_dir, quant_dir, activation_range):
+    """Write an int8 variant of float weights for QuantizedNumpyBert.
+
+    Kernels of dense layers in activation_range, which are every dense
+    of encoder, pooler and heads, are quantized symmetrically per output
+    channel and stored as int8 with a float32 '<dense>/kernel_scale'.
+    Inputs of these layers are quantized per tensor with scale
+    range / 127 at prediction. Embeddings, biases, layer norms and crf
+    transitions stay float32.
+
+    Arguments:
+        weight_dir {str} -- dir of float weights
+        quant_dir {str} -- dir to write int8 weights
+        activation_range {dict} -- ranges returned by calibrate
+
+    Returns:
+        str -- quant_dir
+    """
+    with open(os.path.join(weight_dir, MANIFEST_NAME), 'r', encoding='utf8') as f:
+        manifest = json.load(f)
+    if not os.path.exists(quant_dir):
+        os.makedirs(quant_dir)
+
+    weight_list = []
+    for name in manifest['weights']:
+        value = np.load(os.path.join(weight_dir, weight_file_name(name)))
+        dense_name = name[:-len('/kernel')]
+        if name.endswith('/kernel') and dense_name in activation_range:
+            kernel_scale = np.max(np.abs(value), axis=0) / 127
+            # all zero channel
+            kernel_scale[kernel_scale == 0] = 1.0
+            np.save(os.path.join(quant_dir, weight_file_name(name + '_scale')),
+                    kernel_scale.astype(np.float32))
+            weight_list.append(name + '_scale')
+            value = quantize_symmetric(value, kernel_scale).astype(np.int8)
+        np.save(os.path.join(quant_dir, weight_file_name(name)), value)
+        weight_list.append(name)
+
+    manifest['weights'] = sorted(weight_list)
+    manifest['quantization'] = {
+        'activation_scale': {
+            name: max(value, 1e-8) / 127 for name, value in activation_range.items()}}
+    with open(os.path.join(quant_dir, MANIFEST_NAME), 'w', encoding='utf8') as f:
+        json.dump(manifest, f, indent=2)
+    return quant_dir
+
+
+class QuantizedNumpyBert(NumpyBert):
+    """NumpyBert with int8 weights and activations in dense layers,
+    loaded from a dir written by quantize_numpy_weights.
+
+    Inputs of a dense layer are rounded to the int8 grid of the
+    calibrated scale and multiplied with the int8 kernel, then the
+    product is rescaled by input scale * kernel scale and bias is added.
+    Products and sums are integers, so the result is the int32
+    accumulation of an int8 gemm up to float32 rounding of large sums.
+
+    NumPy has no int8 gemm with int32 accumulation, so the int8 values
+    are multiplied by float32 matmul. Kernels are converted to float32
+    once at load, so int8 weights take a quarter of the disk of float32
+    ones but the same memory at prediction, and prediction is slightly
+    slower than NumpyBert since inputs are rounded as well. This engine
+    measures the accuracy of int8 prediction, it does not speed it up.
+
+    Arguments:
+        weight_dir {str} -- dir of int8 weights
+    """
+
+    def __init__(self, weight_dir):
+        super().__init__(weight_dir)
+        if 'quantization' not in self.manifest:
+            raise ValueError(
+                '%s holds float weights, quantize them with '
+                'estimator_wrapper.quantize_checkpoint' % weight_dir)
+        self.activation_scale = self.manifest['quantization']['activation_scale']
+        self.int_kernel = {}
+        self.output_scale = {}
+        for name, scale in self.activation_scale.items():
+            self.int_kernel[name] = self.weights[name + '/kernel'].astype(np.float32)
+            self.output_scale[name] = (
+                scale * self.weights[name + '/kernel_scale']).astype(np.float32)
+
+    @classmethod
+    def from_checkpoint(cls, model_dir, weight_dir=None, num_examples=512):
+        """Load int8 weights of the latest checkpoint of model_dir. The
+        checkpoint is quantized with estimator_wrapper.quantize_checkpoint
+        first if not quantized yet or quantized from an older checkpoint,
+        which needs tensorflow and the eval set of its problems.
+
+        Arguments:
+            model_dir {str} -- checkpoint dir or exported inference dir
+
+        Keyword Arguments:
+            weight_dir {str} -- dir of int8 weights, defaults to
+                model_dir/numpy_weights_int8 (default: {None})
+            num_examples {int} -- number of calibration examples (default: {512})
+
+        Returns:
+            QuantizedNumpyBert -- engine
+        """
+        if weight_dir is None:
+            weight_dir = os.path.join(model_dir, INT8_WEIGHT_DIR_NAME)
+        manifest_path = os.path.join(weight_dir, MANIFEST_NAME)
+        checkpoint = latest_checkpoint_name(model_dir)
+
+        quantized_checkpoint = None
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf8') as f:
+                quantized_checkpoint = json.load(f)['checkpoint']
+        if quantized_checkpoint is None or \
+                (checkpoint is not None and checkpoint != quantized_checkpoint):
+            from .params import Params
+            from .estimator_wrapper import quantize_checkpoint
+            params = Params()
+            params.from_predict_dir(model_dir)
+            quantize_checkpoint(params, weight_dir, num_examples=num_examples)
+        return cls(weight_dir)
+
+    def dense(self, x, name, activation=None):
+        if name not in self.activation_scale:
+            return super().dense(x, name, activation)
+        x = np.matmul(quantize_symmetric(x, self.activation_scale[name]),
+                      self.int_kernel[name])
+        x *= self.output_scale[name]
+        x += self.weights[name + '/bias']
+        if activation is not None:
+            x = activation(x)
+        return x
@@ -0,0 +1,272 @@
+import json
+import time
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tensorflow as tf
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class LatencyMetrics():
+    """Latency percentiles over the most recent window_size records"""
+
+    def __init__(self, window_size=10000):
+        self.latency = deque(maxlen=window_size)
+        self.batch_size = deque(maxlen=window_size)
+        self.num_requests = 0
+        self.num_rejected = 0
+        self.num_batches = 0
+
+    def record_request(self, sec):
+        self.latency.append(sec)
+        self.num_requests += 1
+
+    def record_batch(self, batch_size):
+        self.batch_size.append(batch_size)
+        self.num_batches += 1
+
+    def percentile(self, q):
+        if not self.latency:
+            return float('nan')
+        return float(np.percentile(np.array(self.latency), q))
+
+    def to_dict(self):
+        return {
+            'num_requests': self.num_requests,
+            'num_rejected': self.num_rejected,
+            'num_batches': self.num_batches,
+            'mean_batch_size': float(np.mean(self.batch_size)) if self.batch_size else 0.0,
+            'p50_ms': self.percentile(50) * 1000,
+            'p99_ms': self.percentile(99) * 1000}
+
+
+class MicroBatcher():
+    """Collect concurrent requests into micro batches and run one
+    forward pass per batch.
+
+    A batch is run when max_batch_size requests are collected, or
+    max_wait_ms after its first request arrives. predict_fn runs in a
+    single worker thread, so the event loop keeps accepting requests
+    while a batch is running. If max_queue_size requests are waiting,
+    new requests are rejected with QueueFullError.
+
+    Arguments:
+        predict_fn {callable} -- list of str -> list of result
+
+    Keyword Arguments:
+        max_batch_size {int} -- max number of requests of a batch (default: {32})
+        max_wait_ms {float} -- max time a batch waits for more requests (default: {5})
+        max_queue_size {int} -- max number of waiting requests (default: {1024})
+    """
+
+    def __init__(self, predict_fn, max_batch_size=32, max_wait_ms=5, max_queue_size=1024):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.metrics = LatencyMetrics()
+        self.batch_task = None
+
+    def start(self):
+        self.batch_task = asyncio.ensure_future(self.batch_loop())
+
+    async def submit(self, text):
+        """Submit a request and wait for its result
+
+        Arguments:
+            text {str} -- input text
+
+        Raises:
+            QueueFullError -- too many requests waiting
+
+        Returns:
+            object -- result of text returned by predict_fn
+        """
+        start = time.time()
+        future = asyncio.get_event_loop().create_future()
+        try:
+            self.queue.put_nowait((text, future))
+        except asyncio.QueueFull:
+            self.metrics.num_rejected += 1
+            raise QueueFullError('%d requests waiting' % self.queue.qsize())
+        result = await future
+        self.metrics.record_request(time.time() - start)
+        return result
+
+    async def collect_batch(self):
+        loop = asyncio.get_event_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def batch_loop(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = await self.collect_batch()
+            text_list = [text for text, _ in batch]
+            self.metrics.record_batch(len(batch))
+            try:
+                result_list = await loop.run_in_executor(
+                    self.executor, self.predict_fn, text_list)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, result_list):
+                # client may be gone
+                if not future.done():
+                    future.set_result(result)
+
+
+class InferenceServer():
+    """Minimal HTTP/1.1 server around a MicroBatcher
+
+    POST /predict with json body {"text": "..."} returns {"result": ...},
+    503 if the batcher queue is full, 500 if predict_fn raises.
+    Malformed requests get 400 and the connection is closed.
+    GET /metrics returns LatencyMetrics.to_dict, updated with metrics_fn.
+
+    Arguments:
+        batcher {MicroBatcher} -- batcher
+
+    Keyword Arguments:
+        host {str} -- host (default: {'127.0.0.1'})
+        port {int} -- port, 0 to pick a free port (default: {8000})
+        metrics_fn {callable} -- returns dict of extra metrics,
+            e.g. PredictModel.cache_metrics (default: {None})
+    """
+
+    def __init__(self, batcher, host='127.0.0.1', port=8000, metrics_fn=None):
+        self.batcher = batcher
+        self.host = host
+        self.port = port
+        self.metrics_fn = metrics_fn
+        self.server = None
+
+    async def start(self):
+        self.batcher.start()
+        self.server = await asyncio.start_server(
+            self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        tf.logging.info('Serving on http://%s:%d' % (self.host, self.port))
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.batcher.batch_task.cancel()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, headers = await self.read_head(reader, request_line)
+                    content_length = int(headers.get('content-length', 0))
+                    if content_length < 0:
+                        raise ValueError('negative content-length')
+                except ValueError as e:
+                    # rest of a malformed request can not be located
+                    self.write_response(
+                        writer, 400, {'error': 'malformed request: %s' % e})
+                    await writer.drain()
+                    break
+                body = await reader.readexactly(content_length)
+
+                status, response = await self.route(method, path, body)
+                self.write_response(writer, status, response)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def read_head(reader, request_line):
+        """Parse request line and headers, raise ValueError if malformed
+
+        Returns:
+            tuple -- (method, path, headers with lower case keys)
+        """
+        method, path, _ = request_line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, value = line.decode('latin-1').split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+        return method, path, headers
+
+    async def route(self, method, path, body):
+        if method == 'GET' and path == '/metrics':
+            metrics = self.batcher.metrics.to_dict()
+            if self.metrics_fn is not None:
+                metrics.update(self.metrics_fn())
+            return 200, metrics
+        if method == 'POST' and path == '/predict':
+            try:
+                text = json.loads(body.decode('utf8'))['text']
+            except (ValueError, KeyError):
+                return 400, {'error': 'body should be json with text'}
+            try:
+                result = await self.batcher.submit(text)
+            except QueueFullError as e:
+                return 503, {'error': str(e)}
+            except Exception as e:
+                # raised by predict_fn, see MicroBatcher.batch_loop
+                tf.logging.error('Prediction failed: %r' % e)
+                return 500, {'error': 'prediction failed: %s' % e}
+            return 200, {'result': result}
+        return 404, {'error': 'not found'}
+
+    @staticmethod
+    def write_response(writer, status, response):
+        reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+                  500: 'Internal Server Error', 503: 'Service Unavailable'}[status]
+        body = json.dumps(response, ensure_ascii=False).encode('utf8')
+        writer.write(('HTTP/1.1 %d %s\r\n'
+                      'Content-Type: application/json; charset=utf-8\r\n'
+                      'Content-Length: %d\r\n\r\n' % (status, reason, len(body))).encode('latin-1'))
+        writer.write(body)
+
+
+def serve(predict_fn, host='127.0.0.1', port=8000, max_batch_size=32,
+          max_wait_ms=5, max_queue_size=1024, metrics_fn=None):
+    """Serve predict_fn until interrupted, see InferenceServer
+
+    Arguments:
+        predict_fn {callable} -- list of str -> list of result,
+            e.g. ChineseNER(params, model_dir, warm=True).ner
+    """
+    loop = asyncio.get_event_loop()
+    batcher = MicroBatcher(
+        predict_fn, max_batch_size=max_batch_size,
+        max_wait_ms=max_wait_ms, max_queue_size=max_queue_size)
+    server = InferenceServer(batcher, host=host, port=port, metrics_fn=metrics_fn)
+    loop.run_until_complete(server.start())
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        tf.logging.info('Metrics: %s' % json.dumps(batcher.metrics.to_dict()))
+        loop.run_until_complete(server.stop())
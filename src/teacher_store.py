@@ -0,0 +1,167 @@
+import os
+import json
+
+import numpy as np
+
+
+class TeacherLogitsStore():
+    """Memory mapped store of teacher outputs for offline distillation
+
+    For every example, the top k emission logits of each token are stored
+    as uint8, relative to the max logit of the token, with a float16 scale
+    per token. Since softmax is shift invariant, the dequantized logits
+    give the same distribution as the original top k logits. Teacher
+    viterbi tags are stored as well.
+
+    Examples are keyed by the order they are yielded by the problem
+    generator in train mode.
+
+    Files, take NER as example:
+        NER_teacher_meta.json
+        NER_teacher_topk_ids.npy: [num_examples, max_seq_len, top_k]
+        NER_teacher_topk_logits.npy: uint8, [num_examples, max_seq_len, top_k]
+        NER_teacher_scale.npy: float16, [num_examples, max_seq_len]
+        NER_teacher_tags.npy: [num_examples, max_seq_len]
+    """
+
+    def __init__(self, store_dir, problem, mmap_mode='r'):
+        self.store_dir = store_dir
+        self.problem = problem
+        with open(self._path('meta', 'json'), 'r', encoding='utf8') as f:
+            self.meta = json.load(f)
+        self.num_examples = self.meta['num_examples']
+        self.max_seq_len = self.meta['max_seq_len']
+        self.top_k = self.meta['top_k']
+
+        self.topk_ids = np.load(self._path('topk_ids'), mmap_mode=mmap_mode)
+        self.topk_logits = np.load(
+            self._path('topk_logits'), mmap_mode=mmap_mode)
+        self.scale = np.load(self._path('scale'), mmap_mode=mmap_mode)
+        self.tags = np.load(self._path('tags'), mmap_mode=mmap_mode)
+
+    def _path(self, name, ext='npy'):
+        return os.path.join(
+            self.store_dir, '%s_teacher_%s.%s' % (self.problem, name, ext))
+
+    @classmethod
+    def create(cls, store_dir, problem, num_examples, max_seq_len, top_k, num_classes):
+        """Create an empty store and open it for writing"""
+        if not os.path.exists(store_dir):
+            os.makedirs(store_dir, exist_ok=True)
+        if top_k > num_classes:
+            raise ValueError('top_k %d is larger than num_classes %d of %s' % (
+                top_k, num_classes, problem))
+        meta = {'num_examples': num_examples,
+                'max_seq_len': max_seq_len,
+                'top_k': top_k,
+                'num_classes': num_classes}
+        meta_path = os.path.join(
+            store_dir, '%s_teacher_meta.json' % problem)
+        with open(meta_path, 'w', encoding='utf8') as f:
+            json.dump(meta, f)
+
+        id_dtype = np.uint8 if num_classes <= 256 else np.int16
+        shape_dtype = {
+            'topk_ids': ([num_examples, max_seq_len, top_k], id_dtype),
+            'topk_logits': ([num_examples, max_seq_len, top_k], np.uint8),
+            'scale': ([num_examples, max_seq_len], np.float16),
+            'tags': ([num_examples, max_seq_len], id_dtype)}
+        for name, (shape, dtype) in shape_dtype.items():
+            path = os.path.join(
+                store_dir, '%s_teacher_%s.npy' % (problem, name))
+            np.lib.format.open_memmap(
+                path, mode='w+', dtype=dtype, shape=tuple(shape)).flush()
+
+        return cls(store_dir, problem, mmap_mode='r+')
+
+    def write(self, start_index, logits, tags):
+        """Quantize and write a batch of teacher outputs
+
+        Arguments:
+            start_index {int} -- example index of the first example in batch
+            logits {np.ndarray} -- emission logits, [batch_size, max_seq_len, num_classes]
+            tags {np.ndarray} -- viterbi tags, [batch_size, max_seq_len]
+        """
+        logits = np.asarray(logits, dtype=np.float32)
+        end_index = start_index + logits.shape[0]
+
+        topk_ids = np.argsort(-logits, axis=-1)[..., :self.top_k]
+        topk_logits = np.take_along_axis(logits, topk_ids, axis=-1)
+
+        # distance to the max logit, in [0, inf)
+        relative = topk_logits[..., :1] - topk_logits
+        scale = np.max(relative, axis=-1) / 255.
+        scale = np.where(scale > 0, scale, 1.).astype(np.float16)
+        quantized = np.round(
+            relative / scale.astype(np.float32)[..., None])
+
+        self.topk_ids[start_index:end_index] = topk_ids
+        self.topk_logits[start_index:end_index] = np.clip(
+            quantized, 0, 255).astype(np.uint8)
+        self.scale[start_index:end_index] = scale
+        self.tags[start_index:end_index] = tags
+
+    def check_shape(self, max_seq_len, top_k, num_classes=None):
+        """Raise ValueError if the store was dumped with other settings
+        than the student reading it
+
+        Arguments:
+            max_seq_len {int} -- max_seq_len of student
+            top_k {int} -- teacher_logits_top_k of student
+
+        Keyword Arguments:
+            num_classes {int} -- number of classes of problem, not
+                checked if None (default: {None})
+        """
+        expected = {'max_seq_len': max_seq_len, 'top_k': top_k}
+        if num_classes is not None:
+            expected['num_classes'] = num_classes
+        mismatch = ['%s %s in store, %s in params' % (key, self.meta.get(key), value)
+                    for key, value in expected.items() if self.meta.get(key) != value]
+        if mismatch:
+            raise ValueError(
+                'Teacher logits store of %s in %s does not match params: %s. '
+                'Dump the teacher logits again with the same params' % (
+                    self.problem, self.store_dir, ', '.join(mismatch)))
+
+    def flush(self):
+        for array in [self.topk_ids, self.topk_logits, self.scale, self.tags]:
+            array.flush()
+
+    def read(self, index):
+        """Read teacher outputs of one example
+
+        Returns:
+            tuple -- (topk_ids, topk_logits, tags)
+                topk_ids: int32, [max_seq_len, top_k]
+                topk_logits: float32, [max_seq_len, top_k]
+                tags: int32, [max_seq_len]
+        """
+        topk_logits = - self.topk_logits[index].astype(np.float32) * \
+            self.scale[index].astype(np.float32)[:, None]
+        return (self.topk_ids[index].astype(np.int32),
+                topk_logits,
+                self.tags[index].astype(np.int32))
+
+    def get_features(self, index):
+        """Teacher outputs of one example as features dict"""
+        if index >= self.num_examples:
+            raise IndexError(
+                'Teacher logits store of %s has %d examples, got index %d' % (
+                    self.problem, self.num_examples, index))
+        topk_ids, topk_logits, tags = self.read(index)
+        return {
+            '%s_teacher_topk_ids' % self.problem: topk_ids,
+            '%s_teacher_topk_logits' % self.problem: topk_logits,
+            '%s_teacher_tags' % self.problem: tags
+        }
+
+    def get_dummy_features(self):
+        return {
+            '%s_teacher_topk_ids' % self.problem: np.zeros(
+                [self.max_seq_len, self.top_k], dtype=np.int32),
+            '%s_teacher_topk_logits' % self.problem: np.zeros(
+                [self.max_seq_len, self.top_k], dtype=np.float32),
+            '%s_teacher_tags' % self.problem: np.zeros(
+                [self.max_seq_len], dtype=np.int32)
+        }
@@ -49,32 +49,47 @@ class SequenceLabel(TopLayer):
     def create_smooth_label(self, labels, num_classes):
         # since crf dose not take the smoothed label, consider the
         # 'hard' smoothing. That is, sample a tag based on smooth factor
+        #
+        # The sample set is int(num_classes/label_smoothing) copies of the
+        # true label plus one copy of every class. Instead of building that
+        # set, draw an index into it and map the index back to a label:
+        # index < num_copies -> true label, otherwise index - num_copies.
+        # This keeps the distribution while using O(batch*seq) memory.
         if self.params.label_smoothing > 0:
-
-            true_labels = tf.stack(
-                [labels]*int(num_classes/self.params.label_smoothing), axis=-1)
-            single_label_set = tf.stack([tf.range(
-                num_classes)]*self.params.max_seq_len, axis=0)
-            batch_size_this_turn = tf.shape(true_labels)[0]
-            label_set = tf.broadcast_to(
-                input=single_label_set, shape=[batch_size_this_turn,
-                                               single_label_set.shape.as_list()[
-                                                   0],
-                                               single_label_set.shape.as_list()[1]])
-            sample_set = tf.concat([true_labels, label_set], axis=-1)
-
-            dims = tf.shape(sample_set)
-            sample_set = tf.reshape(sample_set, shape=[-1, dims[-1]])
-
+            num_copies = int(num_classes/self.params.label_smoothing)
             samples_index = tf.random_uniform(
-                shape=[tf.shape(sample_set)[0], 1], minval=0, maxval=tf.shape(sample_set)[1], dtype=tf.int32)
-            flat_offsets = tf.reshape(
-                tf.range(0, tf.shape(sample_set)[0], dtype=tf.int32) * tf.shape(sample_set)[1], [-1, 1])
-            flat_index = tf.reshape(samples_index+flat_offsets, [-1])
-            sampled_label = tf.gather(
-                tf.reshape(sample_set, [-1]), flat_index)
-            sampled_label = tf.reshape(sampled_label, dims[:-1])
-        return sampled_label
+                shape=tf.shape(labels), minval=0,
+                maxval=num_copies + num_classes, dtype=tf.int32)
+            sampled_label = tf.where(
+                samples_index < num_copies,
+                labels, samples_index - num_copies)
+            return sampled_label
+        return labels
+
+    def partial_crf_log_likelihood(self, logits, labels, label_mask, seq_length):
+        """CRF log likelihood of partially labelled sequences. Positions
+        with label_mask 0 can take any tag, so the likelihood sums over
+        all paths that agree with labels where label_mask is 1. Same as
+        crf_log_likelihood if label_mask is all 1.
+
+        Arguments:
+            logits {tensor} -- [batch_size, seq_length, num_classes]
+            labels {tensor} -- [batch_size, seq_length]
+            label_mask {tensor} -- [batch_size, seq_length]
+            seq_length {tensor} -- [batch_size]
+
+        Returns:
+            tensor -- log likelihood, [batch_size]
+        """
+        num_classes = logits.shape[-1].value
+        label_mask = tf.cast(tf.expand_dims(label_mask, axis=-1), tf.float32)
+        allowed = tf.maximum(
+            tf.one_hot(labels, depth=num_classes), 1.0 - label_mask)
+        constrained_logits = logits + (1.0 - allowed) * -10000.0
+        return tf.contrib.crf.crf_log_norm(
+            constrained_logits, seq_length, self.crf_transition_param) - \
+            tf.contrib.crf.crf_log_norm(
+                logits, seq_length, self.crf_transition_param)
 
     def __call__(self, features, hidden_feature, mode, problem_name, mask=None):
         hidden_feature = hidden_feature['seq']
@@ -100,6 +115,7 @@ class SequenceLabel(TopLayer):
         # CRF transition param
         crf_transition_param = tf.get_variable(
             'crf_transition', shape=[num_classes, num_classes])
+        self.crf_transition_param = crf_transition_param
 
         # sequence_weight = tf.cast(features["input_mask"], tf.float32)
         seq_length = tf.reduce_sum(features["input_mask"], axis=-1)
@@ -108,9 +124,15 @@ class SequenceLabel(TopLayer):
             seq_labels = features['%s_label_ids' % problem_name]
             seq_labels = self.create_smooth_label(seq_labels, num_classes)
             with tf.variable_scope('CRF'):
-                log_likelihood, _ = tf.contrib.crf.crf_log_likelihood(
-                    logits, seq_labels, seq_length,
-                    transition_params=crf_transition_param)
+                if '%s_label_mask' % problem_name in features:
+                    # windows of long sequence, see split_seq_windows
+                    log_likelihood = self.partial_crf_log_likelihood(
+                        logits, seq_labels,
+                        features['%s_label_mask' % problem_name], seq_length)
+                else:
+                    log_likelihood, _ = tf.contrib.crf.crf_log_likelihood(
+                        logits, seq_labels, seq_length,
+                        transition_params=crf_transition_param)
             loss_multiplier = tf.cast(
                 features['%s_loss_multiplier' % problem_name], tf.float32)
             # multiply with loss multiplier to make some loss as zero
@@ -123,25 +145,34 @@ class SequenceLabel(TopLayer):
             seq_labels = features['%s_label_ids' % problem_name]
 
             with tf.variable_scope('CRF'):
-
-                log_likelihood, _ = tf.contrib.crf.crf_log_likelihood(
-                    logits, seq_labels, seq_length,
-                    transition_params=crf_transition_param)
+                if '%s_label_mask' % problem_name in features:
+                    # same as train, overlaps of windows are scored once
+                    log_likelihood = self.partial_crf_log_likelihood(
+                        logits, seq_labels,
+                        features['%s_label_mask' % problem_name], seq_length)
+                else:
+                    log_likelihood, _ = tf.contrib.crf.crf_log_likelihood(
+                        logits, seq_labels, seq_length,
+                        transition_params=crf_transition_param)
 
             seq_loss = tf.reduce_mean(-log_likelihood)
 
+            # overlaps of windows are counted once
+            metric_weights = features.get(
+                '%s_label_mask' % problem_name, features['input_mask'])
+
             def metric_fn(label_ids, logits):
                 predictions = tf.argmax(logits, axis=-1, output_type=tf.int32)
                 prob = tf.nn.softmax(logits)
                 accuracy = tf.metrics.accuracy(
-                    label_ids, predictions, weights=features['input_mask'])
+                    label_ids, predictions, weights=metric_weights)
                 acc_per_seq = get_t2t_metric_op(metrics.METRICS_FNS[
                     metrics.Metrics.ACC_PER_SEQ],
                     prob, features, label_ids)
                 one_hot_labels = tf.one_hot(
                     label_ids, depth=num_classes)
                 f1_score = tf.contrib.metrics.f1_score(
-                    one_hot_labels, prob, weights=features['input_mask'])
+                    one_hot_labels, prob, weights=metric_weights)
 
                 return {
                     "Accuracy": accuracy,
@@ -153,11 +184,84 @@ class SequenceLabel(TopLayer):
             self.eval_metrics = eval_metrics
             return self.eval_metrics
         elif mode == tf.estimator.ModeKeys.PREDICT:
+            if self.params.crf_decode_on_host:
+                # decoded by PredictModel, see src/viterbi.py
+                self.prob = logits
+                return self.prob
             viterbi_sequence, viterbi_score = tf.contrib.crf.crf_decode(
                 logits, crf_transition_param, seq_length)
+            self.viterbi_score = viterbi_score
             self.prob = viterbi_sequence
             return self.prob
 
+    def confidence(self, features):
+        """Probability of the viterbi path of each sequence,
+        should be called after __call__ in predict mode
+
+        Returns:
+            tensor -- [batch_size]
+        """
+        seq_length = tf.reduce_sum(features["input_mask"], axis=-1)
+        if self.params.crf_decode_on_host:
+            _, viterbi_score = tf.contrib.crf.crf_decode(
+                self.logits, self.crf_transition_param, seq_length)
+        else:
+            viterbi_score = self.viterbi_score
+        log_norm = tf.contrib.crf.crf_log_norm(
+            self.logits, seq_length, self.crf_transition_param)
+        return tf.exp(viterbi_score - log_norm)
+
+    def distill_loss(self, features, problem_name, teacher_logits, teacher_tags,
+                     teacher_ids=None):
+        """Distillation loss against teacher, should be called after __call__
+
+        Loss contains two parts:
+        1. cross entropy between softened teacher and student emissions
+        2. negative crf log likelihood of the teacher viterbi path
+
+        Arguments:
+            features {dict} -- feature dict
+            problem_name {str} -- problem name
+            teacher_logits {tensor} -- teacher emission logits,
+                [batch_size, seq_length, num_classes]
+            teacher_tags {tensor} -- teacher viterbi path, [batch_size, seq_length]
+
+        Keyword Arguments:
+            teacher_ids {tensor} -- if specified, teacher_logits are top k logits
+                of these classes, [batch_size, seq_length, top_k] (default: {None})
+
+        Returns:
+            tensor -- loss
+        """
+        temperature = self.params.distillation_temperature
+        seq_length = tf.reduce_sum(features["input_mask"], axis=-1)
+        token_weight = tf.cast(features["input_mask"], tf.float32)
+
+        soft_target = tf.nn.softmax(teacher_logits / temperature)
+        student_log_prob = tf.nn.log_softmax(self.logits / temperature)
+        if teacher_ids is not None:
+            # [batch_size, seq_length, top_k, num_classes]
+            one_hot_ids = tf.one_hot(
+                teacher_ids, depth=tf.shape(self.logits)[-1])
+            student_log_prob = tf.reduce_sum(
+                one_hot_ids * tf.expand_dims(student_log_prob, axis=2), axis=-1)
+        token_loss = - tf.reduce_sum(soft_target * student_log_prob, axis=-1)
+        # scale by T^2 to keep the gradient magnitude of hard loss
+        emission_loss = tf.reduce_sum(token_loss * token_weight) / \
+            (tf.reduce_sum(token_weight) + 1e-5) * temperature ** 2
+
+        with tf.variable_scope('CRF'):
+            log_likelihood, _ = tf.contrib.crf.crf_log_likelihood(
+                self.logits, teacher_tags, seq_length,
+                transition_params=self.crf_transition_param)
+        loss_multiplier = tf.cast(
+            features['%s_loss_multiplier' % problem_name], tf.float32)
+        crf_loss = tf.reduce_mean(-log_likelihood * loss_multiplier)
+
+        distill_loss = emission_loss + crf_loss
+        tf.summary.scalar('%s_distill_loss' % problem_name, distill_loss)
+        return distill_loss
+
 
 class Classification(TopLayer):
     def create_loss(self, labels, logits,  num_classes):
@@ -229,6 +333,29 @@ class Classification(TopLayer):
             self.prob = prob
             return self.prob
 
+    def confidence(self, features):
+        """Max class probability of each example,
+        should be called after __call__
+
+        Returns:
+            tensor -- [batch_size]
+        """
+        return tf.reduce_max(tf.nn.softmax(self.logits), axis=-1)
+
+    def distill_loss(self, features, problem_name, teacher_logits):
+        """Cross entropy between softened teacher and student distribution,
+        should be called after __call__"""
+        temperature = self.params.distillation_temperature
+        soft_target = tf.nn.softmax(teacher_logits / temperature)
+        student_log_prob = tf.nn.log_softmax(self.logits / temperature)
+        batch_loss = - tf.reduce_sum(soft_target * student_log_prob, axis=-1)
+        loss_multiplier = tf.cast(
+            features['%s_loss_multiplier' % problem_name], tf.float32)
+        distill_loss = tf.reduce_mean(
+            batch_loss * loss_multiplier) * temperature ** 2
+        tf.summary.scalar('%s_distill_loss' % problem_name, distill_loss)
+        return distill_loss
+
 
 class MaskLM(TopLayer):
     def __call__(self, features, hidden_feature, mode, problem_name):
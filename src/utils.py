@@ -14,6 +14,8 @@ import tensorflow as tf
 from bert.tokenization import (_is_control,
                                printable_text)
 
+from .teacher_store import TeacherLogitsStore
+
 
 class LabelEncoder(BaseEstimator, TransformerMixin):
 
@@ -205,6 +207,86 @@ def _truncate_seq_pair(tokens_a, tokens_b, max_length, rng):
                 trunc_tokens.pop()
 
 
+def get_window_starts(num_tokens, window_length, stride):
+    """Start index of overlapping windows of window_length every stride
+    tokens, the last window ends at the last token.
+
+    Arguments:
+        num_tokens {int} -- number of tokens
+        window_length {int} -- max number of tokens in a window
+        stride {int} -- distance of start of two windows
+
+    Returns:
+        list -- list of start index
+
+    Raises:
+        ValueError -- if stride is not in (0, window_length], tokens
+            between windows would not be covered
+    """
+    if not 0 < stride <= window_length:
+        raise ValueError(
+            'Window stride should be in (0, %d], the window length without '
+            '[CLS] and [SEP], got %s. Check predict_window_stride and '
+            'train_window_stride' % (window_length, stride))
+    start_list = list(range(0, max(num_tokens - window_length, 0) + 1, stride))
+    if start_list[-1] + window_length < num_tokens:
+        start_list.append(num_tokens - window_length)
+    return start_list
+
+
+def assign_central_window(num_tokens, window_length, start_list):
+    """For every token, find the window it is most central in. That
+    window sees the most context on both sides of the token. Ties go
+    to the earlier window.
+
+    Arguments:
+        num_tokens {int} -- number of tokens
+        window_length {int} -- max number of tokens in a window
+        start_list {list} -- start index of windows, see get_window_starts
+
+    Returns:
+        np.ndarray -- index in start_list of each token, [num_tokens]
+    """
+    positions = np.arange(num_tokens)
+    best_window = np.zeros(num_tokens, dtype=np.int32)
+    best_score = np.full(num_tokens, -1, dtype=np.int32)
+    for ind, start in enumerate(start_list):
+        end = min(start + window_length, num_tokens)
+        # distance to the nearer edge of window
+        score = np.minimum(positions - start, end - 1 - positions)
+        is_better = (positions >= start) & (
+            positions < end) & (score > best_score)
+        best_window[is_better] = ind
+        best_score[is_better] = score[is_better]
+    return best_window
+
+
+def split_seq_windows(tokens_a, target, window_length, stride):
+    """Split a sequential tagging example into overlapping windows.
+    Every token is labelled in exactly one window, the one it is most
+    central in, see assign_central_window.
+
+    Arguments:
+        tokens_a {list} -- tokens
+        target {list} -- labels aligned with tokens
+        window_length {int} -- max number of tokens in a window
+        stride {int} -- distance of start of two windows
+
+    Returns:
+        list -- list of (tokens, target, label_mask) of windows
+    """
+    start_list = get_window_starts(len(tokens_a), window_length, stride)
+    central_window = assign_central_window(
+        len(tokens_a), window_length, start_list)
+    window_list = []
+    for ind, start in enumerate(start_list):
+        end = start + window_length
+        label_mask = (central_window[start:end] == ind).astype(int).tolist()
+        window_list.append(
+            (tokens_a[start:end], target[start:end], label_mask))
+    return window_list
+
+
 def truncate_seq_pair(tokens_a, tokens_b, target, max_length, rng=None, is_seq=False):
     if tokens_b is None:
         if len(tokens_a) > max_length - 2:
@@ -294,9 +376,13 @@ def create_single_problem_generator(problem,
             Example:
                 Before: inputs: ['a', '&', 'c'] target: [0, 0, 1]
                 After: inputs: ['a', 'c'] target: [0, 1]
-        2. Add [CLS], [SEP] tokens
-        3. Padding
-        4. yield result dict
+        2. Truncate, or if params.train_window_stride is set, split long
+            sequential tagging examples into overlapping windows. Each
+            window comes with '<problem>_label_mask', 1 for positions
+            whose label is trained in this window.
+        3. Add [CLS], [SEP] tokens
+        4. Padding
+        5. yield result dict
 
     Arguments:
         problem {str} -- problem name
@@ -314,6 +400,9 @@ def create_single_problem_generator(problem,
     # for sequential labeling, targets needs to align with any
     # change of inputs
     is_seq = problem_type in ['seq_tag']
+    # long seq_tag examples are split into windows instead of truncated,
+    # see split_seq_windows
+    use_label_mask = is_seq and bool(params.train_window_stride)
 
     for ex_index, example in enumerate(zip(inputs_list, target_list)):
         raw_inputs, raw_target = example
@@ -340,100 +429,117 @@ def create_single_problem_generator(problem,
                 tf.logging.warning('Data %d broken' % ex_index)
                 continue
 
-        tokens_a, tokens_b, target = truncate_seq_pair(
-            tokens_a, tokens_b, target, params.max_seq_len, is_seq=is_seq)
-
-        tokens, segment_ids, target = add_special_tokens_with_seqs(
-            tokens_a, tokens_b, target, is_seq)
-
-        if params.augument_mask_lm:
-            rng = random.Random()
-            (mask_lm_tokens, masked_lm_positions,
-                masked_lm_labels) = create_masked_lm_predictions(
-                    tokens,
-                    params.masked_lm_prob,
-                    params.max_predictions_per_seq,
-                    list(tokenizer.vocab.keys()), rng)
-            _, mask_lm_tokens, _, _ = create_mask_and_padding(
-                mask_lm_tokens, copy(segment_ids), copy(target), params.max_seq_len, is_seq)
-            masked_lm_weights, masked_lm_labels, masked_lm_positions, _ = create_mask_and_padding(
-                masked_lm_labels, masked_lm_positions, None, params.max_predictions_per_seq)
-            mask_lm_input_ids = tokenizer.convert_tokens_to_ids(
-                mask_lm_tokens)
-            masked_lm_ids = tokenizer.convert_tokens_to_ids(masked_lm_labels)
-
-        input_mask, tokens, segment_ids, target = create_mask_and_padding(
-            tokens, segment_ids, target, params.max_seq_len, is_seq)
-
-        input_ids = tokenizer.convert_tokens_to_ids(tokens)
-
-        if isinstance(target, list):
-            label_id = label_encoder.transform(target).tolist()
-            label_id = [np.int32(i) for i in label_id]
+        if is_seq and params.train_window_stride and tokens_b is None:
+            window_list = split_seq_windows(
+                tokens_a, target, params.max_seq_len - 2, params.train_window_stride)
         else:
-            label_id = label_encoder.transform([target]).tolist()[0]
-            label_id = np.int32(label_id)
+            tokens_a, tokens_b, target = truncate_seq_pair(
+                tokens_a, tokens_b, target, params.max_seq_len, is_seq=is_seq)
+            window_list = [(tokens_a, target, None)]
+
+        for tokens_a, target, window_label_mask in window_list:
+            tokens, segment_ids, target = add_special_tokens_with_seqs(
+                tokens_a, tokens_b, target, is_seq)
 
-        assert len(input_ids) == params.max_seq_len
-        assert len(input_mask) == params.max_seq_len
-        assert len(segment_ids) == params.max_seq_len, segment_ids
-        if is_seq:
-            assert len(label_id) == params.max_seq_len
-
-        if ex_index < 5:
-            tf.logging.debug("*** Example ***")
-            tf.logging.debug("tokens: %s" % " ".join(
-                [printable_text(x) for x in tokens]))
-            tf.logging.debug("input_ids: %s" %
-                             " ".join([str(x) for x in input_ids]))
-            tf.logging.debug("input_mask: %s" %
-                             " ".join([str(x) for x in input_mask]))
-            tf.logging.debug("segment_ids: %s" %
-                             " ".join([str(x) for x in segment_ids]))
-            if is_seq:
-                tf.logging.debug("%s_label_ids: %s" %
-                                 (problem, " ".join([str(x) for x in label_id])))
-            else:
-                tf.logging.debug("%s_label_ids: %s" %
-                                 (problem, str(label_id)))
             if params.augument_mask_lm:
-                tf.logging.debug("mask lm tokens: %s" % " ".join(
-                    [printable_text(x) for x in mask_lm_tokens]))
-                tf.logging.debug("mask lm input_ids: %s" %
-                                 " ".join([str(x) for x in mask_lm_input_ids]))
-                tf.logging.debug("mask lm label ids: %s" %
-                                 " ".join([str(x) for x in masked_lm_ids]))
-                tf.logging.debug("mask lm position: %s" %
-                                 " ".join([str(x) for x in masked_lm_positions]))
-
-        if not params.augument_mask_lm:
-            yield {
-                'input_ids': input_ids,
-                'input_mask': input_mask,
-                'segment_ids': segment_ids,
-                '%s_label_ids' % problem: label_id
-            }
-        else:
-            if random.uniform(0, 1) <= params.augument_rate:
-                yield {
-                    'input_ids': mask_lm_input_ids,
-                    'input_mask': input_mask,
-                    'segment_ids': segment_ids,
-                    '%s_label_ids' % problem: label_id,
-                    "masked_lm_positions": masked_lm_positions,
-                    "masked_lm_ids": masked_lm_ids,
-                    "masked_lm_weights": masked_lm_weights,
-                }
+                rng = random.Random()
+                (mask_lm_tokens, masked_lm_positions,
+                    masked_lm_labels) = create_masked_lm_predictions(
+                        tokens,
+                        params.masked_lm_prob,
+                        params.max_predictions_per_seq,
+                        list(tokenizer.vocab.keys()), rng)
+                _, mask_lm_tokens, _, _ = create_mask_and_padding(
+                    mask_lm_tokens, copy(segment_ids), copy(target), params.max_seq_len, is_seq)
+                masked_lm_weights, masked_lm_labels, masked_lm_positions, _ = create_mask_and_padding(
+                    masked_lm_labels, masked_lm_positions, None, params.max_predictions_per_seq)
+                mask_lm_input_ids = tokenizer.convert_tokens_to_ids(
+                    mask_lm_tokens)
+                masked_lm_ids = tokenizer.convert_tokens_to_ids(masked_lm_labels)
+
+            input_mask, tokens, segment_ids, target = create_mask_and_padding(
+                tokens, segment_ids, target, params.max_seq_len, is_seq)
+
+            input_ids = tokenizer.convert_tokens_to_ids(tokens)
+
+            if use_label_mask:
+                # label of [CLS] and [SEP] is always counted
+                if window_label_mask is None:
+                    label_mask = copy(input_mask)
+                else:
+                    label_mask = [1] + window_label_mask + [1]
+                    label_mask += [0] * (params.max_seq_len - len(label_mask))
+
+            if isinstance(target, list):
+                label_id = label_encoder.transform(target).tolist()
+                label_id = [np.int32(i) for i in label_id]
             else:
-                yield {
+                label_id = label_encoder.transform([target]).tolist()[0]
+                label_id = np.int32(label_id)
+
+            assert len(input_ids) == params.max_seq_len
+            assert len(input_mask) == params.max_seq_len
+            assert len(segment_ids) == params.max_seq_len, segment_ids
+            if is_seq:
+                assert len(label_id) == params.max_seq_len
+
+            if ex_index < 5:
+                tf.logging.debug("*** Example ***")
+                tf.logging.debug("tokens: %s" % " ".join(
+                    [printable_text(x) for x in tokens]))
+                tf.logging.debug("input_ids: %s" %
+                                 " ".join([str(x) for x in input_ids]))
+                tf.logging.debug("input_mask: %s" %
+                                 " ".join([str(x) for x in input_mask]))
+                tf.logging.debug("segment_ids: %s" %
+                                 " ".join([str(x) for x in segment_ids]))
+                if is_seq:
+                    tf.logging.debug("%s_label_ids: %s" %
+                                     (problem, " ".join([str(x) for x in label_id])))
+                else:
+                    tf.logging.debug("%s_label_ids: %s" %
+                                     (problem, str(label_id)))
+                if params.augument_mask_lm:
+                    tf.logging.debug("mask lm tokens: %s" % " ".join(
+                        [printable_text(x) for x in mask_lm_tokens]))
+                    tf.logging.debug("mask lm input_ids: %s" %
+                                     " ".join([str(x) for x in mask_lm_input_ids]))
+                    tf.logging.debug("mask lm label ids: %s" %
+                                     " ".join([str(x) for x in masked_lm_ids]))
+                    tf.logging.debug("mask lm position: %s" %
+                                     " ".join([str(x) for x in masked_lm_positions]))
+
+            if not params.augument_mask_lm:
+                instance = {
                     'input_ids': input_ids,
                     'input_mask': input_mask,
                     'segment_ids': segment_ids,
-                    '%s_label_ids' % problem: label_id,
-                    "masked_lm_positions": np.zeros_like(masked_lm_positions),
-                    "masked_lm_ids": np.zeros_like(masked_lm_ids),
-                    "masked_lm_weights": np.zeros_like(masked_lm_weights),
+                    '%s_label_ids' % problem: label_id
                 }
+            else:
+                if random.uniform(0, 1) <= params.augument_rate:
+                    instance = {
+                        'input_ids': mask_lm_input_ids,
+                        'input_mask': input_mask,
+                        'segment_ids': segment_ids,
+                        '%s_label_ids' % problem: label_id,
+                        "masked_lm_positions": masked_lm_positions,
+                        "masked_lm_ids": masked_lm_ids,
+                        "masked_lm_weights": masked_lm_weights,
+                    }
+                else:
+                    instance = {
+                        'input_ids': input_ids,
+                        'input_mask': input_mask,
+                        'segment_ids': segment_ids,
+                        '%s_label_ids' % problem: label_id,
+                        "masked_lm_positions": np.zeros_like(masked_lm_positions),
+                        "masked_lm_ids": np.zeros_like(masked_lm_ids),
+                        "masked_lm_weights": np.zeros_like(masked_lm_weights),
+                    }
+            if use_label_mask:
+                instance['%s_label_mask' % problem] = label_mask
+            yield instance
 
 
 def create_pretraining_generator(problem,
@@ -553,11 +659,35 @@ def create_generator(params, mode, epoch):
             return [0]*params.max_seq_len
     dummy_label_dict = {problem+'_label_ids': _create_dummpy_label(
         params.problem_type[problem]) for problem in problem_list if params.problem_type[problem] != 'pretrain'}
+    if params.train_window_stride:
+        dummy_label_dict.update({
+            problem+'_label_mask': [0]*params.max_seq_len
+            for problem in problem_list if params.problem_type[problem] == 'seq_tag'})
 
     # init gen
     gen_dict = {problem: params.read_data_fn[problem](params, mode)
                 for problem in problem_list}
 
+    # teacher outputs for offline distillation, keyed by the
+    # index of example yielded by problem generator
+    teacher_store_dict = {}
+    if params.use_teacher_logits_store and mode == 'train':
+        if params.train_window_stride:
+            raise ValueError(
+                'Teacher logits store is indexed by example, '
+                'it can not be used with train_window_stride')
+        teacher_store_dict = {
+            problem: TeacherLogitsStore(params.teacher_logits_dir, problem)
+            for problem in problem_list
+            if params.problem_type[problem] == 'seq_tag'}
+        # shapes of teacher features are declared from params, see
+        # train_eval_input_fn
+        for problem, store in teacher_store_dict.items():
+            store.check_shape(
+                params.max_seq_len, params.teacher_logits_top_k,
+                params.num_classes[problem])
+    example_ind_dict = {problem: 0 for problem in problem_list}
+
     while gen_dict:
         # sample problem to train
         if len(problem_chunk) > 1:
@@ -595,6 +725,7 @@ def create_generator(params, mode, epoch):
                 if mode == 'train':
                     gen_dict[problem] = params.read_data_fn[problem](
                         params, mode)
+                    example_ind_dict[problem] = 0
                     instance = next(gen_dict[problem])
                 else:
                     del gen_dict[problem]
@@ -602,6 +733,11 @@ def create_generator(params, mode, epoch):
             except KeyError:
                 continue
 
+            if problem in teacher_store_dict:
+                instance.update(teacher_store_dict[problem].get_features(
+                    example_ind_dict[problem]))
+            example_ind_dict[problem] += 1
+
             base_dict.update(instance)
             if base_input is None:
                 base_input = instance['input_ids']
@@ -616,6 +752,9 @@ def create_generator(params, mode, epoch):
         for dummy_problem in dummy_label_dict:
             if dummy_problem not in base_dict:
                 base_dict[dummy_problem] = dummy_label_dict[dummy_problem]
+        for problem, teacher_store in teacher_store_dict.items():
+            if problem not in current_problem_chunk:
+                base_dict.update(teacher_store.get_dummy_features())
         # add loss multipliers
         base_dict.update(loss_multiplier)
         yield base_dict
@@ -0,0 +1,216 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# score used for forbidden transitions, finite to avoid inf - inf
+NEG_INF = -1e30
+
+
+def _split_label(label):
+    """Split label into (prefix, entity type)
+
+    Example:
+        'B-LOC' -> ('B', 'LOC')
+        'b' -> ('B', '')
+        'O' -> (None, '')
+    """
+    label = str(label)
+    if '-' in label:
+        prefix, ent_type = label.split('-', 1)
+        return prefix.upper(), ent_type
+    if label.upper() in ['B', 'I', 'M', 'E', 'S']:
+        return label.upper(), ''
+    return None, ''
+
+
+def create_transition_mask(label_encoder, scheme='BIO'):
+    """Create allowed transition mask from label encoder
+
+    Labels without a scheme prefix, like 'O' and '[PAD]', are treated as
+    outside of any chunk. '[PAD]' can always be transfered to since [CLS]
+    and [SEP] are labeled as '[PAD]'.
+
+    Arguments:
+        label_encoder {LabelEncoder} -- label encoder of the problem
+
+    Keyword Arguments:
+        scheme {str} -- 'BIO' or 'BMES' (default: {'BIO'})
+
+    Returns:
+        tuple -- (transition_mask, start_mask)
+            transition_mask: bool array, [num_classes, num_classes],
+                transition_mask[i, j] is True if tag i -> tag j is allowed
+            start_mask: bool array, [num_classes], allowed first tags
+    """
+    scheme = scheme.upper()
+    if scheme not in ['BIO', 'BMES']:
+        raise ValueError('Unknown tagging scheme: %s' % scheme)
+
+    num_classes = len(label_encoder.decode_dict)
+    split_labels = [_split_label(label_encoder.decode_dict[i])
+                    for i in range(num_classes)]
+
+    def allowed(prev, cur):
+        prev_prefix, prev_type = prev
+        cur_prefix, cur_type = cur
+        if scheme == 'BIO':
+            if cur_prefix == 'I':
+                return prev_prefix in ['B', 'I'] and prev_type == cur_type
+            return True
+        else:
+            prev_open = prev_prefix in ['B', 'M']
+            if cur_prefix in ['M', 'E']:
+                return prev_open and prev_type == cur_type
+            return not prev_open
+
+    transition_mask = np.ones([num_classes, num_classes], dtype=np.bool_)
+    start_mask = np.ones([num_classes], dtype=np.bool_)
+    for cur_ind, cur in enumerate(split_labels):
+        if label_encoder.decode_dict[cur_ind] == '[PAD]':
+            continue
+        start_mask[cur_ind] = allowed((None, ''), cur)
+        for prev_ind, prev in enumerate(split_labels):
+            transition_mask[prev_ind, cur_ind] = allowed(prev, cur)
+    return transition_mask, start_mask
+
+
+def viterbi_decode(logits,
+                   transition_params,
+                   seq_length,
+                   n_best=1,
+                   transition_mask=None,
+                   start_mask=None):
+    """Batched viterbi decoding in numpy
+
+    Same as tf.contrib.crf.crf_decode, but decodes the whole batch with
+    vectorized ops and optionally returns the n best paths.
+
+    Arguments:
+        logits {np.ndarray} -- emission logits, [batch_size, max_seq_len, num_tags]
+        transition_params {np.ndarray} -- [num_tags, num_tags]
+        seq_length {np.ndarray} -- [batch_size]
+
+    Keyword Arguments:
+        n_best {int} -- number of paths to return (default: {1})
+        transition_mask {np.ndarray} -- bool, allowed transitions (default: {None})
+        start_mask {np.ndarray} -- bool, allowed first tags (default: {None})
+
+    Returns:
+        tuple -- (tags, scores)
+            if n_best == 1, tags: [batch_size, max_seq_len], scores: [batch_size]
+            else, tags: [batch_size, n_best, max_seq_len], scores: [batch_size, n_best]
+            tags after seq_length are 0.
+    """
+    logits = np.asarray(logits, dtype=np.float32)
+    transition_params = np.asarray(transition_params, dtype=np.float32)
+    seq_length = np.asarray(seq_length)
+    batch_size, max_seq_len, num_tags = logits.shape
+    k = n_best
+
+    if transition_mask is not None:
+        transition_params = np.where(
+            transition_mask, transition_params, NEG_INF).astype(np.float32)
+
+    # score: [batch_size, num_tags, k], score of k best paths ending with tag
+    score = np.full([batch_size, num_tags, k], NEG_INF, dtype=np.float32)
+    score[:, :, 0] = logits[:, 0, :]
+    if start_mask is not None:
+        score[:, ~start_mask, 0] = NEG_INF
+
+    # back pointers, flattened index of (prev_tag, prev_k)
+    backpointers = np.zeros(
+        [batch_size, max_seq_len, num_tags, k], dtype=np.int32)
+    identity_pointer = np.arange(num_tags*k, dtype=np.int32).reshape(
+        [1, num_tags, k])
+
+    for t in range(1, max_seq_len):
+        # [batch_size, prev_tag, cur_tag, k] -> [batch_size, cur_tag, prev_tag*k]
+        candidate = score[:, :, None, :] + transition_params[None, :, :, None]
+        candidate = candidate.transpose([0, 2, 1, 3]).reshape(
+            [batch_size, num_tags, num_tags*k])
+        if k == 1:
+            pointer = np.argmax(candidate, axis=-1)[..., None]
+        else:
+            pointer = np.argpartition(-candidate, k-1, axis=-1)[..., :k]
+            pointer_score = np.take_along_axis(candidate, pointer, axis=-1)
+            pointer = np.take_along_axis(
+                pointer, np.argsort(-pointer_score, axis=-1), axis=-1)
+        new_score = np.take_along_axis(
+            candidate, pointer, axis=-1) + logits[:, t, :, None]
+
+        # keep finished sequences unchanged
+        active = (t < seq_length)[:, None, None]
+        score = np.where(active, new_score, score)
+        backpointers[:, t] = np.where(active, pointer, identity_pointer)
+
+    # pick n best among all (last_tag, k)
+    flat_score = score.reshape([batch_size, num_tags*k])
+    best = np.argsort(-flat_score, axis=-1)[:, :n_best]
+    best_score = np.take_along_axis(flat_score, best, axis=-1)
+
+    tags = np.zeros([batch_size, n_best, max_seq_len], dtype=np.int32)
+    batch_ind = np.arange(batch_size)[:, None]
+    tag, path_k = best // k, best % k
+    tags[:, :, max_seq_len-1] = tag
+    for t in range(max_seq_len-1, 0, -1):
+        pointer = backpointers[batch_ind, t, tag, path_k]
+        tag, path_k = pointer // k, pointer % k
+        tags[:, :, t-1] = tag
+
+    positions = np.arange(max_seq_len)[None, None, :]
+    tags = np.where(positions < seq_length[:, None, None], tags, 0)
+
+    if n_best == 1:
+        return tags[:, 0, :], best_score[:, 0]
+    return tags, best_score
+
+
+class ViterbiDecoder():
+    """Viterbi decoder that splits a batch across a thread pool.
+
+    Each chunk is decoded with viterbi_decode, numpy releases the GIL for
+    the heavy array ops so chunks run in parallel and cost grows linearly
+    with batch size.
+    """
+
+    def __init__(self,
+                 transition_params,
+                 transition_mask=None,
+                 start_mask=None,
+                 num_threads=1,
+                 chunk_size=64):
+        self.transition_params = np.asarray(
+            transition_params, dtype=np.float32)
+        self.transition_mask = transition_mask
+        self.start_mask = start_mask
+        self.chunk_size = chunk_size
+        self.num_threads = num_threads
+        if num_threads > 1:
+            self.executor = ThreadPoolExecutor(max_workers=num_threads)
+        else:
+            self.executor = None
+
+    def _decode_chunk(self, logits, seq_length, n_best):
+        return viterbi_decode(logits,
+                              self.transition_params,
+                              seq_length,
+                              n_best=n_best,
+                              transition_mask=self.transition_mask,
+                              start_mask=self.start_mask)
+
+    def decode(self, logits, seq_length, n_best=1):
+        """Decode a batch, see viterbi_decode for return values"""
+        logits = np.asarray(logits, dtype=np.float32)
+        seq_length = np.asarray(seq_length)
+        chunk_starts = range(0, logits.shape[0], self.chunk_size)
+        chunks = [(logits[s:s+self.chunk_size],
+                   seq_length[s:s+self.chunk_size],
+                   n_best) for s in chunk_starts]
+        if self.executor is None or len(chunks) == 1:
+            results = [self._decode_chunk(*c) for c in chunks]
+        else:
+            results = list(self.executor.map(
+                lambda c: self._decode_chunk(*c), chunks))
+        tags = np.concatenate([r[0] for r in results], axis=0)
+        scores = np.concatenate([r[1] for r in results], axis=0)
+        return tags, scores
@@ -0,0 +1,51 @@
+import contextlib
+
+import tensorflow as tf
+
+# ops left out of XLA clusters. Output shapes of these depend on input
+# values, e.g. Where of boolean_mask, or they build the while loops and
+# conds of crf log likelihood and crf_decode
+FENCED_OP_TYPES = set([
+    'Where',
+    'Unique',
+    'ListDiff',
+    'DynamicPartition',
+    'DynamicStitch',
+    'Bincount',
+    'Enter',
+    'Exit',
+    'Merge',
+    'Switch',
+    'NextIteration',
+    'LoopCond',
+    'ControlTrigger',
+    'PyFunc',
+    'PyFuncStateless'
+])
+
+FENCED_OP_PREFIXES = ('TensorArray', 'Stack')
+
+
+def is_compilable(node_def):
+    """False for ops fenced off XLA, see FENCED_OP_TYPES"""
+    return node_def.op not in FENCED_OP_TYPES and \
+        not node_def.op.startswith(FENCED_OP_PREFIXES)
+
+
+@contextlib.contextmanager
+def xla_jit_scope(enabled=True):
+    """Mark ops created in this scope for XLA JIT compilation, except
+    ops of is_compilable. Gradients of marked ops are marked as well.
+
+    Ops after a fenced op are still compiled. If their shapes change
+    with values, e.g. the number of records kept by boolean_mask,
+    a cluster is compiled once for each distinct shape.
+
+    Keyword Arguments:
+        enabled {bool} -- if False, this scope does nothing (default: {True})
+    """
+    if not enabled:
+        yield
+        return
+    with tf.contrib.compiler.jit.experimental_jit_scope(compile_ops=is_compilable):
+        yield
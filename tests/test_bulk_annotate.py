@@ -0,0 +1,92 @@
+import json
+
+import pytest
+
+pytest.importorskip('tensorflow')
+
+from src.bulk_annotate import annotate_shard, get_shard_path, load_progress, merge_shards  # noqa: E402
+
+
+class Interrupted(Exception):
+    pass
+
+
+class CountingAnnotateFn():
+    """Upper case texts, raise Interrupted after max_calls calls"""
+
+    def __init__(self, max_calls=None):
+        self.max_calls = max_calls
+        self.call_list = []
+
+    def __call__(self, text_list):
+        if self.max_calls is not None and len(self.call_list) == self.max_calls:
+            raise Interrupted()
+        self.call_list.append(list(text_list))
+        return [text.upper() for text in text_list]
+
+
+def write_input(tmp_path, lines):
+    input_path = tmp_path / 'input.txt'
+    input_path.write_text(''.join(line + '\n' for line in lines), encoding='utf8')
+    return str(input_path)
+
+
+def read_jsonl(path):
+    with open(path, 'r', encoding='utf8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_annotate_shard_writes_jsonl(tmp_path):
+    input_path = write_input(tmp_path, ['ab', '中文', 'cd'])
+    output_path = str(tmp_path / 'output.jsonl')
+    annotate_fn = CountingAnnotateFn()
+    shard_path = annotate_shard(annotate_fn, input_path, output_path, chunk_size=2)
+    assert shard_path == get_shard_path(output_path, 0, 1)
+    assert read_jsonl(shard_path) == [
+        {'line': 0, 'result': 'AB'},
+        {'line': 1, 'result': '中文'},
+        {'line': 2, 'result': 'CD'}]
+    assert annotate_fn.call_list == [['ab', '中文'], ['cd']]
+    assert load_progress(shard_path + '.progress')['num_lines'] == 3
+
+
+def test_resume_after_truncated_chunk(tmp_path):
+    lines = ['line%d' % ind for ind in range(7)]
+    input_path = write_input(tmp_path, lines)
+    output_path = str(tmp_path / 'output.jsonl')
+    expected = [{'line': ind, 'result': line.upper()} for ind, line in enumerate(lines)]
+
+    with pytest.raises(Interrupted):
+        annotate_shard(CountingAnnotateFn(max_calls=2), input_path, output_path,
+                       chunk_size=3)
+    shard_path = get_shard_path(output_path, 0, 1)
+    # a chunk cut off while written after the last saved progress
+    with open(shard_path, 'ab') as f:
+        f.write(b'{"line": 6, "res')
+
+    annotate_fn = CountingAnnotateFn()
+    annotate_shard(annotate_fn, input_path, output_path, chunk_size=3)
+    assert annotate_fn.call_list == [['line6']]
+    assert read_jsonl(shard_path) == expected
+
+    # a finished shard is not annotated again
+    annotate_fn = CountingAnnotateFn()
+    annotate_shard(annotate_fn, input_path, output_path, chunk_size=3)
+    assert annotate_fn.call_list == []
+    assert read_jsonl(shard_path) == expected
+
+
+def test_merge_shards_in_line_order(tmp_path):
+    lines = ['line%d' % ind for ind in range(10)]
+    input_path = write_input(tmp_path, lines)
+    output_path = str(tmp_path / 'output.jsonl')
+    num_shards = 3
+    for shard_index in range(num_shards):
+        annotate_shard(CountingAnnotateFn(), input_path, output_path,
+                       shard_index=shard_index, num_shards=num_shards, chunk_size=2)
+        shard_lines = [x['line'] for x in read_jsonl(
+            get_shard_path(output_path, shard_index, num_shards))]
+        assert shard_lines == list(range(shard_index, len(lines), num_shards))
+    merge_shards(output_path, num_shards)
+    assert read_jsonl(output_path) == [
+        {'line': ind, 'result': line.upper()} for ind, line in enumerate(lines)]
@@ -0,0 +1,89 @@
+from src.cache import LRUCache, cached_map
+
+
+class CountingFn():
+    """Upper case texts, recording every input list it is called with"""
+
+    def __init__(self):
+        self.call_list = []
+
+    def __call__(self, input_list):
+        self.call_list.append(list(input_list))
+        return [x.upper() for x in input_list]
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_size=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert len(cache) == 2
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.evictions == 1
+
+
+def test_lru_put_existing_key_does_not_evict():
+    cache = LRUCache(max_size=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.put('a', 10)
+    assert cache.evictions == 0
+    cache.put('c', 3)
+    assert cache.get('a') == 10
+    assert cache.get('b') is None
+
+
+def test_lru_metrics():
+    cache = LRUCache(max_size=10)
+    cache.put('a', 1)
+    cache.get('a')
+    cache.get('a')
+    cache.get('b')
+    metrics = cache.metrics()
+    assert metrics['size'] == 1
+    assert metrics['hits'] == 2
+    assert metrics['misses'] == 1
+    assert abs(metrics['hit_rate'] - 2 / 3) < 1e-9
+
+
+def test_cached_map_dedups_within_batch():
+    fn = CountingFn()
+    result = cached_map(fn, ['a', 'b', 'a', 'c', 'b'])
+    assert result == ['A', 'B', 'A', 'C', 'B']
+    assert fn.call_list == [['a', 'b', 'c']]
+
+
+def test_cached_map_skips_cached_keys():
+    fn = CountingFn()
+    cache = LRUCache(max_size=10)
+    assert cached_map(fn, ['a', 'b'], cache=cache) == ['A', 'B']
+    assert cached_map(fn, ['b', 'c', 'a', 'c'], cache=cache) == ['B', 'C', 'A', 'C']
+    assert fn.call_list == [['a', 'b'], ['c']]
+    assert cache.hits == 2
+    assert cache.num_calls == 2
+
+
+def test_cached_map_all_cached_does_not_call_fn():
+    fn = CountingFn()
+    cache = LRUCache(max_size=10)
+    cached_map(fn, ['a'], cache=cache)
+    assert cached_map(fn, ['a', 'a'], cache=cache) == ['A', 'A']
+    assert fn.call_list == [['a']]
+
+
+def test_cached_map_key_fn():
+    fn = CountingFn()
+    result = cached_map(fn, [' a', 'a ', 'b'], key_fn=str.strip)
+    assert result == [' A', ' A', 'B']
+    assert fn.call_list == [[' a', 'b']]
+
+
+def test_cached_map_after_eviction_computes_again():
+    fn = CountingFn()
+    cache = LRUCache(max_size=1)
+    cached_map(fn, ['a', 'b'], cache=cache)
+    assert cached_map(fn, ['a'], cache=cache) == ['A']
+    assert fn.call_list == [['a', 'b'], ['a']]
@@ -0,0 +1,171 @@
+import numpy as np
+
+from src.postprocess import CWSDecoder, NERDecoder
+
+SPECIAL_TOKENS = ['[PAD]', '[UNK]', '[CLS]', '[SEP]']
+CHARS = list('abcdef中文字')
+
+
+class FakeLabelEncoder():
+    def __init__(self, labels):
+        self.decode_dict = dict(enumerate(labels))
+        self.encode_dict = {label: ind for ind, label in self.decode_dict.items()}
+
+
+class FakeTokenizer():
+    def __init__(self):
+        self.inv_vocab = dict(enumerate(SPECIAL_TOKENS + CHARS))
+        self.vocab = {token: ind for ind, token in self.inv_vocab.items()}
+
+
+NER_LABEL_ENCODER = FakeLabelEncoder(['[PAD]', 'B-LOC', 'I-LOC', 'B-PER', 'I-PER', 'O'])
+CWS_LABEL_ENCODER = FakeLabelEncoder(['[PAD]', 'b', 'm', 'e', 's'])
+TOKENIZER = FakeTokenizer()
+
+
+def strip_special(p, problem, label_encoder, tokenizer):
+    tokens = [tokenizer.inv_vocab[ind] for ind in p['input_ids']]
+    labels = [label_encoder.decode_dict[ind] for ind in p[problem]]
+    return zip(*[(token, label) for token, label in zip(tokens, labels)
+                 if token not in ['[PAD]', '[CLS]', '[SEP]']])
+
+
+def reference_ner_decode(pred_list, label_encoder, tokenizer):
+    """Per example BIO merge, as done before NERDecoder"""
+    result_list = []
+    for p in pred_list:
+        merged_tokens, merged_labels = [], []
+        for token, label in zip(*strip_special(p, 'NER', label_encoder, tokenizer)):
+            if label == 'O' or label[0] == 'B':
+                merged_tokens.append(token)
+                merged_labels.append(label if label == 'O' else label[2:])
+            else:
+                merged_tokens[-1] += token
+        result_list.append([(ent, ent_type) for ent, ent_type in zip(
+            merged_tokens, merged_labels) if ent_type != 'O'])
+    return result_list
+
+
+def reference_cws_decode(pred_list, label_encoder, tokenizer):
+    """Per example BMES merge, as done before CWSDecoder"""
+    result_list = []
+    for p in pred_list:
+        output_str = ''
+        for char, char_label in zip(*strip_special(p, 'CWS', label_encoder, tokenizer)):
+            output_str += char + ' ' if char_label in ['s', 'e'] else char
+        result_list.append(output_str)
+    return result_list
+
+
+def random_predictions(problem, label_encoder, num_examples, max_seq_len, rng):
+    """Padded predictions of random chars and labels, without [PAD]
+    labels in text and without I right after [CLS]"""
+    label_ids = [ind for ind, label in label_encoder.decode_dict.items()
+                 if label != '[PAD]']
+    char_ids = [TOKENIZER.vocab[char] for char in CHARS]
+    pred_list, doc_list = [], []
+    for ind in range(num_examples):
+        # an empty text as well
+        length = 0 if ind == 0 else rng.randint(1, max_seq_len - 1)
+        input_ids = np.zeros(max_seq_len, dtype=np.int64)
+        input_ids[0] = TOKENIZER.vocab['[CLS]']
+        input_ids[1:1+length] = rng.choice(char_ids, size=length)
+        input_ids[1+length] = TOKENIZER.vocab['[SEP]']
+        labels = rng.choice(label_ids, size=max_seq_len)
+        if label_encoder.decode_dict[labels[1]].startswith('I-'):
+            labels[1] = label_encoder.encode_dict['O']
+        pred_list.append({'input_ids': input_ids, problem: labels})
+        doc_list.append(''.join(TOKENIZER.inv_vocab[i] for i in input_ids[1:1+length]))
+    return pred_list, doc_list
+
+
+def make_prediction(doc, char_offsets, labels, label_encoder, max_seq_len=16):
+    """Prediction of doc with text tokens at char_offsets"""
+    input_ids = np.zeros(max_seq_len, dtype=np.int64)
+    input_ids[0] = TOKENIZER.vocab['[CLS]']
+    for ind, offset in enumerate(char_offsets):
+        input_ids[1+ind] = TOKENIZER.vocab.get(doc[offset].lower(), TOKENIZER.vocab['[UNK]'])
+    input_ids[1+len(char_offsets)] = TOKENIZER.vocab['[SEP]']
+    label_ids = np.zeros(max_seq_len, dtype=np.int64)
+    label_ids[1:1+len(labels)] = [label_encoder.encode_dict[label] for label in labels]
+    return {'input_ids': input_ids,
+            'char_offsets': np.array(char_offsets, dtype=np.int64),
+            'label_ids': label_ids}
+
+
+def test_ner_matches_reference():
+    rng = np.random.RandomState(0)
+    pred_list, doc_list = random_predictions('NER', NER_LABEL_ENCODER, 50, 12, rng)
+    decoder = NERDecoder(NER_LABEL_ENCODER, TOKENIZER)
+    assert decoder.decode(pred_list, 'NER', doc_list) == \
+        reference_ner_decode(pred_list, NER_LABEL_ENCODER, TOKENIZER)
+
+
+def test_cws_matches_reference():
+    rng = np.random.RandomState(1)
+    pred_list, doc_list = random_predictions('CWS', CWS_LABEL_ENCODER, 50, 12, rng)
+    decoder = CWSDecoder(CWS_LABEL_ENCODER, TOKENIZER)
+    assert decoder.decode(pred_list, 'CWS', doc_list) == \
+        reference_cws_decode(pred_list, CWS_LABEL_ENCODER, TOKENIZER)
+
+
+def test_empty_batch():
+    assert NERDecoder(NER_LABEL_ENCODER, TOKENIZER).decode([], 'NER', []) == []
+    assert CWSDecoder(CWS_LABEL_ENCODER, TOKENIZER).decode([], 'CWS', []) == []
+
+
+def test_batch_without_text_tokens():
+    rng = np.random.RandomState(2)
+    pred_list, doc_list = random_predictions('CWS', CWS_LABEL_ENCODER, 1, 12, rng)
+    p = pred_list[0]
+    p['NER'] = p['CWS']
+    assert NERDecoder(NER_LABEL_ENCODER, TOKENIZER).decode([p, p], 'NER', ['', '']) == [[], []]
+    assert CWSDecoder(CWS_LABEL_ENCODER, TOKENIZER).decode([p, p], 'CWS', ['', '']) == ['', '']
+    p['char_offsets'] = np.zeros([0], dtype=np.int64)
+    assert CWSDecoder(CWS_LABEL_ENCODER, TOKENIZER).decode(
+        [p], 'CWS', [''], with_offsets=True) == [[]]
+
+
+def test_ner_extract_ent_false_keeps_outside_segments():
+    doc = 'ab中文c'
+    p = make_prediction(doc, [0, 1, 2, 3, 4], ['O', 'B-PER', 'I-PER', 'O', 'B-LOC'],
+                        NER_LABEL_ENCODER)
+    p['NER'] = p.pop('label_ids')
+    del p['char_offsets']
+    result = NERDecoder(NER_LABEL_ENCODER, TOKENIZER).decode(
+        [p], 'NER', [doc], extract_ent=False)
+    assert result == [[('a', 'O'), ('b中', 'PER'), ('文', 'O'), ('c', 'LOC')]]
+
+
+def test_ner_char_offsets():
+    # spaces are not tokenized, upper case chars are kept from doc
+    doc = 'A b 中文 c'
+    p = make_prediction(doc, [0, 2, 4, 5, 7], ['B-PER', 'I-PER', 'O', 'B-LOC', 'I-LOC'],
+                        NER_LABEL_ENCODER)
+    p['NER'] = p.pop('label_ids')
+    decoder = NERDecoder(NER_LABEL_ENCODER, TOKENIZER)
+    assert decoder.decode([p], 'NER', [doc]) == [[('Ab', 'PER'), ('文c', 'LOC')]]
+    result = decoder.decode([p], 'NER', [doc], with_offsets=True)
+    assert result == [[('Ab', 'PER', 0, 3), ('文c', 'LOC', 5, 8)]]
+    for _, _, start, end in result[0]:
+        assert doc[start:end].replace(' ', '') in ['Ab', '文c']
+
+
+def test_cws_char_offsets():
+    doc = '中文 字Ab'
+    p = make_prediction(doc, [0, 1, 3, 4, 5], ['b', 'e', 's', 'b', 'e'], CWS_LABEL_ENCODER)
+    p['CWS'] = p.pop('label_ids')
+    decoder = CWSDecoder(CWS_LABEL_ENCODER, TOKENIZER)
+    assert decoder.decode([p], 'CWS', [doc]) == ['中文 字 Ab ']
+    assert decoder.decode([p], 'CWS', [doc], with_offsets=True) == [
+        [('中文', 0, 2), ('字', 3, 4), ('Ab', 4, 6)]]
+
+
+def test_cws_unfinished_word_ends_at_last_token():
+    doc = 'abc'
+    p = make_prediction(doc, [0, 1, 2], ['s', 'b', 'm'], CWS_LABEL_ENCODER)
+    p['CWS'] = p.pop('label_ids')
+    decoder = CWSDecoder(CWS_LABEL_ENCODER, TOKENIZER)
+    assert decoder.decode([p, p], 'CWS', [doc, doc]) == ['a bc', 'a bc']
+    assert decoder.decode([p], 'CWS', [doc], with_offsets=True) == [
+        [('a', 0, 1), ('bc', 1, 3)]]
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+from src.teacher_store import TeacherLogitsStore
+
+
+def softmax(x):
+    e = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return e / np.sum(e, axis=-1, keepdims=True)
+
+
+def write_store(store_dir, logits, tags, top_k, batch_size=3):
+    num_examples, max_seq_len, num_classes = logits.shape
+    store = TeacherLogitsStore.create(
+        store_dir, 'NER', num_examples, max_seq_len, top_k, num_classes)
+    for start in range(0, num_examples, batch_size):
+        store.write(start, logits[start:start+batch_size], tags[start:start+batch_size])
+    store.flush()
+
+
+def random_outputs(rng, num_examples=7, max_seq_len=5, num_classes=6):
+    logits = (rng.randn(num_examples, max_seq_len, num_classes) * 3).astype(np.float32)
+    tags = rng.randint(0, num_classes, size=[num_examples, max_seq_len])
+    return logits, tags
+
+
+def test_round_trip(tmp_path):
+    rng = np.random.RandomState(0)
+    logits, tags = random_outputs(rng)
+    top_k = 3
+    write_store(str(tmp_path), logits, tags, top_k)
+
+    store = TeacherLogitsStore(str(tmp_path), 'NER')
+    assert store.num_examples == logits.shape[0]
+    for index in range(store.num_examples):
+        topk_ids, topk_logits, read_tags = store.read(index)
+        assert topk_ids.dtype == np.int32 and read_tags.dtype == np.int32
+        assert topk_logits.shape == (logits.shape[1], top_k)
+        np.testing.assert_array_equal(
+            topk_ids, np.argsort(-logits[index], axis=-1)[:, :top_k])
+        np.testing.assert_array_equal(read_tags, tags[index])
+        # relative to the max logit of token
+        assert (topk_logits <= 0).all()
+        np.testing.assert_array_equal(topk_logits[:, 0], 0)
+
+        original = np.take_along_axis(logits[index], topk_ids, axis=-1)
+        np.testing.assert_allclose(
+            topk_logits, original - original[:, :1], atol=0.05)
+        np.testing.assert_allclose(
+            softmax(topk_logits), softmax(original), atol=1e-2)
+
+
+def test_equal_logits(tmp_path):
+    logits = np.zeros([2, 3, 4], dtype=np.float32)
+    tags = np.zeros([2, 3], dtype=np.int64)
+    write_store(str(tmp_path), logits, tags, top_k=2)
+    _, topk_logits, _ = TeacherLogitsStore(str(tmp_path), 'NER').read(1)
+    np.testing.assert_array_equal(topk_logits, 0)
+
+
+def test_many_classes(tmp_path):
+    rng = np.random.RandomState(1)
+    logits, tags = random_outputs(rng, num_examples=2, num_classes=300)
+    write_store(str(tmp_path), logits, tags, top_k=4)
+    topk_ids, _, read_tags = TeacherLogitsStore(str(tmp_path), 'NER').read(1)
+    np.testing.assert_array_equal(topk_ids, np.argsort(-logits[1], axis=-1)[:, :4])
+    np.testing.assert_array_equal(read_tags, tags[1])
+
+
+def test_features(tmp_path):
+    rng = np.random.RandomState(2)
+    logits, tags = random_outputs(rng)
+    write_store(str(tmp_path), logits, tags, top_k=2)
+    store = TeacherLogitsStore(str(tmp_path), 'NER')
+
+    features = store.get_features(3)
+    topk_ids, topk_logits, read_tags = store.read(3)
+    np.testing.assert_array_equal(features['NER_teacher_topk_ids'], topk_ids)
+    np.testing.assert_array_equal(features['NER_teacher_topk_logits'], topk_logits)
+    np.testing.assert_array_equal(features['NER_teacher_tags'], read_tags)
+
+    dummy = store.get_dummy_features()
+    assert set(dummy) == set(features)
+    for key, value in dummy.items():
+        assert value.shape == features[key].shape
+        assert value.dtype == features[key].dtype
+
+    with pytest.raises(IndexError):
+        store.get_features(logits.shape[0])
+
+
+def test_top_k_larger_than_num_classes(tmp_path):
+    with pytest.raises(ValueError):
+        TeacherLogitsStore.create(str(tmp_path), 'NER', 2, 3, top_k=5, num_classes=4)
+
+
+def test_check_shape(tmp_path):
+    rng = np.random.RandomState(3)
+    logits, tags = random_outputs(rng, max_seq_len=5, num_classes=6)
+    write_store(str(tmp_path), logits, tags, top_k=2)
+    store = TeacherLogitsStore(str(tmp_path), 'NER')
+    store.check_shape(5, 2, 6)
+    store.check_shape(5, 2)
+    for max_seq_len, top_k, num_classes in [(8, 2, 6), (5, 4, 6), (5, 2, 7)]:
+        with pytest.raises(ValueError):
+            store.check_shape(max_seq_len, top_k, num_classes)
@@ -0,0 +1,116 @@
+import itertools
+
+import numpy as np
+
+from src.viterbi import NEG_INF, ViterbiDecoder, create_transition_mask, viterbi_decode
+
+
+class FakeLabelEncoder():
+    def __init__(self, labels):
+        self.decode_dict = dict(enumerate(labels))
+
+
+def brute_force(logits, transition_params, length, transition_mask=None, start_mask=None):
+    """All paths of length sorted by score, best first"""
+    num_tags = logits.shape[-1]
+    path_list = []
+    for path in itertools.product(range(num_tags), repeat=length):
+        if start_mask is not None and not start_mask[path[0]]:
+            continue
+        if transition_mask is not None and not all(
+                transition_mask[prev, cur] for prev, cur in zip(path[:-1], path[1:])):
+            continue
+        score = sum(logits[t, tag] for t, tag in enumerate(path)) + sum(
+            transition_params[prev, cur] for prev, cur in zip(path[:-1], path[1:]))
+        path_list.append((score, path))
+    return sorted(path_list, key=lambda x: -x[0])
+
+
+def random_inputs(rng, batch_size=6, max_seq_len=5, num_tags=3):
+    logits = rng.randn(batch_size, max_seq_len, num_tags).astype(np.float32)
+    transition_params = rng.randn(num_tags, num_tags).astype(np.float32)
+    seq_length = rng.randint(2, max_seq_len + 1, size=batch_size)
+    seq_length[0] = max_seq_len
+    return logits, transition_params, seq_length
+
+
+def test_best_path_matches_brute_force():
+    rng = np.random.RandomState(0)
+    logits, transition_params, seq_length = random_inputs(rng)
+    tags, scores = viterbi_decode(logits, transition_params, seq_length)
+    assert tags.shape == logits.shape[:2]
+    for ind, length in enumerate(seq_length):
+        best_score, best_path = brute_force(logits[ind], transition_params, length)[0]
+        np.testing.assert_allclose(scores[ind], best_score, rtol=1e-5)
+        assert tuple(tags[ind, :length]) == best_path
+        assert not tags[ind, length:].any()
+
+
+def test_n_best_matches_brute_force():
+    rng = np.random.RandomState(1)
+    logits, transition_params, seq_length = random_inputs(rng)
+    n_best = 4
+    tags, scores = viterbi_decode(logits, transition_params, seq_length, n_best=n_best)
+    assert tags.shape == (logits.shape[0], n_best, logits.shape[1])
+    assert scores.shape == (logits.shape[0], n_best)
+    for ind, length in enumerate(seq_length):
+        expected = brute_force(logits[ind], transition_params, length)[:n_best]
+        np.testing.assert_allclose(
+            scores[ind], [score for score, _ in expected], rtol=1e-5)
+        assert [tuple(path[:length]) for path in tags[ind]] == \
+            [path for _, path in expected]
+        assert not tags[ind, :, length:].any()
+
+
+def test_n_best_with_transition_mask():
+    rng = np.random.RandomState(2)
+    label_encoder = FakeLabelEncoder(['[PAD]', 'B-LOC', 'I-LOC', 'O'])
+    transition_mask, start_mask = create_transition_mask(label_encoder, 'BIO')
+    logits, transition_params, seq_length = random_inputs(rng, num_tags=4)
+    # make the forbidden O -> I-LOC and start I-LOC attractive
+    logits[:, :, 2] += 3.
+    n_best = 3
+    tags, scores = viterbi_decode(
+        logits, transition_params, seq_length, n_best=n_best,
+        transition_mask=transition_mask, start_mask=start_mask)
+    for ind, length in enumerate(seq_length):
+        expected = brute_force(
+            logits[ind], transition_params, length, transition_mask, start_mask)[:n_best]
+        np.testing.assert_allclose(
+            scores[ind], [score for score, _ in expected], rtol=1e-5)
+        assert [tuple(path[:length]) for path in tags[ind]] == \
+            [path for _, path in expected]
+    assert (scores > NEG_INF / 2).all()
+
+
+def test_create_transition_mask_bio():
+    label_encoder = FakeLabelEncoder(['[PAD]', 'B-LOC', 'I-LOC', 'B-PER', 'I-PER', 'O'])
+    transition_mask, start_mask = create_transition_mask(label_encoder, 'BIO')
+    assert transition_mask[1, 2] and transition_mask[2, 2]
+    assert not transition_mask[5, 2]
+    assert not transition_mask[1, 4]
+    assert transition_mask[:, 0].all()
+    assert not start_mask[2] and not start_mask[4]
+    assert start_mask[[0, 1, 3, 5]].all()
+
+
+def test_create_transition_mask_bmes():
+    label_encoder = FakeLabelEncoder(['[PAD]', 'b', 'm', 'e', 's'])
+    transition_mask, start_mask = create_transition_mask(label_encoder, 'BMES')
+    assert transition_mask[1, 2] and transition_mask[2, 3] and transition_mask[1, 3]
+    assert not transition_mask[1, 4] and not transition_mask[1, 1]
+    assert not transition_mask[3, 2] and not transition_mask[4, 3]
+    assert start_mask[[1, 4]].all() and not start_mask[[2, 3]].any()
+
+
+def test_decoder_chunks_match_single_call():
+    rng = np.random.RandomState(3)
+    logits, transition_params, seq_length = random_inputs(rng, batch_size=23)
+    expected_tags, expected_scores = viterbi_decode(
+        logits, transition_params, seq_length, n_best=2)
+    for num_threads in [1, 3]:
+        decoder = ViterbiDecoder(
+            transition_params, num_threads=num_threads, chunk_size=5)
+        tags, scores = decoder.decode(logits, seq_length, n_best=2)
+        np.testing.assert_array_equal(tags, expected_tags)
+        np.testing.assert_allclose(scores, expected_scores)